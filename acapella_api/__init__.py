@@ -1,22 +1,81 @@
+from typing import Optional
 from urllib.parse import urlparse
 
 from .auth import AuthApi
 from .codebase import CodeBaseApi
-from .context import ApiContext
+from .compression import TrafficCounters
+from .context import ApiContext, RequestHook
+from .log_cache import LogCache
 from .logs import LoggingApi
+from .retry import RetryPolicy
 from .vm import VmApi
 
 
 class AcapellaApi:
-    def __init__(self, address: str = 'http://api.acapella.ru:5678', http_timeout: int = 2000):
+    def __init__(self,
+                 address: str = 'http://api.acapella.ru:5678',
+                 http_timeout: int = 2000,
+                 pool_connections: int = 4,
+                 pool_maxsize: int = 16,
+                 pool_block: bool = False,
+                 keep_alive: bool = True,
+                 compression: Optional[str] = None,
+                 compress_min_size: int = 1024,
+                 retry: Optional[RetryPolicy] = None,
+                 log_chunk_size: int = 64 * 1024,
+                 log_cache_dir: Optional[str] = None,
+                 log_cache_max_bytes: int = 512 * 1024 * 1024):
         if address.find('://') == -1:
             address = 'http://' + address
 
-        self.__api_ctx = ApiContext(address, http_timeout)
+        self.__api_ctx = ApiContext(address, http_timeout,
+                                    pool_connections=pool_connections,
+                                    pool_maxsize=pool_maxsize,
+                                    pool_block=pool_block,
+                                    keep_alive=keep_alive,
+                                    compression=compression,
+                                    compress_min_size=compress_min_size,
+                                    retry=retry)
         self.address = address
         self.url = urlparse(address)
 
         self.auth = AuthApi(self.__api_ctx)
         self.vm = VmApi(self.__api_ctx)
         self.codebase = CodeBaseApi(self.__api_ctx)
-        self.logs = LoggingApi(self.__api_ctx)
+        log_cache = LogCache(log_cache_dir, log_cache_max_bytes) if log_cache_dir else None
+        self.logs = LoggingApi(self.__api_ctx, chunk_size=log_chunk_size, cache=log_cache)
+
+    def set_compression(self, compression: Optional[str], min_size: int = 1024):
+        """
+        Сжатие тел запросов загрузки фрагментов, создания снапшотов и запуска транзакций.
+        :param compression: 'gzip', 'deflate', 'zstd' или `None` - без сжатия
+        :param min_size: тела меньше этого размера, байт, не сжимаются
+        """
+        self.__api_ctx.compression = compression
+        self.__api_ctx.compress_min_size = min_size
+
+    def add_request_hook(self, hook: RequestHook):
+        """
+        Обработчик, вызываемый после каждого HTTP-запроса с его `RequestRecord`
+        (эндпоинт, статус, объём, время соединения, до первого байта и полное, количество повторов).
+        Например, `acapella_api.stats.RequestStats()` собирает сводку по эндпоинтам.
+        """
+        self.__api_ctx.add_hook(hook)
+
+    def remove_request_hook(self, hook: RequestHook):
+        self.__api_ctx.remove_hook(hook)
+
+    @property
+    def traffic(self) -> TrafficCounters:
+        """Счётчики переданных байт до и после сжатия"""
+        return self.__api_ctx.traffic
+
+    def close(self):
+        """Закрытие всех соединений пула"""
+        self.__api_ctx.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,629 @@
+"""
+Асинхронный вариант API на `aiohttp` (необязательная зависимость).
+
+Модели (`TransactionParameters`, `SnapshotMeta`, `LogRef`, ...) и имена методов совпадают
+с синхронным API; все запросы идут через один пул соединений `aiohttp.ClientSession`.
+Потоки логов возвращаются асинхронными итераторами.
+"""
+import asyncio
+import base64
+import io
+import random
+import re
+import sys
+import time
+from typing import Optional, List, Set, Mapping, Iterable, AsyncIterator, Union
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .auth import UserInfo
+from .codebase import CodeBaseApi, SnapshotName, SnapshotTag, FragmentPath, ExecutorType, SnapshotMeta, \
+    NewSnapshotMeta, NewSnapshotResponse
+from .common import UserId, JsonObject, TransactionId, AccessLevel, Deadline, json_loads, json_dumps
+from .compression import TrafficCounters, compress, to_bytes
+from .context import ApiError, HttpError
+from .logs import LoggingApi, LogRef, LogScope, LogName, _LogWriter, _RAW_LOG_HEADERS
+from .vm import ExecutionTimeout, WaitCancelled, TransactionState, TransactionStartResult, \
+    TransactionParameters, TransactionStatus, TransactionInfo, TransactionResult
+
+
+class LogNotFound(Exception):
+    def __init__(self, ref: Optional[LogRef]):
+        super().__init__('log not found' + (f': {ref.logId}' if ref is not None else ''))
+        self.ref = ref
+
+
+class AsyncResponse(object):
+    """Прочитанный ответ: статус, заголовки и тело"""
+    def __init__(self, status_code: int, headers: Mapping[str, str], content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json_loads(self.content)
+
+
+class AsyncApiContext(object):
+    def __init__(self,
+                 address: str = 'http://localhost:5678',
+                 http_timeout: float = 2000,
+                 limit: int = 1000,
+                 limit_per_host: int = 0,
+                 keep_alive: bool = True,
+                 compression: Optional[str] = None,
+                 compress_min_size: int = 1024):
+        """
+        :param limit: максимальное количество соединений пула
+        :param limit_per_host: максимальное количество соединений с одним хостом, 0 - без ограничения
+        :param compression: сжатие тел запросов, отмеченных `compress=True`: 'gzip', 'deflate', 'zstd' или `None`
+        """
+        if aiohttp is None:
+            raise ImportError("asynchronous API requires the 'aiohttp' package")
+
+        self.address = address
+        self.http_timeout = http_timeout
+
+        self.user_id: UserId = "$TEST_USER"
+        self.token: str = None
+
+        self.__id_pattern = re.compile(r'^[\w\-.]+$')
+
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keep_alive = keep_alive
+        self.compression = compression
+        self.compress_min_size = compress_min_size
+        self.traffic = TrafficCounters()
+
+        self.__session = None
+
+    @property
+    def session(self) -> 'aiohttp.ClientSession':
+        """Пул соединений. Создаётся при первом запросе, внутри работающего event loop"""
+        if self.__session is None or self.__session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit,
+                                             limit_per_host=self.limit_per_host,
+                                             force_close=not self.keep_alive)
+            self.__session = aiohttp.ClientSession(connector=connector)
+        return self.__session
+
+    async def close(self) -> None:
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    def validate_id(self, id, name = "id") -> None:
+        if not self.__id_pattern.match(id):
+            raise Exception(f'invalid {name}: "{id}"')
+
+    @staticmethod
+    def raise_if_failed(response: AsyncResponse) -> None:
+        if response.status_code != 200:
+            if response.status_code == 400:
+                json = response.json()
+                raise ApiError(
+                    error_code=json['code'],
+                    msg=json['message']
+                )
+            raise HttpError(response.status_code, response.text)
+
+    def __timeout(self, timeout: Optional[float]) -> 'aiohttp.ClientTimeout':
+        # как в `requests`: таймаут соединения и ожидания очередных данных, а не всего запроса
+        timeout = self.http_timeout if timeout is None else timeout
+        return aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+
+    def __request_kwargs(self, kwargs: dict) -> dict:
+        json = kwargs.pop('json', None)
+        if json is not None:
+            kwargs['data'] = json.to_json() if isinstance(json, JsonObject) else json_dumps(json)
+
+        data = kwargs.get('data')
+        if isinstance(data, dict):
+            # `requests` пропускает поля со значением `None` и принимает байты
+            kwargs['data'] = dict((k, v.decode('utf-8') if isinstance(v, bytes) else str(v))
+                                  for k, v in data.items() if v is not None)
+        elif isinstance(data, (str, bytes)):
+            body = to_bytes(data)
+            wire = body
+            if kwargs.pop('compress', False) and self.compression and len(body) >= self.compress_min_size:
+                wire = compress(body, self.compression)
+                kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'Content-Encoding': self.compression})
+            self.traffic.add_request(len(body), len(wire))
+            kwargs['data'] = wire
+        kwargs.pop('compress', None)
+
+        if self.token:
+            # заголовок собирается вручную: параметр `auth` в новых версиях aiohttp устарел
+            credentials = base64.b64encode(f'{self.user_id}:{self.token}'.encode('utf-8')).decode('ascii')
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, Authorization='Basic ' + credentials)
+        kwargs['timeout'] = self.__timeout(kwargs.get('timeout'))
+        return kwargs
+
+    async def http_request(self, method: str, path: str, ignore_errors: bool = False, **kwargs) -> AsyncResponse:
+        assert path.startswith("/")
+        kwargs = self.__request_kwargs(kwargs)
+        async with self.session.request(method, self.address + path, **kwargs) as resp:
+            content = await resp.read()
+            response = AsyncResponse(resp.status, resp.headers, content)
+
+        content_length = response.headers.get('Content-Length')
+        self.traffic.add_response(len(content), int(content_length) if content_length else len(content))
+        if not ignore_errors:
+            self.raise_if_failed(response)
+        return response
+
+    def http_stream(self, method: str, path: str, **kwargs) -> 'aiohttp.client._RequestContextManager':
+        """Запрос с потоковым чтением тела: `async with ctx.http_stream(...) as resp`"""
+        assert path.startswith("/")
+        return self.session.request(method, self.address + path, **self.__request_kwargs(kwargs))
+
+    async def http_get(self, path: str, **kwargs) -> AsyncResponse:
+        return await self.http_request('GET', path, **kwargs)
+
+    async def http_post(self, path: str, **kwargs) -> AsyncResponse:
+        return await self.http_request('POST', path, **kwargs)
+
+    async def http_delete(self, path: str, **kwargs) -> AsyncResponse:
+        return await self.http_request('DELETE', path, **kwargs)
+
+
+class AsyncAuthApi(object):
+    def __init__(self, api_context: AsyncApiContext):
+        self._ctx = api_context
+
+    async def create_session(self, name: str, password: str, invalidate_old: bool = False, expireSec: Optional[int] = None) -> str:
+        resp = await self._ctx.http_post("/auth/login", data = {
+            'loginAndPassword': base64.b64encode((name + ':' + password).encode('utf-8')),
+            'invalidateOld': str(invalidate_old),
+            'expireSec': expireSec,
+        })
+        return resp.json()['token']
+
+    async def login(self, name: str, password: str, invalidate_old: bool = False, expireSec: Optional[int] = None):
+        self._ctx.token = await self.create_session(name, password, invalidate_old, expireSec)
+        self._ctx.user_id = name
+
+    async def logout(self):
+        if self._ctx.token is None:
+            return
+        await self._ctx.http_post("/auth/logout")
+        self._ctx.token = None
+        self._ctx.user_id = "$TEST_USER"
+
+    async def signup(self, info: UserInfo):
+        await self._ctx.http_post('/auth/signup', json=info)
+
+    @property
+    def token(self) -> str: return self._ctx.token
+    @token.setter
+    def token(self, value): self._ctx.token = value
+
+    @property
+    def user_id(self) -> UserId: return self._ctx.user_id
+    @user_id.setter
+    def user_id(self, value): self._ctx.user_id = value
+
+
+class AsyncCodeBaseApi(object):
+    def __init__(self, api_context: AsyncApiContext):
+        self._ctx = api_context
+
+    validate_sn_tag = staticmethod(CodeBaseApi.validate_sn_tag)
+    encode_fragment = staticmethod(CodeBaseApi.encode_fragment)
+
+    async def upload(self,
+                     sn_name: SnapshotName,
+                     sn_tag: SnapshotTag,
+                     path: FragmentPath,
+                     code: str,
+                     exec_types: Set[ExecutorType]):
+        await self.upload_encoded(sn_name, sn_tag, path, self.encode_fragment(code, exec_types))
+
+    async def upload_encoded(self,
+                             sn_name: SnapshotName,
+                             sn_tag: SnapshotTag,
+                             path: FragmentPath,
+                             body: Union[bytes, AsyncIterator[bytes]]):
+        self._ctx.validate_id(sn_name)
+        self.validate_sn_tag(sn_tag, optional=True)
+
+        if path.startswith("/"): path = path[1:]
+
+        await self._ctx.http_post(f'/cb/snapshots/{sn_name}/{sn_tag}/fragments/{path}', data=body, compress=True)
+
+    async def upload_file(self,
+                          sn_name: SnapshotName,
+                          sn_tag: SnapshotTag,
+                          path: FragmentPath,
+                          file_path: str,
+                          exec_types: Set[ExecutorType]):
+        """Загрузка фрагмента из файла потоком; блоки файла читаются в пуле потоков event loop"""
+        chunks = CodeBaseApi.encode_fragment_stream(file_path, exec_types)
+        loop = asyncio.get_running_loop()
+
+        async def body():
+            while True:
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+
+        await self.upload_encoded(sn_name, sn_tag, path, body())
+
+    async def get_snapshots(self, name: Optional[SnapshotName] = None, owner: Optional[UserId] = None) -> List[SnapshotMeta]:
+        if not owner:
+            owner = self._ctx.user_id
+        options = {}
+        if name:
+            options['snName'] = name
+        response = await self._ctx.http_get(f'/cb/users/{owner}/snapshots', data = options)
+        return [JsonObject.decode_from_json_dict(SnapshotMeta, sn) for sn in response.json()]
+
+    async def create_snapshot(self,
+                              name: SnapshotName,
+                              tag: Optional[SnapshotTag] = None,
+                              fragmentHashes: Optional[Mapping[FragmentPath, str]] = None
+                              ) -> NewSnapshotResponse:
+        self._ctx.validate_id(name)
+        self.validate_sn_tag(tag, optional=True)
+
+        snapshot_meta = NewSnapshotMeta(
+            name = name,
+            tag = tag,
+            removeAfterExecute = False,
+            fragmentHashes = fragmentHashes
+        )
+
+        response = await self._ctx.http_post('/cb/newSnapshot', json=snapshot_meta, compress=True)
+        json = response.json()
+        sn_json = json['snapshot']
+
+        apu_json = sn_json.get('accessPerUser')
+        access_pre_user = None if (apu_json is None) else dict((k, AccessLevel(v)) for k, v in apu_json.items())
+
+        return NewSnapshotResponse(
+            snapshot = SnapshotMeta(
+                name = sn_json['name'],
+                tag = sn_json['tag'],
+                frozen = sn_json.get('frozen'),
+                removed = sn_json.get('removed'),
+                created = sn_json.get('created'),
+                expireAt = sn_json.get('expireAt'),
+                owner = sn_json.get('owner'),
+                accessLevel = AccessLevel(sn_json.get('accessLevel')),
+                accessPerUser = access_pre_user
+            ),
+            notFound = json.get('notFound')
+        )
+
+    async def freeze_snapshot(self, name: SnapshotName, tag: SnapshotTag):
+        await self._ctx.http_post(f'/cb/snapshots/{name}/{tag}/freeze')
+
+
+class AsyncVmApi(object):
+    def __init__(self,
+                 api_context: AsyncApiContext,
+                 transaction_timeout_ms: int = 2 * 60 * 1000,
+                 long_poll_timeout_sec: float = 30.0,
+                 poll_min_interval_sec: float = 0.05,
+                 poll_max_interval_sec: float = 1.0):
+        """Параметры - как у `VmApi`"""
+        self._ctx = api_context
+        self.transaction_timeout_ms = transaction_timeout_ms
+        self.long_poll_timeout_sec = long_poll_timeout_sec
+        self.poll_min_interval_sec = poll_min_interval_sec
+        self.poll_max_interval_sec = poll_max_interval_sec
+
+    async def start_transaction(self, params: TransactionParameters) -> TransactionStartResult:
+        return await self.start_transaction_with_raw_params(params.to_json())
+
+    async def start_transaction_with_raw_params(self, tr_params_json: str) -> TransactionStartResult:
+        response = await self._ctx.http_post('/vm/start', data=tr_params_json, compress=True)
+        return TransactionStartResult(response.json()['transactionId'])
+
+    async def stop_transaction(self, tr_id: TransactionId) -> None:
+        await self._ctx.http_post('/vm/stop', data={'trId': tr_id})
+
+    @staticmethod
+    def __parse_tr_status(json: Optional[dict]) -> TransactionStatus:
+        if json is None:
+            return TransactionStatus(TransactionState.RUNNING.value)
+        return JsonObject.decode_from_json_dict(TransactionStatus, json)
+
+    async def get_transaction_status(self, tr_id: TransactionId) -> Optional[TransactionStatus]:
+        json = (await self._ctx.http_get(f'/vm/transactions/{tr_id}/status')).json()
+        if json is None:
+            return None
+        return self.__parse_tr_status(json)
+
+    async def get_transactions(self) -> List[TransactionInfo]:
+        json = (await self._ctx.http_get('/vm/transactions')).json()
+        return [JsonObject.decode_from_json_dict(TransactionInfo, tr) for tr in json]
+
+    async def remove_transaction(self, tr_id: TransactionId):
+        await self._ctx.http_delete(f'/vm/transactions/{tr_id}')
+
+    async def __wait_status(self, tr_id: TransactionId, deadline: Deadline, long_poll: bool) -> Optional[TransactionStatus]:
+        if not long_poll:
+            return await self.get_transaction_status(tr_id)
+        # бюджет мог истечь после проверки в цикле ожидания: нулевой таймаут запросу передавать нельзя
+        timeout = deadline.timeout(self.long_poll_timeout_sec)
+        if (timeout is not None) and (timeout <= 0):
+            raise ExecutionTimeout()
+        try:
+            response = await self._ctx.http_get(f'/vm/transactions/{tr_id}/wait',
+                                                timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self.__parse_tr_status(response.json())
+
+    async def wait_transaction(self,
+                               tr_id: TransactionId,
+                               deadline: Optional[Deadline] = None,
+                               cancel: Optional[asyncio.Event] = None,
+                               long_poll: bool = True) -> TransactionStatus:
+        """
+        Ожидание завершения транзакции, как `VmApi.wait_transaction`.
+        :raises ExecutionTimeout: бюджет исчерпан
+        :raises WaitCancelled: ожидание отменено через `cancel`
+        """
+        if deadline is None:
+            deadline = Deadline(self.transaction_timeout_ms / 1000.0)
+
+        interval = self.poll_min_interval_sec
+        while not deadline.expired():
+            if cancel is not None and cancel.is_set():
+                raise WaitCancelled()
+
+            started = time.monotonic()
+            status = await self.__wait_status(tr_id, deadline, long_poll)
+            if status is not None and status.state != TransactionState.RUNNING.value:
+                return status
+
+            if long_poll and (status is None or time.monotonic() - started >= self.long_poll_timeout_sec / 2):
+                interval = self.poll_min_interval_sec
+                continue
+
+            pause = deadline.timeout(random.uniform(interval / 2, interval))
+            await _sleep(pause, cancel)
+            interval = min(self.poll_max_interval_sec, interval * 2.0)
+
+        raise ExecutionTimeout()
+
+    async def __run_transaction(self, params: TransactionParameters, cancel: asyncio.Event) -> TransactionResult:
+        started = time.monotonic()
+        result = TransactionResult(params)
+        try:
+            result.transaction_id = (await self.start_transaction(params)).transaction_id
+            result.status = await self.wait_transaction(result.transaction_id, cancel=cancel)
+        except Exception as e:
+            result.error = e
+        result.latency_sec = time.monotonic() - started
+        return result
+
+    async def start_many(self,
+                         params: Iterable[TransactionParameters],
+                         max_in_flight: int = 1000,
+                         cancel: Optional[asyncio.Event] = None) -> AsyncIterator[TransactionResult]:
+        """
+        Запуск множества транзакций, как `VmApi.start_many`, но задачами одного event loop
+        вместо потоков. Результаты возвращаются в порядке завершения.
+        """
+        own_cancel = cancel is None
+        if own_cancel:
+            cancel = asyncio.Event()
+        params_iter = iter(params)
+        max_in_flight = max(1, max_in_flight)
+        in_flight = set()
+
+        def submit_next() -> bool:
+            next_params = next(params_iter, None)
+            if next_params is None:
+                return False
+            in_flight.add(asyncio.ensure_future(self.__run_transaction(next_params, cancel)))
+            return True
+
+        try:
+            while len(in_flight) < max_in_flight and submit_next():
+                pass
+            while in_flight:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    submit_next()
+                    yield task.result()
+        finally:
+            if own_cancel:
+                cancel.set()
+            for task in in_flight:
+                task.cancel()
+
+    async def get_version(self) -> str:
+        return (await self._ctx.http_get('/vm/version')).text
+
+
+class AsyncLoggingApi(object):
+    def __init__(self,
+                 api_context: AsyncApiContext,
+                 chunk_size: int = 64 * 1024,
+                 read_timeout: float = 1000.0,
+                 follow_read_timeout: float = 60.0,
+                 follow_min_interval: float = 0.1,
+                 follow_max_interval: float = 5.0):
+        """Параметры - как у `LoggingApi`"""
+        self._ctx = api_context
+        self.chunk_size = chunk_size
+        self.read_timeout = read_timeout
+        self.follow_read_timeout = follow_read_timeout
+        self.follow_min_interval = follow_min_interval
+        self.follow_max_interval = follow_max_interval
+
+    log_path = staticmethod(LoggingApi.log_path)
+
+    async def __read_stream(self, path: str, offset: int, timeout: float) -> AsyncIterator[bytes]:
+        """Блоки лога начиная с `offset`; `LogNotFound` - лога нет"""
+        headers = dict(_RAW_LOG_HEADERS, Range=f'bytes={offset}-') if offset > 0 else dict(_RAW_LOG_HEADERS)
+        async with self._ctx.http_stream('GET', path, timeout=timeout, headers=headers) as resp:
+            if resp.status == 404:
+                raise LogNotFound(None)
+            if resp.status == 416:
+                return
+            if resp.status not in (200, 206):
+                self._ctx.raise_if_failed(AsyncResponse(resp.status, resp.headers, await resp.read()))
+            skip = offset if resp.status == 200 else 0
+
+            async for chunk in resp.content.iter_chunked(self.chunk_size):
+                if skip > 0:
+                    if len(chunk) <= skip:
+                        skip -= len(chunk)
+                        continue
+                    chunk = chunk[skip:]
+                    skip = 0
+                yield chunk
+
+    async def iter_log(self, ref: LogRef) -> AsyncIterator[bytes]:
+        """
+        Содержимое лога блоками по `chunk_size` байт.
+        :raises LogNotFound: лог не найден
+        """
+        path = self.log_path(ref)
+        if path is None:
+            raise LogNotFound(ref)
+        try:
+            async for chunk in self.__read_stream(path, 0, self.read_timeout):
+                yield chunk
+        except LogNotFound:
+            raise LogNotFound(ref)
+
+    async def __is_running(self, tr_id: TransactionId) -> bool:
+        json = (await self._ctx.http_get(f'/vm/transactions/{tr_id}/status')).json()
+        return json is None or json.get('state') == TransactionState.RUNNING.value
+
+    async def follow_log(self, ref: LogRef, cancel: Optional[asyncio.Event] = None) -> AsyncIterator[bytes]:
+        """
+        Чтение лога с продолжением, как `LoggingApi.follow_log`: после обрыва соединения
+        чтение возобновляется с последнего принятого байта, лог транзакции читается до её завершения.
+        """
+        path = self.log_path(ref)
+        if path is None:
+            return
+
+        offset = 0
+        interval = self.follow_min_interval
+        finished = False
+        while not (cancel is not None and cancel.is_set()):
+            received = 0
+            found = True
+            try:
+                async for chunk in self.__read_stream(path, offset, self.follow_read_timeout):
+                    offset += len(chunk)
+                    received += len(chunk)
+                    yield chunk
+            except LogNotFound:
+                found = False
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+
+            if finished:
+                return
+
+            if received:
+                interval = self.follow_min_interval
+                continue
+
+            if ref.trId is not None and ref.scope != LogScope.USER:
+                try:
+                    finished = not await self.__is_running(ref.trId)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pass
+                if finished:
+                    continue
+            elif not found:
+                return
+
+            await _sleep(interval, cancel)
+            interval = min(self.follow_max_interval, interval * 2.0)
+
+    async def read_log(self, ref: LogRef, output: io.RawIOBase = sys.stdout, binary: bool = False) -> bool:
+        writer = _LogWriter(output, binary)
+        try:
+            async for chunk in self.iter_log(ref):
+                writer.write(chunk)
+        except LogNotFound:
+            return False
+        writer.close()
+        return True
+
+    def __ref(self, scope: LogScope, log_id: LogName, **kwargs) -> LogRef:
+        return LogRef(scope, self._ctx.user_id, log_id, **kwargs)
+
+    async def read_user_log(self, log_id: LogName, output: io.RawIOBase = sys.stdout, binary: bool = False) -> bool:
+        return await self.read_log(self.__ref(LogScope.USER, log_id), output, binary)
+
+    async def read_tr_log(self, tr_id: TransactionId, log_id: LogName, output: io.RawIOBase = sys.stdout, binary: bool = False) -> bool:
+        return await self.read_log(self.__ref(LogScope.TRANSACTION, log_id, trId=tr_id), output, binary)
+
+    async def read_fragment_log(self, tr_id: TransactionId, fr_path: FragmentPath, log_id: LogName, output: io.RawIOBase = sys.stdout, binary: bool = False) -> bool:
+        return await self.read_log(self.__ref(LogScope.FRAGMENT, log_id, trId=tr_id, frPath=fr_path), output, binary)
+
+    async def read_execution_log(self, tr_id: TransactionId, fr_path: FragmentPath, dam: str, log_id: LogName, output: io.RawIOBase = sys.stdout, binary: bool = False) -> bool:
+        return await self.read_log(self.__ref(LogScope.EXECUTION, log_id, trId=tr_id, frPath=fr_path, dam=dam), output, binary)
+
+
+async def _sleep(seconds: float, cancel: Optional[asyncio.Event]):
+    """Пауза, прерываемая событием отмены"""
+    if cancel is None:
+        await asyncio.sleep(seconds)
+        return
+    try:
+        await asyncio.wait_for(cancel.wait(), seconds)
+    except asyncio.TimeoutError:
+        pass
+
+
+class AsyncAcapellaApi:
+    def __init__(self,
+                 address: str = 'http://api.acapella.ru:5678',
+                 http_timeout: float = 2000,
+                 limit: int = 1000,
+                 limit_per_host: int = 0,
+                 keep_alive: bool = True,
+                 compression: Optional[str] = None,
+                 compress_min_size: int = 1024,
+                 log_chunk_size: int = 64 * 1024):
+        if address.find('://') == -1:
+            address = 'http://' + address
+
+        self.__api_ctx = AsyncApiContext(address, http_timeout,
+                                         limit=limit,
+                                         limit_per_host=limit_per_host,
+                                         keep_alive=keep_alive,
+                                         compression=compression,
+                                         compress_min_size=compress_min_size)
+        self.address = address
+
+        self.auth = AsyncAuthApi(self.__api_ctx)
+        self.vm = AsyncVmApi(self.__api_ctx)
+        self.codebase = AsyncCodeBaseApi(self.__api_ctx)
+        self.logs = AsyncLoggingApi(self.__api_ctx, chunk_size=log_chunk_size)
+
+    @property
+    def traffic(self) -> TrafficCounters:
+        return self.__api_ctx.traffic
+
+    async def close(self):
+        """Закрытие всех соединений пула"""
+        await self.__api_ctx.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
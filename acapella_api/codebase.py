@@ -1,7 +1,8 @@
+import json
 from enum import Enum
-from typing import Optional, Dict, Set, List, Mapping
+from typing import Optional, Dict, Set, List, Mapping, Iterator, Iterable, Union
 
-from .common import AccessLevel, UserId, JsonObject
+from .common import AccessLevel, UserId, JsonObject, json_loads, json_dumps
 from .context import ApiContext
 
 SnapshotName = str
@@ -121,6 +122,35 @@ class CodeBaseApi(object):
         if '/' in sn_tag:
             raise Exception("invalid snapshot tag: `" + sn_tag + "`")
 
+    @staticmethod
+    def encode_fragment(code: str, exec_types: Set[ExecutorType]) -> bytes:
+        """Тело запроса загрузки фрагмента - `FragmentCodeAndMeta` в JSON"""
+        code_and_meta = FragmentCodeAndMeta(
+            sourceCode = code,
+            metadata = FragmentMetadata(
+                isTextSource = True,
+                executorTypes = exec_types
+            )
+        )
+        return code_and_meta.to_json().encode('utf-8')
+
+    @staticmethod
+    def encode_fragment_stream(file_path: str, exec_types: Set[ExecutorType], chunk_size: int = 2**20) -> Iterator[bytes]:
+        """
+        Потоковое тело запроса загрузки фрагмента из файла: JSON-оболочка `FragmentCodeAndMeta`
+        вокруг исходного кода, который читается и экранируется блоками по `chunk_size` символов.
+        В памяти одновременно находится только один блок.
+        """
+        metadata = FragmentMetadata(isTextSource = True, executorTypes = exec_types)
+        yield ('{"metadata":' + json_dumps(metadata.repr_json()) + ',"sourceCode":"').encode('utf-8')
+        with open(file_path, 'r') as source:
+            chunk = source.read(chunk_size)
+            while len(chunk) != 0:
+                # экранированная JSON-строка без окружающих кавычек
+                yield json.dumps(chunk)[1:-1].encode('utf-8')
+                chunk = source.read(chunk_size)
+        yield b'"}'
+
     def upload(self,
                sn_name: SnapshotName,
                sn_tag: SnapshotTag,
@@ -134,20 +164,36 @@ class CodeBaseApi(object):
         :param path: путь фрагмента (начальный слеш не нужен)
         :param code: исходный код фрагмента
         """
+        self.upload_encoded(sn_name, sn_tag, path, self.encode_fragment(code, exec_types))
+
+    def upload_encoded(self,
+                       sn_name: SnapshotName,
+                       sn_tag: SnapshotTag,
+                       path: FragmentPath,
+                       body: Union[bytes, Iterable[bytes]]):
+        """
+        Загрузка фрагмента, тело которого заранее подготовлено `encode_fragment`
+        или `encode_fragment_stream` (отправляется с `Transfer-Encoding: chunked`).
+        Позволяет читать и кодировать фрагменты параллельно с отправкой.
+        """
         self._ctx.validate_id(sn_name)
         self.validate_sn_tag(sn_tag, optional=True)
 
-        code_and_meta = FragmentCodeAndMeta(
-            sourceCode = code,
-            metadata = FragmentMetadata(
-                isTextSource = True,
-                executorTypes = exec_types
-            )
-        )
-
         if path.startswith("/"): path = path[1:]
 
-        self._ctx.http_post(f'/cb/snapshots/{sn_name}/{sn_tag}/fragments/{path}', json=code_and_meta)
+        self._ctx.http_post(f'/cb/snapshots/{sn_name}/{sn_tag}/fragments/{path}', data=body, compress=True)
+
+    def upload_file(self,
+                    sn_name: SnapshotName,
+                    sn_tag: SnapshotTag,
+                    path: FragmentPath,
+                    file_path: str,
+                    exec_types: Set[ExecutorType]):
+        """
+        Загрузка фрагмента из файла без чтения его целиком в память.
+        :param file_path: путь к файлу с исходным кодом фрагмента
+        """
+        self.upload_encoded(sn_name, sn_tag, path, self.encode_fragment_stream(file_path, exec_types))
 
     def get_snapshots(self, name: Optional[SnapshotName] = None, owner: Optional[UserId] = None) -> List[SnapshotMeta]:
         if not owner:
@@ -156,7 +202,7 @@ class CodeBaseApi(object):
         if name:
             options['snName'] = name
         response = self._ctx.http_get(f'/cb/users/{owner}/snapshots', data = options)
-        sn_list = response.json()
+        sn_list = json_loads(response.content)
         return [JsonObject.decode_from_json_dict(SnapshotMeta, sn) for sn in sn_list]
 
     def create_snapshot(self,
@@ -181,7 +227,7 @@ class CodeBaseApi(object):
             fragmentHashes = fragmentHashes
         )
 
-        response = self._ctx.http_post('/cb/newSnapshot', json=snapshot_meta)
+        response = self._ctx.http_post('/cb/newSnapshot', json=snapshot_meta, compress=True)
         json = response.json()
         sn_json = json['snapshot']
 
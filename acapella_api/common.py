@@ -1,82 +1,99 @@
 import inspect
 import json
+import time
 from enum import Enum
-from typing import Optional, Dict, Any, Mapping, Type, Union
+from typing import Optional, Dict, Any, Callable, Type, Union
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-class JsonObject(object):
-    def repr_json(self): return dict(filter(lambda x: not (x[1] is None), self.__dict__.items()))
 
-    def to_json(self, formatted = False): return JsonObject.__encode_to_json(self, formatted)
+def _encode_default(obj: Any):
+    if isinstance(obj, Enum):
+        return obj.value
+    elif isinstance(obj, JsonObject):
+        return obj.repr_json()
+    raise TypeError(f'Object of type {obj.__class__.__name__} is not JSON serializable')
 
-    @staticmethod
-    def __encode_to_json(obj: Any, formatted = False):
-        class ComplexEncoder(json.JSONEncoder):
-            def default(self, obj):
-                if isinstance(obj, Enum):
-                    return obj.value
-                elif isinstance(obj, JsonObject):
-                    return obj.repr_json()
-                else:
-                    return json.JSONEncoder.default(self, obj)
-
-        if formatted:
-            return json.dumps(obj.repr_json(), cls=ComplexEncoder, indent=4, sort_keys=True)
-        else:
-            return json.dumps(obj.repr_json(), cls=ComplexEncoder)
 
-    @staticmethod
-    def decode_from_json(cls, json_str: str):
-        return JsonObject.decode_from_json_dict(cls, json.loads(json_str))
+def json_dumps(obj: Any, formatted = False) -> str:
+    if formatted:
+        return json.dumps(obj, default=_encode_default, indent=4, sort_keys=True)
+    if orjson is not None:
+        return orjson.dumps(obj, default=_encode_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(obj, default=_encode_default)
+
+
+def json_loads(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _unwrap_optional(cls: Type, t: Any) -> Any:
+    if getattr(t, '__origin__', None) is Union:
+        union_params = [p for p in t.__args__ if p is not None.__class__]
+        if len(union_params) > 1:
+            raise Exception('"Union" tags are not supported: ' + str(cls))
+        return union_params[0]
+    return t
+
+
+class JsonObject(object):
+    def repr_json(self): return dict((k, v) for k, v in self.__dict__.items() if v is not None)
 
-    __cache: Mapping[Type, inspect.FullArgSpec] = {}
+    def to_json(self, formatted = False): return json_dumps(self.repr_json(), formatted)
 
     @staticmethod
-    def __default_value_for(spec: inspect.FullArgSpec, arg_name: str):
-        dlen = len(spec.defaults)
-        if dlen == 0:
-            return None
-        index = spec.args.index(arg_name)
-        offset = len(spec.args) - dlen
-        def_index = index - offset
-        if def_index >= 0:
-            return spec.defaults[def_index]
-        return None
+    def decode_from_json(cls, json_str: str):
+        return JsonObject.decode_from_json_dict(cls, json_loads(json_str))
 
+    __decoders: Dict[Type, Callable[[dict], Any]] = {}
 
     @staticmethod
-    def decode_from_json_dict(cls, json_dict: dict):
-        spec = JsonObject.__cache.get(cls)
-        if spec is None:
-            spec = inspect.getfullargspec(cls.__init__)
-            JsonObject.__cache[cls] = spec
-
-        if len(spec.annotations) != (len(spec.args) - 1):
-            not_marked = []
-            for a in spec.args:
-                if (a != 'self') and (spec.annotations.get(a) is None):
-                    not_marked.append(a)
+    def __compile_decoder(cls) -> Callable[[dict], Any]:
+        """
+        Декодер собирается один раз на класс: аргументы `__init__`, их значения по умолчанию
+        и классы вложенных объектов вычисляются заранее.
+        """
+        spec = inspect.getfullargspec(cls.__init__)
+        args = spec.args[1:]
+
+        not_marked = [a for a in args if spec.annotations.get(a) is None]
+        if not_marked:
             raise Exception('not annotated arguments in __init__ of ' + str(cls) + ': ' + ', '.join(not_marked))
 
-        for name, t in spec.annotations.items():
-            if t.__class__ == Union.__class__:
-                if hasattr(t, '__union_params__'):
-                    union_params = t.__union_params__ # Python 3.5
-                else:
-                    union_params = t.__args__ # Python 3.6+
-                union_params = list(filter(lambda x: x != None.__class__, union_params))
-                if len(union_params) > 1:
-                    raise Exception('"Union" tags are not supported: ' + str(cls))
-                t = union_params[0]
+        defaults = spec.defaults or ()
+        offset = len(args) - len(defaults)
 
-            val = json_dict.get(name)
-            if (type(val) == dict) and (t.__class__ != Dict.__class__):
-                val = JsonObject.decode_from_json_dict(t, val)
-            if (val is None):
-                val = JsonObject.__default_value_for(spec, name)
-            json_dict[name] = val
+        fields = []
+        for index, name in enumerate(args):
+            t = _unwrap_optional(cls, spec.annotations[name])
+            nested = t if (inspect.isclass(t) and issubclass(t, JsonObject)) else None
+            default = defaults[index - offset] if index >= offset else None
+            fields.append((name, nested, default))
 
-        return cls(**json_dict)
+        def decode(json_dict: dict):
+            for name, nested, default in fields:
+                val = json_dict.get(name)
+                if val is None:
+                    val = default
+                elif (nested is not None) and (type(val) == dict):
+                    val = JsonObject.decode_from_json_dict(nested, val)
+                json_dict[name] = val
+            return cls(**json_dict)
+
+        return decode
+
+    @staticmethod
+    def decode_from_json_dict(cls, json_dict: dict):
+        decoder = JsonObject.__decoders.get(cls)
+        if decoder is None:
+            decoder = JsonObject.__compile_decoder(cls)
+            JsonObject.__decoders[cls] = decoder
+        return decoder(json_dict)
 
 
 
@@ -107,3 +124,26 @@ class SharableResource(JsonObject):
         self.owner = owner
         self.access = access
         self.accessPerUser = accessPerUser
+
+
+class Deadline(object):
+    """Бюджет времени операции, отсчитываемый по монотонным часам. `None` - без ограничения"""
+    def __init__(self, timeout_sec: Optional[float]):
+        self.expire_at = None if timeout_sec is None else time.monotonic() + timeout_sec
+
+    def remaining(self) -> Optional[float]:
+        if self.expire_at is None:
+            return None
+        return max(0.0, self.expire_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expire_at is not None and time.monotonic() >= self.expire_at
+
+    def timeout(self, limit: Optional[float]) -> Optional[float]:
+        """Таймаут одного запроса: `limit`, но не больше оставшегося бюджета"""
+        remaining = self.remaining()
+        if remaining is None:
+            return limit
+        if limit is None:
+            return remaining
+        return min(limit, remaining)
@@ -0,0 +1,87 @@
+import threading
+import zlib
+from typing import Iterable, Iterator, List, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# параметр `wbits` zlib для каждого формата
+_ZLIB_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+def available_encodings() -> List[str]:
+    """Поддерживаемые алгоритмы сжатия тела запроса (`zstd` - при установленном `zstandard`)"""
+    encodings = list(_ZLIB_WBITS)
+    if zstandard is not None:
+        encodings.append('zstd')
+    return encodings
+
+
+def _compressor(encoding: str):
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise ValueError("'zstd' compression requires the 'zstandard' package")
+        return zstandard.ZstdCompressor().compressobj()
+    wbits = _ZLIB_WBITS.get(encoding)
+    if wbits is None:
+        raise ValueError(f"unsupported compression: '{encoding}'")
+    return zlib.compressobj(6, zlib.DEFLATED, wbits)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    compressor = _compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str, counters: 'TrafficCounters') -> Iterator[bytes]:
+    """Потоковое сжатие тела запроса, заданного генератором"""
+    compressor = _compressor(encoding)
+    for chunk in chunks:
+        counters.add_request(len(chunk), 0)
+        compressed = compressor.compress(chunk)
+        if compressed:
+            counters.add_request(0, len(compressed))
+            yield compressed
+    compressed = compressor.flush()
+    counters.add_request(0, len(compressed))
+    yield compressed
+
+
+def to_bytes(data: Union[str, bytes]) -> bytes:
+    return data.encode('utf-8') if isinstance(data, str) else data
+
+
+class TrafficCounters(object):
+    """
+    Счётчики трафика HTTP-тел: размер до сжатия и размер, переданный по сети.
+    Для ответов размер по сети известен из `Content-Length`, размер после распаковки - если тело прочитано.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.request_bytes = 0
+        self.request_wire_bytes = 0
+        self.response_bytes = 0
+        self.response_wire_bytes = 0
+
+    def add_request(self, raw: int, wire: int):
+        with self.__lock:
+            self.request_bytes += raw
+            self.request_wire_bytes += wire
+
+    def add_response(self, raw: int, wire: int):
+        with self.__lock:
+            self.response_bytes += raw
+            self.response_wire_bytes += wire
+
+    def summary(self) -> str:
+        def ratio(raw: int, wire: int) -> str:
+            return f'{100.0 * (1 - wire / raw):.0f}% saved' if raw > 0 else '-'
+        return (f'sent {self.request_wire_bytes} of {self.request_bytes} bytes '
+                f'({ratio(self.request_bytes, self.request_wire_bytes)}), '
+                f'received {self.response_wire_bytes} of {self.response_bytes} bytes '
+                f'({ratio(self.response_bytes, self.response_wire_bytes)})')
@@ -1,14 +1,212 @@
 import re
-
-import requests
-from requests import Response
-from requests.auth import HTTPBasicAuth
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import TYPE_CHECKING, Optional, Callable, List, Tuple
 
 from .common import UserId, JsonObject
+from .compression import TrafficCounters, compress, compress_stream, to_bytes
+from .retry import RetryPolicy, NO_RETRY
+from .stats import RequestRecord, AttemptRecord
+
+if TYPE_CHECKING:
+    from requests import Response, Session
+
+RequestHook = Callable[[RequestRecord], None]
+
+# попытка (`AttemptRecord`), которую сейчас отправляет этот поток: в неё пулы записывают время DNS и соединения;
+# `hedge` - `_HedgeAttempt` потока дублируемого запроса
+_attempt_timing = threading.local()
+
+
+class _HedgeAttempt(object):
+    """
+    Попытка дублируемого запроса в потоке-демоне: незавершённый запрос не задерживает выход из процесса,
+    а проигравшую попытку `cancel()` обрывает, закрывая соединение, ждущее ответа.
+    """
+    def __init__(self, send: Callable[[], Tuple['Response', AttemptRecord]]):
+        self.future = Future()
+        self.__send = send
+        self.__lock = threading.Lock()
+        self.__connection = None
+        self.__cancelled = False
+
+    def start(self) -> Future:
+        threading.Thread(target=self.__run, name='hedge', daemon=True).start()
+        return self.future
+
+    def __run(self):
+        _attempt_timing.hedge = self
+        try:
+            self.future.set_result(self.__send())
+        except BaseException as e:
+            self.future.set_exception(e)
+        finally:
+            _attempt_timing.hedge = None
+
+    def waiting(self, connection) -> None:
+        """Соединение, отправившее запрос и ждущее заголовков ответа; `None` - ответ получен"""
+        with self.__lock:
+            self.__connection = connection
+            if self.__cancelled:
+                self.__shutdown()
+
+    def cancel(self) -> None:
+        with self.__lock:
+            self.__cancelled = True
+            self.__shutdown()
+
+    def __shutdown(self):
+        sock = getattr(self.__connection, 'sock', None)
+        if sock is None:
+            return
+        try:
+            # прерывает чтение в потоке попытки; пул отбросит соединение после ошибки
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+# версия urllib3, внутреннее устройство которой (`_new_conn`, `_dns_host`) повторяет `_dns_timed`
+_DNS_TIMING_URLLIB3_MAJOR = 2
+
+
+def _timed(connection_cls):
+    """
+    Соединение, учитывающее время `connect()` (разрешение имени, TCP и TLS) в текущей попытке.
+    Переопределяются только открытые методы `http.client.HTTPConnection`.
+    """
+    class TimedConnection(connection_cls):
+        def request(self, *args, **kwargs):
+            hedge: Optional[_HedgeAttempt] = getattr(_attempt_timing, 'hedge', None)
+            if hedge is not None:
+                hedge.waiting(self)
+            try:
+                return super().request(*args, **kwargs)
+            except BaseException:
+                if hedge is not None:
+                    hedge.waiting(None)
+                raise
+
+        def getresponse(self, *args, **kwargs):
+            hedge: Optional[_HedgeAttempt] = getattr(_attempt_timing, 'hedge', None)
+            try:
+                return super().getresponse(*args, **kwargs)
+            finally:
+                # после заголовков соединение может вернуться в пул, и обрывать его уже нельзя
+                if hedge is not None:
+                    hedge.waiting(None)
+
+        def connect(self):
+            timing: Optional[AttemptRecord] = getattr(_attempt_timing, 'current', None)
+            dns_before = timing.dns_sec if timing else 0.0
+            started = time.monotonic()
+            try:
+                super().connect()
+            finally:
+                if timing is not None:
+                    # из длительности `connect()` вычитается разрешение имени, если оно измерено отдельно
+                    timing.connect_sec += time.monotonic() - started - (timing.dns_sec - dns_before)
+    return TimedConnection
+
+
+def _dns_timed(connection_cls):
+    """
+    `_timed`, дополнительно отделяющее разрешение имени: `_new_conn` из urllib3 2.x, в котором
+    `getaddrinfo` вызывается отдельно от `create_connection`. Ошибки - те же, что у urllib3.
+    """
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError, NameResolutionError
+    from urllib3.util.connection import allowed_gai_family, create_connection
+
+    class DnsTimedConnection(_timed(connection_cls)):
+        def _new_conn(self):
+            timing: Optional[AttemptRecord] = getattr(_attempt_timing, 'current', None)
+            dns_host = getattr(self, '_dns_host', None)
+            if (timing is None) or (dns_host is None):
+                return super()._new_conn()
+
+            # адреса перебираются по порядку, как в `urllib3.util.connection.create_connection`
+            started = time.monotonic()
+            try:
+                addresses = socket.getaddrinfo(dns_host.strip('[]'), self.port, allowed_gai_family(), socket.SOCK_STREAM)
+            except socket.gaierror as e:
+                raise NameResolutionError(self.host, self, e) from e
+            finally:
+                timing.dns_sec += time.monotonic() - started
+
+            error = OSError('getaddrinfo returns an empty list')
+            for family, sock_type, proto, canonname, address in addresses:
+                try:
+                    sock = create_connection((address[0], self.port), self.timeout,
+                                             source_address=self.source_address,
+                                             socket_options=self.socket_options)
+                except OSError as e:
+                    error = e
+                    continue
+                sys.audit('http.client.connect', self, self.host, self.port)
+                return sock
+            if isinstance(error, socket.timeout):
+                raise ConnectTimeoutError(
+                    self, f'Connection to {self.host} timed out. (connect timeout={self.timeout})') from error
+            raise NewConnectionError(self, f'Failed to establish a new connection: {error}') from error
+    return DnsTimedConnection
+
+
+def _supports_dns_timing() -> bool:
+    import urllib3
+    from urllib3 import exceptions
+    from urllib3.connection import HTTPConnection
+    from urllib3.util import connection
+    return (urllib3.__version__.split('.')[0] == str(_DNS_TIMING_URLLIB3_MAJOR)
+            and hasattr(HTTPConnection, '_new_conn') and hasattr(exceptions, 'NameResolutionError')
+            and hasattr(connection, 'allowed_gai_family') and hasattr(connection, 'create_connection'))
+
+
+def _mount_timed_pools(adapter) -> None:
+    """
+    Пулы urllib3, соединения которых учитывают время соединения в текущей попытке `_attempt_timing`.
+    Время DNS измеряется отдельно только с urllib3 `_DNS_TIMING_URLLIB3_MAJOR`.x; с другими версиями
+    оно входит в `connect_sec`, а `dns_sec` остаётся нулевым.
+    """
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    timed = _dns_timed if _supports_dns_timing() else _timed
+
+    class TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = timed(HTTPConnection)
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = timed(HTTPSConnection)
+
+    adapter.poolmanager.pool_classes_by_scheme = {
+        'http': TimedHTTPConnectionPool,
+        'https': TimedHTTPSConnectionPool,
+    }
 
 
 class ApiContext(object):
-    def __init__(self, address: str = 'http://localhost:5678', http_timeout: int = 2000):
+    def __init__(self,
+                 address: str = 'http://localhost:5678',
+                 http_timeout: int = 2000,
+                 pool_connections: int = 4,
+                 pool_maxsize: int = 16,
+                 pool_block: bool = False,
+                 keep_alive: bool = True,
+                 compression: Optional[str] = None,
+                 compress_min_size: int = 1024,
+                 retry: Optional[RetryPolicy] = None):
+        """
+        :param pool_connections: количество хостов, для которых хранятся пулы соединений
+        :param pool_maxsize: максимальное количество соединений с одним хостом
+        :param pool_block: ждать освобождения соединения вместо открытия нового сверх `pool_maxsize`
+        :param keep_alive: переиспользовать соединения между запросами
+        :param compression: сжатие тел запросов, отмеченных `compress=True`: 'gzip', 'deflate', 'zstd' или `None`
+        :param compress_min_size: тела меньше этого размера, байт, не сжимаются
+        :param retry: политика повторов идемпотентных запросов, по умолчанию `RetryPolicy()`
+        """
         self.address = address
         self.http_timeout = http_timeout
 
@@ -17,7 +215,62 @@ class ApiContext(object):
 
         self.__id_pattern = re.compile('^[\w\-.]+$')
 
-    def raise_if_failed(self, response: Response) -> None:
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.compression = compression
+        self.compress_min_size = compress_min_size
+        self.traffic = TrafficCounters()
+        self.retry = retry if retry is not None else RetryPolicy()
+
+        self.__session = None
+        self.__session_lock = threading.Lock()
+        self.__hooks: List[RequestHook] = []
+
+    @property
+    def session(self) -> 'Session':
+        """Пул соединений. `requests` импортируется при первом HTTP-запросе"""
+        if self.__session is None:
+            with self.__session_lock:
+                if self.__session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    from urllib3.util.request import ACCEPT_ENCODING
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                          pool_maxsize=self.pool_maxsize,
+                                          pool_block=self.pool_block)
+                    _mount_timed_pools(adapter)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    if not self.keep_alive:
+                        session.headers['Connection'] = 'close'
+                    # все форматы ответа, которые умеет распаковать urllib3 (br и zstd - если установлены их пакеты)
+                    session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+                    self.__session = session
+        return self.__session
+
+    def close(self) -> None:
+        if self.__session is not None:
+            self.__session.close()
+            self.__session = None
+
+    def add_hook(self, hook: RequestHook) -> None:
+        """Обработчик, вызываемый с `RequestRecord` после каждого запроса (в потоке запроса)"""
+        self.__hooks = self.__hooks + [hook]
+
+    def remove_hook(self, hook: RequestHook) -> None:
+        self.__hooks = [h for h in self.__hooks if h is not hook]
+
+    @property
+    def http_errors(self):
+        """Модуль исключений HTTP-клиента (`requests.exceptions`)"""
+        import requests.exceptions
+        return requests.exceptions
+
+    def raise_if_failed(self, response: 'Response') -> None:
         if response.status_code != 200:
             if response.status_code == 400:
                 json = response.json()
@@ -40,7 +293,7 @@ class ApiContext(object):
             kwargs['data'] = json.to_json()
 
         if self.token:
-            kwargs['auth'] = HTTPBasicAuth(self.user_id, self.token)
+            kwargs['auth'] = (self.user_id, self.token)
 
         kwargs.setdefault('timeout', self.http_timeout)
         kwargs.setdefault('allow_redirects', True)
@@ -50,20 +303,147 @@ class ApiContext(object):
             ignore_errors = True
             del kwargs["ignore_errors"]
 
-        resp = requests.request(method, self.address + path, **kwargs)
+        record = RequestRecord(method, path)
+        record.started = time.monotonic()
+        record.bytes_sent = self.__encode_body(kwargs, kwargs.pop('compress', False))
+
+        # тело-генератор после первой попытки уже прочитано: такой запрос не повторяется
+        idempotent = kwargs.pop('idempotent', method.lower() == 'get')
+        data = kwargs.get('data')
+        retryable = idempotent and (data is None or isinstance(data, (str, bytes, dict)))
+        hedge = kwargs.pop('hedge', False)
+
+        try:
+            resp, attempt = self.__send(method, self.address + path, kwargs,
+                                        self.retry if retryable else NO_RETRY, hedge, record)
+
+            record.status = resp.status_code
+            record.ttfb_sec = attempt.ttfb_sec
+            content_length = resp.headers.get('Content-Length')
+            if not kwargs.get('stream'):
+                raw = len(resp.content)
+                wire = int(content_length) if content_length else raw
+                self.traffic.add_response(raw, wire)
+                record.bytes_received = wire
+            elif content_length:
+                record.bytes_received = int(content_length)
+        except Exception as e:
+            record.error = e
+            raise
+        finally:
+            record.total_sec = time.monotonic() - record.started
+            for hook in self.__hooks:
+                hook(record)
 
         if not ignore_errors:
             self.raise_if_failed(resp)
 
         return resp
 
-    def http_get(self, path: str, **kwargs) -> Response:
+    def __attempt(self, method: str, url: str, kwargs: dict, record: RequestRecord,
+                  hedge: bool = False) -> Tuple['Response', AttemptRecord]:
+        """Одна отправка запроса; время DNS, соединения и до первого байта измеряется в потоке отправки"""
+        timing = AttemptRecord(hedge)
+        record.attempts.append(timing)
+        _attempt_timing.current = timing
+        started = time.monotonic()
+        try:
+            resp = self.session.request(method, url, **kwargs)
+        except Exception as e:
+            timing.error = e
+            raise
+        finally:
+            _attempt_timing.current = None
+            timing.total_sec = time.monotonic() - started
+        timing.status = resp.status_code
+        # `elapsed` requests отсчитывается от начала отправки и включает установку соединения
+        timing.ttfb_sec = max(0.0, resp.elapsed.total_seconds() - timing.dns_sec - timing.connect_sec)
+        return resp, timing
+
+    def __send(self, method: str, url: str, kwargs: dict, policy: RetryPolicy, hedge: bool,
+               record: RequestRecord) -> Tuple['Response', AttemptRecord]:
+        """Отправка запроса с повторами по `policy` после ошибок соединения и временных ошибок сервера"""
+        deadline = policy.deadline()
+        hedge_delay = policy.hedge_delay_sec if hedge else None
+        attempt = 0
+        while True:
+            try:
+                if hedge_delay is None:
+                    resp, timing = self.__attempt(method, url, kwargs, record)
+                else:
+                    resp, timing = self.__hedged_request(method, url, kwargs, hedge_delay, record)
+            except self.http_errors.ConnectionError:
+                if not policy.can_retry(attempt, deadline):
+                    raise
+            else:
+                if (resp.status_code not in policy.retry_statuses) or not policy.can_retry(attempt, deadline):
+                    return resp, timing
+                resp.close()
+
+            time.sleep(deadline.timeout(policy.backoff(attempt)))
+            attempt += 1
+            record.retries = attempt
+
+    def __hedged_request(self, method: str, url: str, kwargs: dict, hedge_delay: float,
+                         record: RequestRecord) -> Tuple['Response', AttemptRecord]:
+        """
+        Если ответа нет дольше `hedge_delay`, отправляется дублирующий запрос;
+        используется ответ, пришедший первым, второй закрывается или обрывается.
+        """
+        attempts = [_HedgeAttempt(lambda: self.__attempt(method, url, kwargs, record))]
+        futures = [attempts[0].start()]
+        done, pending = wait(futures, timeout=hedge_delay)
+        if not done:
+            attempts.append(_HedgeAttempt(lambda: self.__attempt(method, url, kwargs, record, True)))
+            futures.append(attempts[1].start())
+            done, pending = wait(futures, return_when=FIRST_COMPLETED)
+            # первый ответ - ошибка: ждём второй
+            if all(f.exception() is not None for f in done) and pending:
+                done, pending = wait(futures)
+
+        winner = next((f for f in futures if f in done and f.exception() is None), None)
+        for attempt in attempts:
+            if attempt.future in pending:
+                attempt.cancel()
+                attempt.future.add_done_callback(lambda f: f.exception() is None and f.result()[0].close())
+        for f in done:
+            if (f is not winner) and (f.exception() is None):
+                f.result()[0].close()
+        if winner is None:
+            raise futures[0].exception()
+        return winner.result()
+
+    def __encode_body(self, kwargs: dict, compressible: bool) -> int:
+        """
+        Сжатие тела запроса (строки, байт или генератора байт) и учёт его размера.
+        :return: размер тела для передачи; 0 - заранее неизвестен
+        """
+        data = kwargs.get('data')
+        if (data is None) or isinstance(data, dict):
+            return 0
+
+        if isinstance(data, (str, bytes)):
+            body = to_bytes(data)
+            if compressible and self.compression and len(body) >= self.compress_min_size:
+                kwargs['data'] = compress(body, self.compression)
+                kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'Content-Encoding': self.compression})
+                self.traffic.add_request(len(body), len(kwargs['data']))
+                return len(kwargs['data'])
+            self.traffic.add_request(len(body), len(body))
+            return len(body)
+        if compressible and self.compression:
+            # размер генератора заранее неизвестен: сжимается всегда
+            kwargs['data'] = compress_stream(data, self.compression, self.traffic)
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'Content-Encoding': self.compression})
+        return 0
+
+    def http_get(self, path: str, **kwargs) -> 'Response':
         return self.http_request('get', path, **kwargs)
 
-    def http_post(self, path: str, **kwargs) -> Response:
+    def http_post(self, path: str, **kwargs) -> 'Response':
         return self.http_request('post', path, **kwargs)
 
-    def http_delete(self, path: str, **kwargs) -> Response:
+    def http_delete(self, path: str, **kwargs) -> 'Response':
         return self.http_request('delete', path, **kwargs)
 
 
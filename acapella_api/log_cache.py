@@ -0,0 +1,116 @@
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+from typing import Callable, Optional
+
+from .common import UserId
+
+
+class _PendingLog(object):
+    """Запись лога в кеш: файл появляется в кеше только после `commit`"""
+    def __init__(self, cache: 'LogCache', key: str, file, tmp_path: str):
+        self.__cache = cache
+        self.__key = key
+        self.__file = file
+        self.__tmp_path = tmp_path
+
+    def write(self, chunk: bytes):
+        self.__file.write(chunk)
+
+    def commit(self):
+        try:
+            self.__file.close()
+            os.replace(self.__tmp_path, self.__cache.file_path(self.__key))
+        except OSError:
+            self.abort()
+            return
+        self.__cache.evict()
+
+    def abort(self):
+        self.__file.close()
+        try:
+            os.unlink(self.__tmp_path)
+        except OSError:
+            pass
+
+
+class LogCache(object):
+    """
+    Дисковый кеш логов завершённых транзакций. После FINISHED/ERROR лог транзакции не меняется,
+    поэтому повторные чтения отдаются из файла через mmap. Размер кеша ограничен `max_bytes`,
+    при переполнении удаляются давно не читанные логи (LRU по mtime).
+    """
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(host: str, user: UserId, scope: str, tr_id: str, fr_path: Optional[str], dam: Optional[str], log_id: str) -> str:
+        canonical = json.dumps([host, user, scope, tr_id, fr_path, dam, log_id], separators=(',', ':'))
+        return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+    def file_path(self, key: str) -> str:
+        return os.path.join(self.path, key + '.log')
+
+    def read_into(self, key: str, write: Callable[[memoryview], None], chunk_size: int) -> bool:
+        """Передача закешированного лога в `write` блоками по `chunk_size`. `False` - лога нет в кеше"""
+        path = self.file_path(key)
+        try:
+            source = open(path, 'rb')
+        except OSError:
+            return False
+
+        with source:
+            size = os.fstat(source.fileno()).st_size
+            if size > 0:
+                with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    view = memoryview(data)
+                    try:
+                        for offset in range(0, size, chunk_size):
+                            write(view[offset:offset + chunk_size])
+                    finally:
+                        view.release()
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return True
+
+    def begin(self, key: str) -> Optional[_PendingLog]:
+        """Начало записи лога в кеш. `None`, если каталог кеша недоступен"""
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.' + key, suffix='.tmp')
+            return _PendingLog(self, key, os.fdopen(fd, 'wb'), tmp_path)
+        except OSError:
+            return None
+
+    def evict(self):
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    if not entry.name.endswith('.log'):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        except OSError:
+            return
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
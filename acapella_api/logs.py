@@ -1,11 +1,21 @@
+import codecs
+import datetime
+import heapq
 import io
+import re
 import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import Dict, Optional
+from typing import Dict, Optional, List, Iterator, Iterable, Tuple, Callable
 
 from .codebase import FragmentPath
 from .common import TransactionId, JsonObject, UserId, CompactDam
 from .context import ApiContext
+from .log_cache import LogCache
 
 StreamId = str
 LogName = str
@@ -25,6 +35,11 @@ class LogOrdering(Enum):
     STRICT = "STRICT"
 
 
+class LogMerge(Enum):
+    SOURCE = "source"
+    TIMESTAMP = "timestamp"
+
+
 class LogParameters(JsonObject):
     def __init__(self,
                  id: LogName,
@@ -60,42 +75,518 @@ class LogRef(JsonObject):
         self.frPath = frPath
         self.dam = dam
 
+def log_label(ref: LogRef) -> str:
+    """Метка источника при объединении логов: `frPath/dam:logId`"""
+    parts = [p for p in [ref.frPath, ref.dam] if p]
+    return ('/'.join(parts) + ':' + ref.logId) if parts else ref.logId
+
+
+# `2020-01-31 12:00:00.123`, `2020-01-31T12:00:00`, `12:00:00.123`, `1580461200123` (мс)
+_timestamp_pattern = re.compile(r'^\[?(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?|\d{2}:\d{2}:\d{2}(?:[.,]\d+)?|\d{13})')
+
+
+def _line_timestamp(line: str) -> Optional[float]:
+    match = _timestamp_pattern.match(line)
+    if not match:
+        return None
+    value = match.group(1).replace(',', '.')
+    if value.isdigit():
+        return int(value) / 1000.0
+    try:
+        if len(value) > 8 and value[2] != ':':
+            return datetime.datetime.fromisoformat(value[:26]).timestamp()
+        h, m, sec = value.split(':')
+        return int(h) * 3600 + int(m) * 60 + float(sec)
+    except ValueError:
+        return None
+
+
+def _timestamped_lines(label: str, lines: Iterable[str]) -> Iterator[Tuple[float, str]]:
+    """Строки без метки времени (например, продолжение стектрейса) получают время предыдущей строки"""
+    last = 0.0
+    for line in lines:
+        ts = _line_timestamp(line)
+        if ts is not None:
+            last = ts
+        yield last, f'[{label}] {line}'
+
+
+class LogFilter(object):
+    """
+    Построчная фильтрация текста лога: `grep` - регулярное выражение, `head` - первые N
+    подходящих строк, `tail` - последние N из них (кольцевой буфер). Если заданы оба,
+    `tail` применяется к результату `head`.
+    """
+    def __init__(self, output, grep: Optional[str] = None, head: Optional[int] = None, tail: Optional[int] = None):
+        self.output = output
+        self.pattern = re.compile(grep) if grep else None
+        self.head = head
+        self.ring = deque(maxlen=tail) if tail is not None else None
+        self.matched = 0
+        self.__partial = ''
+
+    @property
+    def done(self) -> bool:
+        """Дальнейшие строки уже не попадут в вывод - чтение можно прекратить"""
+        return (self.head is not None) and (self.matched >= self.head)
+
+    def __line(self, line: str):
+        if self.done:
+            return
+        if (self.pattern is not None) and not self.pattern.search(line):
+            return
+        self.matched += 1
+        if self.ring is not None:
+            self.ring.append(line)
+        else:
+            self.output.write(line)
+
+    def write(self, text: str):
+        lines = (self.__partial + text).split('\n')
+        self.__partial = lines.pop()
+        for line in lines:
+            self.__line(line + '\n')
+
+    def flush(self):
+        self.output.flush()
+
+    def close(self):
+        if self.__partial:
+            self.__line(self.__partial)
+            self.__partial = ''
+        if self.ring:
+            self.output.writelines(self.ring)
+            self.ring.clear()
+        self.output.flush()
+
+
+# лог запрашивается без сжатия: смещения `Range` отсчитываются в байтах лога, а не сжатого ответа
+_RAW_LOG_HEADERS = {'Accept-Encoding': 'identity'}
+
+
+class _LogWriter(object):
+    """
+    Запись потока лога в `output` с подсчётом принятых байт.
+    В текстовом режиме байты декодируются инкрементально, поэтому многобайтовые символы
+    на границе блоков не ломаются. В бинарном режиме байты пишутся в `output` как есть;
+    для текстового потока (например `sys.stdout`) используется его буфер.
+    """
+    def __init__(self, output, binary: bool, copy_to = None, until: Optional[Callable[[], bool]] = None):
+        """
+        :param copy_to: дополнительный приёмник сырых байт (запись в кеш)
+        :param until: условие досрочного прекращения чтения
+        """
+        self.offset = 0
+        self.binary = binary
+        self.copy_to = copy_to
+        self.until = until
+        if binary:
+            if isinstance(output, io.TextIOBase):
+                output.flush()
+                output = output.buffer
+            self.decoder = None
+        else:
+            self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.output = output
+
+    def write(self, chunk: bytes):
+        self.offset += len(chunk)
+        if self.copy_to is not None:
+            self.copy_to.write(chunk)
+        if self.binary:
+            self.output.write(chunk)
+        else:
+            text = self.decoder.decode(chunk)
+            if text:
+                self.output.write(text)
+
+    def close(self):
+        if not self.binary:
+            text = self.decoder.decode(b'', final=True)
+            if text:
+                self.output.write(text)
+        self.output.flush()
+
+
+class _LogSpool(object):
+    """
+    Лог, читаемый в фоновом потоке: принятые байты пишутся во временный файл и доступны
+    для построчного чтения, пока запись продолжается. Запись никогда не блокируется читателем,
+    а в памяти находится только текущий блок.
+    """
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.file = tempfile.TemporaryFile()
+        self.__cond = threading.Condition()
+        self.__size = 0
+        self.__done = False
+        self.found = False
+        self.error: Optional[BaseException] = None
+
+    def write(self, chunk: bytes):
+        with self.__cond:
+            self.file.seek(0, io.SEEK_END)
+            self.file.write(chunk)
+            self.__size += len(chunk)
+            self.__cond.notify_all()
+
+    def flush(self):
+        pass
+
+    def finish(self, found: bool, error: Optional[BaseException] = None):
+        with self.__cond:
+            self.found = found
+            self.error = error
+            self.__done = True
+            self.__cond.notify_all()
+
+    def chunks(self) -> Iterator[bytes]:
+        """Блоки лога по мере поступления; ошибка чтения пробрасывается после принятых данных"""
+        pos = 0
+        while True:
+            with self.__cond:
+                while pos >= self.__size and not self.__done:
+                    self.__cond.wait()
+                if pos >= self.__size:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                self.file.seek(pos)
+                data = self.file.read(min(self.__size - pos, self.chunk_size))
+            pos += len(data)
+            yield data
+
+    def lines(self) -> Iterator[str]:
+        """Строки лога с переводом строки в конце, включая последнюю"""
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        rest = ''
+        for chunk in self.chunks():
+            lines = (rest + decoder.decode(chunk)).splitlines(keepends=True)
+            # незавершённая строка (в том числе `\r` без `\n`) ждёт следующего блока
+            rest = lines.pop() if lines and not lines[-1].endswith('\n') else ''
+            yield from lines
+        rest += decoder.decode(b'', final=True)
+        if rest:
+            yield rest + '\n'
+
+    def close(self):
+        self.file.close()
+
+
 # todo pass user
 class LoggingApi(object):
-    def __init__(self, api_context: ApiContext):
+    def __init__(self,
+                 api_context: ApiContext,
+                 chunk_size: int = 64 * 1024,
+                 read_timeout: float = 1000.0,
+                 follow_read_timeout: float = 60.0,
+                 follow_min_interval: float = 0.1,
+                 follow_max_interval: float = 5.0,
+                 cache: Optional[LogCache] = None):
+        """
+        :param chunk_size: размер блока, которым читается поток лога
+        :param read_timeout: таймаут ожидания очередного блока лога, секунды
+        :param follow_read_timeout: то же для `follow_log`; по истечении соединение переоткрывается
+        :param follow_min_interval: начальная пауза `follow_log` между переподключениями без новых данных
+        :param follow_max_interval: максимальная пауза `follow_log` между переподключениями
+        :param cache: дисковый кеш логов завершённых транзакций
+        """
         self._ctx = api_context
+        self.chunk_size = chunk_size
+        self.read_timeout = read_timeout
+        self.follow_read_timeout = follow_read_timeout
+        self.follow_min_interval = follow_min_interval
+        self.follow_max_interval = follow_max_interval
+        self.cache = cache
 
-    def __read_log(self, output, path: str) -> bool:
-        resp = self._ctx.http_get(path, timeout=1000.0, stream=True, ignore_errors=True)
-        if resp.status_code == 404:
-            return False
-        self._ctx.raise_if_failed(resp)
-        for chunk in resp.iter_content():
-            output.write(chunk.decode(encoding="utf-8"))
-        return True
-
-    def read_log(self, ref: LogRef, output: io.RawIOBase = sys.stdout):
+    @staticmethod
+    def log_path(ref: LogRef) -> Optional[str]:
         if ref.scope == LogScope.USER:
-            self.read_user_log(ref.logId, output)
+            return f'/vm/logs/{ref.logId}'
         elif ref.scope == LogScope.TRANSACTION:
-            self.read_tr_log(ref.trId, ref.logId, output)
+            return f'/vm/transactions/{ref.trId}/logs/{ref.logId}'
         elif ref.scope == LogScope.FRAGMENT:
-            self.read_fragment_log(ref.trId, ref.frPath, ref.logId, output)
+            return f'/vm/transactions/{ref.trId}/fragments/{ref.frPath}/logs/{ref.logId}'
         elif ref.scope == LogScope.EXECUTION:
-            self.read_execution_log(ref.trId, ref.frPath, ref.dam, ref.logId, output)
+            return f'/vm/transactions/{ref.trId}/fragments/{ref.frPath}/executions/{ref.dam}/logs/{ref.logId}'
+        return None
+
+    def __read_stream(self, writer: _LogWriter, path: str, timeout: float) -> Optional[int]:
+        """
+        Чтение лога, начиная с `writer.offset`. Продолжение запрашивается заголовком `Range`;
+        если сервер его игнорирует, уже принятые байты пропускаются.
+        :return: количество новых байт или `None`, если лог не найден
+        """
+        offset = writer.offset
+        headers = dict(_RAW_LOG_HEADERS, Range=f'bytes={offset}-') if offset > 0 else dict(_RAW_LOG_HEADERS)
+        resp = self._ctx.http_get(path, timeout=timeout, stream=True, ignore_errors=True, headers=headers)
+        with resp:
+            if resp.status_code == 404:
+                return None
+            if resp.status_code == 416:
+                return 0
+            if resp.status_code != 206:
+                self._ctx.raise_if_failed(resp)
+            skip = offset if resp.status_code == 200 else 0
+
+            for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                if skip > 0:
+                    if len(chunk) <= skip:
+                        skip -= len(chunk)
+                        continue
+                    chunk = chunk[skip:]
+                    skip = 0
+                writer.write(chunk)
+                if (writer.until is not None) and writer.until():
+                    break
+        return writer.offset - offset
+
+    def __read_log(self, output, path: str, binary: bool = False) -> bool:
+        """Потоковое чтение лога блоками по `chunk_size`"""
+        writer = _LogWriter(output, binary)
+        if self.__read_stream(writer, path, self.read_timeout) is None:
+            return False
+        writer.close()
+        return True
+
+    def __tr_state(self, tr_id: TransactionId) -> str:
+        json = self._ctx.http_get(f'/vm/transactions/{tr_id}/status').json()
+        return 'running' if json is None else json.get('state')
+
+    def __is_running(self, tr_id: TransactionId) -> bool:
+        return self.__tr_state(tr_id) == 'running'
+
+    def __cache_key(self, ref: LogRef) -> Optional[str]:
+        if (self.cache is None) or (ref.scope == LogScope.USER) or (ref.trId is None):
+            return None
+        return LogCache.key(self._ctx.address, ref.user or self._ctx.user_id,
+                            ref.scope.value, ref.trId, ref.frPath, ref.dam, ref.logId)
+
+    def __read_cached(self, ref: LogRef, path: str, output, binary: bool) -> bool:
+        key = self.__cache_key(ref)
+
+        writer = _LogWriter(output, binary)
+        if self.cache.read_into(key, writer.write, self.chunk_size):
+            writer.close()
+            return True
+
+        # лог кешируется, только если транзакция завершилась до начала чтения: тогда он полный
+        if not (self.__tr_state(ref.trId) in ['finished', 'error']):
+            return self.__read_log(output, path, binary)
+
+        pending = self.cache.begin(key)
+        if pending is None:
+            return self.__read_log(output, path, binary)
+
+        writer.copy_to = pending
+        try:
+            found = self.__read_stream(writer, path, self.read_timeout) is not None
+        except BaseException:
+            pending.abort()
+            raise
+        if found:
+            pending.commit()
+            writer.close()
+        else:
+            pending.abort()
+        return found
+
+    def follow_log(self,
+                   ref: LogRef,
+                   output: io.RawIOBase = sys.stdout,
+                   binary: bool = False,
+                   cancel: Optional[threading.Event] = None,
+                   tr_finished: Optional[threading.Event] = None) -> bool:
+        """
+        Чтение лога с продолжением: после обрыва соединения чтение возобновляется с последнего
+        принятого байта. Лог транзакции читается до её завершения, лог пользователя - до отмены.
+        Пауза между переподключениями растёт, только пока новых данных нет.
+
+        :param cancel: событие отмены, проверяется между переподключениями и между блоками ответа
+        :param tr_finished: событие завершения транзакции, если её статус ожидает вызывающий код;
+                         вместо опроса статуса лог дочитывается сразу после этого события
+        :return: `False`, если лог так и не появился до завершения транзакции
+        """
+        path = self.log_path(ref)
+        if path is None:
+            return False
+
+        errors = self._ctx.http_errors
+        writer = _LogWriter(output, binary, until=cancel.is_set if cancel is not None else None)
+        interval = self.follow_min_interval
+        found = False
+        finished = False
+        try:
+            while not (cancel is not None and cancel.is_set()):
+                finished = finished or (tr_finished is not None and tr_finished.is_set())
+                offset = writer.offset
+                try:
+                    received = self.__read_stream(writer, path, self.follow_read_timeout)
+                    found = found or (received is not None)
+                except (errors.ConnectionError, errors.Timeout, errors.ChunkedEncodingError):
+                    # обрыв посреди ответа: принятые до него байты - тоже продвижение
+                    received = writer.offset - offset
+                    found = found or (received > 0)
+
+                # транзакция завершилась до этого чтения: всё, что было в логе, уже получено
+                if finished:
+                    break
+
+                if received:
+                    interval = self.follow_min_interval
+                    continue
+
+                if tr_finished is not None:
+                    if tr_finished.is_set():
+                        continue
+                elif ref.trId is not None and ref.scope != LogScope.USER:
+                    try:
+                        finished = not self.__is_running(ref.trId)
+                    except (errors.ConnectionError, errors.Timeout):
+                        pass
+                    if finished:
+                        continue
+                elif received is None:
+                    break
+
+                if tr_finished is not None:
+                    tr_finished.wait(interval)
+                elif cancel is not None:
+                    cancel.wait(interval)
+                else:
+                    time.sleep(interval)
+                interval = min(self.follow_max_interval, interval * 2.0)
+        finally:
+            writer.close()
+        return found
+
+    def read_logs(self,
+                  refs: List[LogRef],
+                  output: io.RawIOBase = sys.stdout,
+                  merge: LogMerge = LogMerge.SOURCE,
+                  jobs: int = 8) -> List[LogRef]:
+        """
+        Параллельное чтение нескольких логов (например, логов всех фрагментов и исполнений транзакции)
+        и вывод в один поток. Каждая строка помечается источником `[frPath/dam:logId]`.
+
+        :param merge: `SOURCE` - логи выводятся целиком в порядке `refs`; первый выводится по мере
+                      получения, остальные тем временем читаются во временные файлы,
+                      `TIMESTAMP` - строки упорядочиваются по метке времени в начале строки
+        :return: ненайденные логи
+        """
+        def fetch(ref: LogRef, spool: _LogSpool):
+            try:
+                spool.finish(self.read_log(ref, spool, binary=True))
+            except BaseException as e:
+                spool.finish(False, e)
+
+        spools = [_LogSpool(self.chunk_size) for _ in refs]
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+                for ref, spool in zip(refs, spools):
+                    executor.submit(fetch, ref, spool)
+
+                if merge == LogMerge.SOURCE:
+                    for ref, spool in zip(refs, spools):
+                        label = log_label(ref)
+                        for line in spool.lines():
+                            output.write(f'[{label}] {line}')
+                else:
+                    sources = [_timestamped_lines(log_label(ref), spool.lines()) for ref, spool in zip(refs, spools)]
+                    for ts, line in heapq.merge(*sources, key=lambda item: item[0]):
+                        output.write(line)
+        finally:
+            for spool in spools:
+                spool.close()
+        return [ref for ref, spool in zip(refs, spools) if not spool.found]
+
+    def __read_tail(self, path: str, writer: _LogWriter, log_filter: LogFilter, tail: int) -> bool:
+        """
+        Чтение последних `tail` строк запросами `Range: bytes=-N` с увеличением N, пока строк не хватит.
+        Если сервер не поддерживает Range, весь лог проходит через кольцевой буфер фильтра.
+        """
+        size = max(4096, tail * 256)
+        while True:
+            resp = self._ctx.http_get(path, timeout=self.read_timeout, stream=True, ignore_errors=True,
+                                      headers=dict(_RAW_LOG_HEADERS, Range=f'bytes=-{size}'))
+            with resp:
+                if resp.status_code == 404:
+                    return False
+                if resp.status_code == 416:
+                    return True
+                if resp.status_code == 200:
+                    for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                        writer.write(chunk)
+                    writer.close()
+                    log_filter.close()
+                    return True
+                if resp.status_code != 206:
+                    self._ctx.raise_if_failed(resp)
+
+                content_range = re.match(r'bytes (\d+)-\d+/', resp.headers.get('Content-Range', ''))
+                start = int(content_range.group(1)) if content_range else 0
+                data = resp.content
+
+            lines = data.decode('utf-8', errors='replace').splitlines(keepends=True)
+            # первая строка фрагмента может оказаться обрезанной
+            if start > 0:
+                lines = lines[1:]
+            if (len(lines) >= tail) or (start == 0):
+                log_filter.output.writelines(lines[max(0, len(lines) - tail):] if tail > 0 else [])
+                log_filter.output.flush()
+                return True
+            size *= 4
+
+    def filter_log(self,
+                   ref: LogRef,
+                   output: io.RawIOBase = sys.stdout,
+                   grep: Optional[str] = None,
+                   head: Optional[int] = None,
+                   tail: Optional[int] = None) -> bool:
+        """
+        Чтение лога с построчной фильтрацией (см. `LogFilter`). Чтение прекращается, как только
+        набрано `head` строк. Для `tail` без других фильтров запрашивается только конец лога.
+        """
+        path = self.log_path(ref)
+        if path is None:
+            return False
+
+        log_filter = LogFilter(output, grep, head, tail)
+        writer = _LogWriter(log_filter, binary=False, until=lambda: log_filter.done)
+
+        key = self.__cache_key(ref)
+        if (key is not None) and self.cache.read_into(key, writer.write, self.chunk_size):
+            found = True
+        elif (tail is not None) and (grep is None) and (head is None):
+            return self.__read_tail(path, writer, log_filter, tail)
+        else:
+            found = self.__read_stream(writer, path, self.read_timeout) is not None
+
+        if found:
+            writer.close()
+            log_filter.close()
+        return found
+
+    def read_log(self, ref: LogRef, output: io.RawIOBase = sys.stdout, binary: bool = False) -> bool:
+        path = self.log_path(ref)
+        if path is None:
+            return False
+        if self.__cache_key(ref) is not None:
+            return self.__read_cached(ref, path, output, binary)
+        return self.__read_log(output, path, binary)
 
-    def read_user_log(self, log_id: LogName, output: io.RawIOBase = sys.stdout) -> bool:
+    def read_user_log(self, log_id: LogName, output: io.RawIOBase = sys.stdout, binary: bool = False) -> bool:
         """Чтение лога log_id со скоупом USER"""
-        return self.__read_log(output, f'/vm/logs/{log_id}')
+        return self.read_log(LogRef(LogScope.USER, self._ctx.user_id, log_id), output, binary)
 
-    def read_tr_log(self, tr_id: TransactionId, log_id: LogName, output: io.RawIOBase = sys.stdout) -> bool:
+    def read_tr_log(self, tr_id: TransactionId, log_id: LogName, output: io.RawIOBase = sys.stdout, binary: bool = False) -> bool:
         """Чтение лога log_id со скоупом TRANSACTION"""
-        return self.__read_log(output, f'/vm/transactions/{tr_id}/logs/{log_id}')
+        return self.read_log(LogRef(LogScope.TRANSACTION, self._ctx.user_id, log_id, trId=tr_id), output, binary)
 
-    def read_fragment_log(self, tr_id: TransactionId, fr_path: FragmentPath, log_id: LogName, output: io.RawIOBase = sys.stdout) -> bool:
+    def read_fragment_log(self, tr_id: TransactionId, fr_path: FragmentPath, log_id: LogName, output: io.RawIOBase = sys.stdout, binary: bool = False) -> bool:
         """Чтение лога log_id со скоупом FRAGMENT"""
-        return self.__read_log(output, f'/vm/transactions/{tr_id}/fragments/{fr_path}/logs/{log_id}')
+        return self.read_log(LogRef(LogScope.FRAGMENT, self._ctx.user_id, log_id, trId=tr_id, frPath=fr_path), output, binary)
 
-    def read_execution_log(self, tr_id: TransactionId, fr_path: FragmentPath, dam: str, log_id: LogName, output: io.RawIOBase = sys.stdout) -> bool:
+    def read_execution_log(self, tr_id: TransactionId, fr_path: FragmentPath, dam: str, log_id: LogName, output: io.RawIOBase = sys.stdout, binary: bool = False) -> bool:
         """Чтение лога log_id со скоупом EXECUTION"""
-        return self.__read_log(output, f'/vm/transactions/{tr_id}/fragments/{fr_path}/executions/{dam}/logs/{log_id}')
\ No newline at end of file
+        return self.read_log(LogRef(LogScope.EXECUTION, self._ctx.user_id, log_id, trId=tr_id, frPath=fr_path, dam=dam), output, binary)
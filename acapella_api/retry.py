@@ -0,0 +1,52 @@
+import random
+from typing import Optional, Collection
+
+from .common import Deadline
+
+
+class RetryPolicy(object):
+    """
+    Политика повторов HTTP-запросов `ApiContext`.
+
+    Повторяются только идемпотентные запросы: GET и запросы, явно отмеченные `idempotent=True`
+    (например, `/vm/start` с заданным клиентом `transactionId`). Запросы с телом-генератором
+    не повторяются никогда - тело уже прочитано. Повод для повтора - ошибка соединения
+    или статус из `retry_statuses`; пауза между попытками растёт экспоненциально со случайным
+    разбросом ("full jitter"), все попытки укладываются в общий бюджет `budget_sec`.
+    """
+    def __init__(self,
+                 max_attempts: int = 4,
+                 backoff_base_sec: float = 0.1,
+                 backoff_max_sec: float = 5.0,
+                 budget_sec: Optional[float] = 30.0,
+                 retry_statuses: Collection[int] = (429, 502, 503, 504),
+                 hedge_delay_sec: Optional[float] = None):
+        """
+        :param max_attempts: максимальное количество попыток, включая первую
+        :param backoff_base_sec: пауза перед первым повтором (верхняя граница разброса)
+        :param backoff_max_sec: максимальная пауза между попытками
+        :param budget_sec: общий бюджет времени всех попыток, `None` - без ограничения
+        :param retry_statuses: HTTP-статусы временных ошибок сервера
+        :param hedge_delay_sec: через сколько секунд без ответа отправлять дублирующий запрос
+                                для запросов, отмеченных `hedge=True`; `None` - не дублировать
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec = backoff_max_sec
+        self.budget_sec = budget_sec
+        self.retry_statuses = frozenset(retry_statuses)
+        self.hedge_delay_sec = hedge_delay_sec
+
+    def deadline(self) -> Deadline:
+        return Deadline(self.budget_sec)
+
+    def backoff(self, attempt: int) -> float:
+        """Пауза после неудачной попытки номер `attempt` (с нуля)"""
+        return random.uniform(0, min(self.backoff_max_sec, self.backoff_base_sec * (2 ** attempt)))
+
+    def can_retry(self, attempt: int, deadline: Deadline) -> bool:
+        return (attempt + 1 < self.max_attempts) and not deadline.expired()
+
+
+# без повторов: поведение до появления политик
+NO_RETRY = RetryPolicy(max_attempts=1)
@@ -0,0 +1,125 @@
+import math
+import re
+import threading
+from typing import Optional, List, Dict, Tuple
+
+# шаблоны путей API: идентификаторы заменяются именами параметров, чтобы запросы группировались по ресурсу
+_path_templates: List[Tuple['re.Pattern', str]] = [(re.compile(pattern), template) for pattern, template in [
+    (r'^/vm/transactions/[^/]+/fragments/.+/executions/[^/]+/logs/[^/]+$',
+     '/vm/transactions/{trId}/fragments/{frPath}/executions/{dam}/logs/{logId}'),
+    (r'^/vm/transactions/[^/]+/fragments/.+/logs/[^/]+$', '/vm/transactions/{trId}/fragments/{frPath}/logs/{logId}'),
+    (r'^/vm/transactions/[^/]+/logs/[^/]+$', '/vm/transactions/{trId}/logs/{logId}'),
+    (r'^/vm/transactions/[^/]+/status$', '/vm/transactions/{trId}/status'),
+    (r'^/vm/transactions/[^/]+/wait$', '/vm/transactions/{trId}/wait'),
+    (r'^/vm/transactions/[^/]+$', '/vm/transactions/{trId}'),
+    (r'^/vm/logs/[^/]+$', '/vm/logs/{logId}'),
+    (r'^/cb/snapshots/[^/]+/[^/]+/fragments/.+$', '/cb/snapshots/{name}/{tag}/fragments/{path}'),
+    (r'^/cb/snapshots/[^/]+/[^/]+/freeze$', '/cb/snapshots/{name}/{tag}/freeze'),
+    (r'^/cb/users/[^/]+/snapshots$', '/cb/users/{user}/snapshots'),
+]]
+
+
+def path_template(path: str) -> str:
+    path = path.split('?', 1)[0]
+    for pattern, template in _path_templates:
+        if pattern.match(path):
+            return template
+    return path
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """Перцентиль методом ближайшего ранга"""
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+class AttemptRecord(object):
+    """
+    Одна отправка запроса: первая попытка, повтор или дублирующий (`hedge`) запрос.
+    Время - в секундах и измеряется в потоке, отправившем запрос. `dns_sec` и `connect_sec`
+    (TCP и TLS) равны нулю, если соединение взято из пула. Если версия urllib3 не позволяет
+    измерить разрешение имени отдельно, оно входит в `connect_sec`. `ttfb_sec` - от отправки
+    запроса до заголовков ответа, без установки соединения.
+    """
+    def __init__(self, hedge: bool = False):
+        self.hedge = hedge
+        self.status: Optional[int] = None
+        self.error: Optional[Exception] = None
+        self.dns_sec = 0.0
+        self.connect_sec = 0.0
+        self.ttfb_sec: Optional[float] = None
+        self.total_sec = 0.0
+
+
+class RequestRecord(object):
+    """
+    Сведения об одном вызове `ApiContext.http_request`, передаются в обработчики `ApiContext.add_hook`.
+    Время - в секундах. `dns_sec` и `connect_sec` - суммы по всем попыткам (`attempts`), `ttfb_sec` -
+    у попытки, чей ответ возвращён. Для потоковых ответов (`stream=True`) `total_sec` не включает
+    чтение тела. Проигравший дублирующий запрос может попасть в `attempts` уже после вызова обработчиков.
+    """
+    def __init__(self, method: str, path: str):
+        self.method = method.upper()
+        self.path = path
+        self.template = path_template(path)
+        self.status: Optional[int] = None
+        self.error: Optional[Exception] = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.ttfb_sec: Optional[float] = None
+        self.total_sec = 0.0
+        self.retries = 0
+        self.attempts: List[AttemptRecord] = []
+        # начало запроса по `time.monotonic()`
+        self.started = 0.0
+
+    @property
+    def endpoint(self) -> str:
+        return f'{self.method} {self.template}'
+
+    @property
+    def dns_sec(self) -> float:
+        return sum(a.dns_sec for a in list(self.attempts))
+
+    @property
+    def connect_sec(self) -> float:
+        return sum(a.connect_sec for a in list(self.attempts))
+
+
+class RequestStats(object):
+    """Накопление `RequestRecord` по эндпоинтам; подходит как обработчик для `ApiContext.add_hook`"""
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.records: Dict[str, List[RequestRecord]] = {}
+
+    def __call__(self, record: RequestRecord):
+        with self.__lock:
+            self.records.setdefault(record.endpoint, []).append(record)
+
+    def summary(self, percentiles: List[float] = (50, 90, 99)) -> List[dict]:
+        """Сводка по эндпоинтам в порядке убывания суммарного времени"""
+        with self.__lock:
+            groups = dict((endpoint, list(records)) for endpoint, records in self.records.items())
+
+        rows = []
+        for endpoint, records in groups.items():
+            totals = sorted(r.total_sec for r in records)
+            ttfbs = sorted(r.ttfb_sec for r in records if r.ttfb_sec is not None)
+            rows.append({
+                'endpoint': endpoint,
+                'count': len(records),
+                'errors': sum(1 for r in records if r.error is not None or (r.status or 0) >= 400),
+                'retries': sum(r.retries for r in records),
+                'sent': sum(r.bytes_sent for r in records),
+                'received': sum(r.bytes_received for r in records),
+                'dns': sum(r.dns_sec for r in records),
+                'connect': sum(r.connect_sec for r in records),
+                'ttfb_p50': percentile(ttfbs, 50),
+                'total': sum(totals),
+                'percentiles': [percentile(totals, p) for p in percentiles],
+                'max': totals[-1],
+            })
+        rows.sort(key=lambda row: row['total'], reverse=True)
+        return rows
@@ -1,9 +1,12 @@
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from enum import Enum
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Iterable, Iterator
 
 from .codebase import SnapshotName, SnapshotTag, FragmentPath
-from .common import TransactionId, FragmentReference, UserId, JsonObject
+from .common import TransactionId, FragmentReference, UserId, JsonObject, Deadline, json_loads
 from .context import ApiContext
 from .logs import LoggingParameters, LogParameters, LogOrdering, LogScope
 
@@ -12,6 +15,10 @@ class ExecutionTimeout(Exception):
     pass
 
 
+class WaitCancelled(Exception):
+    pass
+
+
 class TransactionState(Enum):
     RUNNING = 'running'
     ERROR = 'error'
@@ -114,10 +121,43 @@ class TransactionInfo(JsonObject):
         self.status = status
 
 
+class TransactionResult(object):
+    """Итог запуска транзакции из `VmApi.start_many`"""
+    def __init__(self,
+                 params: TransactionParameters,
+                 transaction_id: Optional[TransactionId] = None,
+                 status: Optional[TransactionStatus] = None,
+                 error: Optional[Exception] = None,
+                 latency_sec: Optional[float] = None):
+        self.params = params
+        self.transaction_id = transaction_id
+        self.status = status
+        self.error = error
+        self.latency_sec = latency_sec
+
+
 class VmApi(object):
-    def __init__(self, api_context: ApiContext, transaction_timeout_ms: int = 2 * 60 * 1000):
+    def __init__(self,
+                 api_context: ApiContext,
+                 transaction_timeout_ms: int = 2 * 60 * 1000,
+                 long_poll_timeout_sec: float = 30.0,
+                 poll_min_interval_sec: float = 0.05,
+                 poll_max_interval_sec: float = 1.0,
+                 cancel_poll_slice_sec: float = 2.0):
+        """
+        :param transaction_timeout_ms: бюджет ожидания транзакции по умолчанию
+        :param long_poll_timeout_sec: максимальная длительность одного запроса `/wait`
+        :param poll_min_interval_sec: начальный интервал опроса статуса, если long-poll не дождался завершения
+        :param poll_max_interval_sec: максимальный интервал опроса статуса
+        :param cancel_poll_slice_sec: максимальная длительность запроса `/wait` при ожидании с событием
+                                      отмены: отмена замечается не позже, чем через столько секунд
+        """
         self._ctx = api_context
         self.transaction_timeout_ms = transaction_timeout_ms
+        self.long_poll_timeout_sec = long_poll_timeout_sec
+        self.poll_min_interval_sec = poll_min_interval_sec
+        self.poll_max_interval_sec = poll_max_interval_sec
+        self.cancel_poll_slice_sec = cancel_poll_slice_sec
 
     def call(self,
              sn_owner: UserId,
@@ -180,50 +220,162 @@ class VmApi(object):
         return self.start_transaction(tr_params)
 
     def start_transaction(self, params: TransactionParameters) -> TransactionStartResult:
-        return self.start_transaction_with_raw_params(params.to_json())
+        # с заданным клиентом ID повторный запуск не создаст вторую транзакцию
+        idempotent = getattr(params, 'transactionId', None) is not None
+        return self.start_transaction_with_raw_params(params.to_json(), idempotent=idempotent)
 
-    def start_transaction_with_raw_params(self, tr_params_json: str) -> TransactionStartResult:
-        response = self._ctx.http_post(f'/vm/start', data=tr_params_json)
+    def start_transaction_with_raw_params(self, tr_params_json: str, idempotent: bool = False) -> TransactionStartResult:
+        """
+        :param idempotent: запрос можно повторить после ошибки соединения (в параметрах задан `transactionId`)
+        """
+        response = self._ctx.http_post('/vm/start', data=tr_params_json, compress=True, idempotent=idempotent)
         return TransactionStartResult(response.json()['transactionId'])
 
     def stop_transaction(self, tr_id: TransactionId) -> None:
-        self._ctx.http_post(f'/vm/stop', data={'trId': tr_id})
+        self._ctx.http_post('/vm/stop', data={'trId': tr_id})
 
     @staticmethod
     def __parse_tr_status(json: Optional[dict]) -> TransactionStatus:
         if json is None:
-            return TransactionStatus(TransactionState.RUNNING)
+            # состояние хранится строкой, как и в статусах, пришедших с сервера
+            return TransactionStatus(TransactionState.RUNNING.value)
         return JsonObject.decode_from_json_dict(TransactionStatus, json)
 
     def get_transaction_status(self, tr_id: TransactionId) -> Optional[TransactionStatus]:
-        json = self._ctx.http_get(f'/vm/transactions/{tr_id}/status').json()
+        json = self._ctx.http_get(f'/vm/transactions/{tr_id}/status', hedge=True).json()
         if json is None:
             return None
         return self.__parse_tr_status(json)
 
     def get_transactions(self) -> List[TransactionInfo]:
-        json = self._ctx.http_get(f'/vm/transactions').json()
+        json = json_loads(self._ctx.http_get('/vm/transactions').content)
         return [JsonObject.decode_from_json_dict(TransactionInfo, tr) for tr in json]
 
     def remove_transaction(self, tr_id: TransactionId):
         self._ctx.http_delete(f'/vm/transactions/{tr_id}')
 
-    def wait_transaction(self, tr_id: TransactionId) -> TransactionStatus:
-        """Ожидание завершения транзакции."""
-        timeout = 0.001
-        deadline = time.time() + self.transaction_timeout_ms
-        while time.time() < deadline:
+    def __wait_status(self, tr_id: TransactionId, deadline: Deadline,
+                      long_poll: Optional[float]) -> Optional[TransactionStatus]:
+        """
+        Один запрос статуса: long-poll `/wait` не дольше `long_poll` секунд или, если `None`, мгновенный `/status`.
+        `None` - не дождались ответа
+        """
+        if long_poll is None:
+            return self.get_transaction_status(tr_id)
+        # бюджет мог истечь после проверки в цикле ожидания: нулевой таймаут запросу передавать нельзя
+        timeout = deadline.timeout(long_poll)
+        if (timeout is not None) and (timeout <= 0):
+            raise ExecutionTimeout()
+        try:
             response = self._ctx.http_get(f'/vm/transactions/{tr_id}/wait',
-                                          timeout=self.transaction_timeout_ms)
-            status = self.__parse_tr_status(response.json())
-            if status.state == TransactionState.RUNNING:
-                time.sleep(timeout)
-                timeout = min(5.0, timeout * 2.0)
-            else:
+                                          timeout=timeout)
+        except self._ctx.http_errors.ReadTimeout:
+            return None
+        return self.__parse_tr_status(response.json())
+
+    def wait_transaction(self,
+                         tr_id: TransactionId,
+                         deadline: Optional[Deadline] = None,
+                         cancel: Optional[threading.Event] = None,
+                         long_poll: bool = True) -> TransactionStatus:
+        """
+        Ожидание завершения транзакции.
+
+        Основной механизм - long-poll запросы `/wait`. Если сервер отвечает раньше, чем
+        завершилась транзакция, следующий запрос выполняется после паузы со случайным
+        разбросом, растущей от `poll_min_interval_sec` до `poll_max_interval_sec`.
+
+        :param deadline: общий бюджет ожидания, по умолчанию `transaction_timeout_ms`
+        :param cancel: событие отмены, проверяется между запросами; запросы `/wait` при этом
+                       короче - не дольше `cancel_poll_slice_sec`
+        :param long_poll: `False` - опрашивать `/status` вместо `/wait`
+        :raises ExecutionTimeout: бюджет исчерпан
+        :raises WaitCancelled: ожидание отменено через `cancel`
+        """
+        if deadline is None:
+            deadline = Deadline(self.transaction_timeout_ms / 1000.0)
+
+        poll_slice = None
+        if long_poll:
+            poll_slice = self.long_poll_timeout_sec
+            if cancel is not None:
+                poll_slice = min(poll_slice, self.cancel_poll_slice_sec)
+
+        interval = self.poll_min_interval_sec
+        while not deadline.expired():
+            if cancel is not None and cancel.is_set():
+                raise WaitCancelled()
+
+            started = time.monotonic()
+            status = self.__wait_status(tr_id, deadline, poll_slice)
+            if status is not None and status.state != TransactionState.RUNNING.value:
                 return status
 
+            # long-poll продержал запрос до конца окна: сразу начинаем следующий
+            if long_poll and (status is None or time.monotonic() - started >= poll_slice / 2):
+                interval = self.poll_min_interval_sec
+                continue
+
+            pause = deadline.timeout(random.uniform(interval / 2, interval))
+            if cancel is not None:
+                cancel.wait(pause)
+            else:
+                time.sleep(pause)
+            interval = min(self.poll_max_interval_sec, interval * 2.0)
+
         raise ExecutionTimeout()
 
+    def __run_transaction(self, params: TransactionParameters, cancel: threading.Event) -> TransactionResult:
+        started = time.monotonic()
+        result = TransactionResult(params)
+        try:
+            result.transaction_id = self.start_transaction(params).transaction_id
+            result.status = self.wait_transaction(result.transaction_id, cancel=cancel)
+        except Exception as e:
+            result.error = e
+        result.latency_sec = time.monotonic() - started
+        return result
+
+    def start_many(self,
+                   params: Iterable[TransactionParameters],
+                   max_in_flight: int = 16,
+                   cancel: Optional[threading.Event] = None) -> Iterator[TransactionResult]:
+        """
+        Запуск множества транзакций. Одновременно исполняется не более `max_in_flight` транзакций,
+        следующие параметры берутся из `params` по мере завершения предыдущих.
+        Результаты возвращаются в порядке завершения, ошибки запуска и ожидания - в `TransactionResult.error`.
+        """
+        own_cancel = cancel is None
+        if own_cancel:
+            cancel = threading.Event()
+        params_iter = iter(params)
+        max_in_flight = max(1, max_in_flight)
+
+        executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        in_flight = set()
+
+        def submit_next() -> bool:
+            next_params = next(params_iter, None)
+            if next_params is None:
+                return False
+            in_flight.add(executor.submit(self.__run_transaction, next_params, cancel))
+            return True
+
+        try:
+            while len(in_flight) < max_in_flight and submit_next():
+                pass
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    submit_next()
+                    yield future.result()
+        finally:
+            # итерацию прервали: незапущенные задачи отменяются, а ожидания в работе завершатся сами
+            # не позже `cancel_poll_slice_sec`, не задерживая вызывающий код
+            if own_cancel:
+                cancel.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def get_version(self) -> str:
-        response = self._ctx.http_get(f'/vm/version')
+        response = self._ctx.http_get('/vm/version')
         return response.text
@@ -0,0 +1,124 @@
+import argparse
+import copy
+import sys
+import time
+from typing import List, Iterator
+
+from acapella_api.stats import percentile
+from acapella_api.vm import TransactionParameters, TransactionState, TransactionResult
+from .cmd_start import StartCommand
+from .cmd_upload import parse_fr_ref
+from .context import ap
+from .formatters import to_duration, format_size
+from .presets import preset_names
+
+
+class BenchCommand:
+    doc = 'run fragment many times and report latency percentiles'
+    name = 'bench'
+    need_auth = True
+
+    percentiles = [50, 90, 99]
+
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(description=self.doc, prog=f'acapella {self.name}', formatter_class=argparse.RawTextHelpFormatter)
+
+        self.parser.add_argument('fname', type=str,
+                                 help='full fragment reference. Format: `<SnapshotOwner>/<SnapshotName>/<SnapshotTag>:path/to/fragment.lua`')
+
+        self.parser.add_argument('--count', '-n', type=int, default=100, dest='count',
+                                 help='number of transactions (default: 100)')
+        self.parser.add_argument('--concurrency', '-c', type=int, default=8, dest='concurrency',
+                                 help='max number of concurrently running transactions (default: 8)')
+        self.parser.add_argument('--rate', type=float, default=None, dest='rate',
+                                 help='target rate of transaction starts per second (default: as fast as concurrency allows)')
+        self.parser.add_argument('--args', type=str, dest='dict_of_args', default=None,
+                                 help='map of root fragment arguments: {"p1":"v1", "p2":"v2"}')
+        self.parser.add_argument('--kvio', action='store_true',
+                                 help='allow TVM KV IO')
+        self.parser.add_argument('--preset', type=str, dest='preset', default="transactional",
+                                 help=preset_names)
+
+    def make_params(self, args) -> Iterator[TransactionParameters]:
+        start_cmd = StartCommand()
+        tr_params = start_cmd.get_preset(args.preset)
+        tr_params = copy.deepcopy(tr_params)
+        tr_params.arguments = start_cmd.parse_fr_args(args.dict_of_args) if args.dict_of_args else {}
+        tr_params.beginKvTransaction = args.kvio
+        tr_params.fragment = args.fname
+
+        interval = (1.0 / args.rate) if args.rate else 0.0
+        next_start = time.monotonic()
+        for _ in range(args.count):
+            if interval > 0:
+                delay = next_start - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_start += interval
+            yield copy.copy(tr_params)
+
+    def handle(self, args: List[str]):
+        args = self.parser.parse_args(args)
+        parse_fr_ref(args.fname)
+
+        if args.count < 1 or args.concurrency < 1:
+            print("'count' and 'concurrency' must be positive", file=sys.stderr)
+            sys.exit(-1)
+
+        print(f"bench {args.fname}: {args.count} transactions, concurrency {args.concurrency}, "
+              f"rate {args.rate if args.rate else 'unlimited'}, '{args.preset}' preset")
+
+        results = []
+        started = time.monotonic()
+        for result in ap.vm.start_many(self.make_params(args), max_in_flight=args.concurrency):
+            results.append(result)
+            if len(results) % max(1, args.count // 10) == 0:
+                print(f'  {len(results)}/{args.count}', file=sys.stderr)
+        wall_time = time.monotonic() - started
+
+        self.print_report(results, wall_time)
+
+    @staticmethod
+    def __is_ok(result: TransactionResult) -> bool:
+        return result.status is not None and result.status.state == TransactionState.FINISHED.value
+
+    def print_report(self, results: List[TransactionResult], wall_time: float):
+        ok = [r for r in results if self.__is_ok(r)]
+        failed = [r for r in results if not self.__is_ok(r)]
+
+        print()
+        print(f"transactions: {len(results)} (finished: {len(ok)}, failed: {len(failed)})")
+        print(f"wall time:    {wall_time:.3f} s")
+        print(f"throughput:   {len(ok) / wall_time if wall_time > 0 else 0.0:.2f} tr/s")
+
+        if ok:
+            stats = [r.status.statistics for r in ok if r.status.statistics]
+            rows = [
+                ('end-to-end (client)', [r.latency_sec * 10**9 for r in ok], to_duration),
+                ('worker exec time',    [int(s.workerExecTime) for s in stats], to_duration),
+                ('node exec time',      [int(s.nodeExecTime) for s in stats], to_duration),
+                ('total conflicts',     [int(s.totalConflicts) for s in stats], str),
+                ('total restarts',      [int(s.totalRestarts) for s in stats], str),
+                ('TVM bytes read',      [int(s.bytesRead) for s in stats], format_size),
+                ('TVM bytes write',     [int(s.bytesWrite) for s in stats], format_size),
+            ]
+
+            print()
+            header = ''.join(f'p{p}'.rjust(16) for p in self.percentiles) + 'max'.rjust(16)
+            print('    {:22}{}'.format('', header))
+            for name, values, fmt in rows:
+                if not values:
+                    continue
+                values = sorted(values)
+                cells = [percentile(values, p) for p in self.percentiles] + [values[-1]]
+                print('    {:22}{}'.format(name, ''.join(fmt(int(v)).rjust(16) for v in cells)))
+
+        if failed:
+            print()
+            print('errors:')
+            errors = {}
+            for r in failed:
+                error = r.status.error if r.status else str(r.error)
+                errors[error] = errors.get(error, 0) + 1
+            for error, count in sorted(errors.items(), key=lambda e: -e[1])[:5]:
+                print(f'    {count} x {error}')
@@ -1,9 +1,11 @@
 import argparse
+import re
 import sys
 from typing import List
 
-from acapella_api.logs import LogScope, LogRef
+from acapella_api.logs import LogScope, LogRef, LogMerge
 from .context import ap
+from .tracing import span
 
 
 class LogCommand:
@@ -14,8 +16,10 @@ class LogCommand:
     def __init__(self):
         self.parser = argparse.ArgumentParser(description=self.doc, prog=f'acapella {self.name}', formatter_class=argparse.RawTextHelpFormatter)
 
-        self.parser.add_argument('logref', type=str,
+        self.parser.add_argument('logref', type=str, nargs='+',
                                  help='reference to log. You can spceify user ID of log owner by prefixing reference with `@username/`.\n'
+                                      'Several references are fetched concurrently and printed as one stream,\n'
+                                      'each line labeled with its source `[frPath/dam:logId]`.\n'
                                       'Examples:'
                                       '  logId\n'
                                       '  trId/logId\n'
@@ -26,11 +30,101 @@ class LogCommand:
                                       '  @user/trId/frId/logId\n'
                                       '  @user/trId/frId/dam/logId')
 
+        self.parser.add_argument('--output', '-o', type=str, default=None, dest='output',
+                                 help='write log to file instead of stdout')
+
+        self.parser.add_argument('--follow', '-f', dest='follow', action='store_true',
+                                 help='keep reading the log until the transaction ends (or Ctrl-C for user logs),\n'
+                                      'resuming from the last received byte after connection errors')
+
+        self.parser.add_argument('--merge', type=str, default=LogMerge.SOURCE.value, dest='merge',
+                                 choices=[m.value for m in LogMerge],
+                                 help="how several logs are combined: 'source' - one log after another,\n"
+                                      "'timestamp' - lines ordered by the timestamp at the start of each line")
+
+        self.parser.add_argument('--jobs', '-j', type=int, default=8, dest='jobs',
+                                 help='number of logs fetched concurrently (default: 8)')
+
+        self.parser.add_argument('--grep', type=str, default=None, dest='grep', metavar='REGEX',
+                                 help='print only lines matching the regular expression')
+
+        self.parser.add_argument('--head', type=int, default=None, dest='head', metavar='N',
+                                 help='print only the first N (matching) lines and stop reading the log')
+
+        self.parser.add_argument('--tail', type=int, default=None, dest='tail', metavar='N',
+                                 help='print only the last N (matching) lines;\n'
+                                      'without --grep/--head only the end of the log is downloaded')
+
     def handle(self, args: List[str]):
         args = self.parser.parse_args(args)
-        ref = self.parse_log_ref(args.logref)
+        refs = [self.parse_log_ref(r) for r in args.logref]
+        filtered = (args.grep is not None) or (args.head is not None) or (args.tail is not None)
+        if filtered:
+            self.read_filtered(args, refs)
+            return
+        if len(refs) > 1:
+            self.read_many(args, refs)
+            return
+
+        ref = refs[0]
         # print(ref.scope, ref.user, ref.trId, ref.frPath, ref.dam, ref.logId)
-        ap.logs.read_log(ref)
+
+        # лог копируется без декодирования: байты пишутся в файл или в буфер stdout как есть
+        read = ap.logs.follow_log if args.follow else ap.logs.read_log
+        with span('read log', ref=args.logref[0]):
+            if args.output:
+                with open(args.output, 'wb') as output:
+                    found = read(ref, output, binary=True)
+            else:
+                found = read(ref, sys.stdout, binary=True)
+
+        if not found:
+            print(f"log not found: {args.logref[0]}", file=sys.stderr)
+            sys.exit(-1)
+
+    def read_filtered(self, args, refs: List[LogRef]):
+        if (len(refs) > 1) or args.follow:
+            print("options 'grep', 'head' and 'tail' support a single log reference without 'follow'", file=sys.stderr)
+            sys.exit(-1)
+        if ((args.head is not None) and (args.head < 0)) or ((args.tail is not None) and (args.tail < 0)):
+            print("options 'head' and 'tail' must not be negative", file=sys.stderr)
+            sys.exit(-1)
+        if args.grep is not None:
+            try:
+                re.compile(args.grep)
+            except re.error as e:
+                print(f"invalid regular expression: {e}", file=sys.stderr)
+                sys.exit(-1)
+
+        options = dict(grep=args.grep, head=args.head, tail=args.tail)
+        with span('read log', ref=args.logref[0]):
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as output:
+                    found = ap.logs.filter_log(refs[0], output, **options)
+            else:
+                found = ap.logs.filter_log(refs[0], sys.stdout, **options)
+
+        if not found:
+            print(f"log not found: {args.logref[0]}", file=sys.stderr)
+            sys.exit(-1)
+
+    def read_many(self, args, refs: List[LogRef]):
+        if args.follow:
+            print("option 'follow' supports a single log reference only", file=sys.stderr)
+            sys.exit(-1)
+
+        merge = LogMerge(args.merge)
+        with span('read log', ref=' '.join(args.logref)):
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as output:
+                    not_found = ap.logs.read_logs(refs, output, merge=merge, jobs=args.jobs)
+            else:
+                not_found = ap.logs.read_logs(refs, sys.stdout, merge=merge, jobs=args.jobs)
+
+        for ref in not_found:
+            print(f"log not found: {args.logref[refs.index(ref)]}", file=sys.stderr)
+        if len(not_found) == len(refs):
+            sys.exit(-1)
 
     def __invalid_ref(self, ref: str):
         print(f"invalid log reference: {ref}", file=sys.stderr)
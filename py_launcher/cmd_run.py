@@ -1,11 +1,13 @@
 import argparse
-import os
 import sys
 from typing import List
 
 from .cmd_start import StartCommand
 from .cmd_upload import UploadCommand
-from .context import dir_path
+from acapella_api.vm import TransactionState
+
+from .context import dir_path, ap
+from .tracing import span
 
 
 class RunCommand:
@@ -32,14 +34,30 @@ class RunCommand:
                                  help='specify root directory of the snapshot')
         self.parser.add_argument('--sn_name', type=str, default=None, dest='sn_name',
                                  help='name of the new snapshot')
+        self.parser.add_argument('--jobs', '-j', type=int, default=8, dest='jobs',
+                                 help='number of fragments uploaded concurrently (default: 8)')
+        self.parser.add_argument('--nomanifest', dest='no_manifest', action='store_true',
+                                 help='always create a new snapshot, ignoring locally remembered ones')
+        self.parser.add_argument('--pipeline', dest='pipeline', action='store_true',
+                                 help='read and encode fragments in a separate thread while others are being sent,\n'
+                                      'and print timings of upload stages')
 
     def handle(self, args: List[str]):
-        args = self.parser.parse_args(args)
+        with span('parse arguments'):
+            args = self.parser.parse_args(args)
+        if args.compress:
+            ap.set_compression(args.compress)
+
+        if args.batch:
+            print("option 'batch' is not supported by 'run', use 'start --batch'", file=sys.stderr)
+            sys.exit(-1)
+
+        if not args.fname:
+            print("fragment file path is required", file=sys.stderr)
+            sys.exit(-1)
 
         search_path = args.path if args.path else dir_path
-        fragments = self.upload_cmd.search_fragment_files(
-            files = os.listdir(args.path if args.path else dir_path)
-        )
+        fragments = self.upload_cmd.search_fragment_files(['.'], root=search_path)
 
         if len(fragments) == 0:
             print(f"fragments not found in '{search_path}'", file=sys.stderr)
@@ -52,8 +70,15 @@ class RunCommand:
             print(f"fragment not found: '{args.fname}'\nAvailable:\n  {fr_paths}", file=sys.stderr)
             sys.exit(-1)
 
-        sn_id = self.upload_cmd.upload_fragments(fragments, args.sn_name)
+        sn_id = self.upload_cmd.upload_fragments(fragments, args.sn_name, jobs=args.jobs,
+                                                 use_manifest=(not args.no_manifest), pipeline=args.pipeline)
 
         args.fname = str(sn_id) + ':' + args.fname
 
-        self.start_cmd.run(args)
\ No newline at end of file
+        status = self.start_cmd.run(args)
+        if (status is not None) and (status.state == TransactionState.ERROR.value) \
+                and self.upload_cmd.forget_missing_snapshot():
+            print(f"snapshot '{sn_id}' no longer exists on the server and was removed from the local manifest,\n"
+                  f"run the command again to upload fragments to a new snapshot", file=sys.stderr)
+        if args.compress:
+            print('traffic:', ap.traffic.summary(), file=sys.stderr)
\ No newline at end of file
@@ -1,13 +1,106 @@
 import argparse
+import copy
+import io
 import json
+import os
+import shutil
 import sys
-from typing import List
+import tempfile
+import threading
+from typing import List, Iterator, Tuple, Optional
 
-from acapella_api.vm import TransactionParameters, ExecutionTimeout, TransactionStatus, TransactionState
-from .cmd_upload import parse_fr_ref
+from acapella_api.common import Deadline
+from acapella_api.logs import LogRef, LogScope
+from acapella_api.vm import TransactionParameters, ExecutionTimeout, TransactionStatus, TransactionState, TransactionResult
+from .cmd_upload import parse_fr_ref, MalformedFragmentReference, add_compress_argument
 from .context import ap
 from .formatters import to_duration, to_date, format_size
-from .presets import preset_names, presets
+from .presets import preset_names, presets, load_presets
+from .tracing import span
+
+# сколько ждать дочитывания лога после завершения транзакции, если бюджет ожидания уже исчерпан
+LOG_GRACE_SEC = 5.0
+# сколько ждать остановки чтения лога после отмены
+LOG_CANCEL_SEC = 2.0
+
+
+class DetachableOutput(object):
+    """Байтовый приёмник лога, который можно отключить: после `detach()` запись отбрасывается"""
+    def __init__(self, output):
+        if isinstance(output, io.TextIOBase):
+            output.flush()
+            output = output.buffer
+        self.__output = output
+        self.__lock = threading.Lock()
+        self.__detached = False
+
+    def write(self, data: bytes):
+        with self.__lock:
+            if not self.__detached:
+                self.__output.write(data)
+
+    def flush(self):
+        with self.__lock:
+            if not self.__detached:
+                self.__output.flush()
+
+    def detach(self):
+        with self.__lock:
+            self.__detached = True
+
+
+class LogReaderThread(threading.Thread):
+    """Поток чтения лога транзакции; результат и ошибка чтения сохраняются для основного потока"""
+    def __init__(self, ref: LogRef, output, cancel: threading.Event, tr_finished: threading.Event):
+        # поток-демон: при Ctrl-C не дожидаемся, пока оборвётся текущий запрос лога
+        super().__init__(name='log-reader', daemon=True)
+        self.ref = ref
+        self.output = DetachableOutput(output)
+        self.cancel = cancel
+        self.tr_finished = tr_finished
+        self.found = False
+        self.complete = True
+        self.error: Optional[Exception] = None
+
+    def run(self):
+        try:
+            with span('follow_log'):
+                self.found = ap.logs.follow_log(ref=self.ref, output=self.output, binary=True,
+                                                cancel=self.cancel, tr_finished=self.tr_finished)
+        except Exception as e:
+            self.error = e
+
+    def finish(self, deadline: Deadline):
+        """
+        Ожидание дочитывания лога после завершения транзакции. Если поток не успел, чтение
+        отменяется и лог помечается неполным; после возврата поток больше не пишет в `output`.
+        """
+        self.tr_finished.set()
+        self.join(max(deadline.remaining(), LOG_GRACE_SEC))
+        if self.is_alive():
+            self.complete = False
+            self.stop()
+
+    def stop(self):
+        """
+        Отмена чтения. `follow_log` проверяет отмену между блоками ответа; если блоки не приходят,
+        поток не дожидаемся, а его дальнейшая запись в `output` отбрасывается.
+        """
+        self.cancel.set()
+        self.join(LOG_CANCEL_SEC)
+        self.output.detach()
+
+    def report(self) -> bool:
+        """:return: `True`, если лог прочитан и его можно выводить"""
+        if self.error is not None:
+            print(f'failed to read log: {self.error}', file=sys.stderr)
+            return False
+        if not self.found:
+            print('log not found', file=sys.stderr)
+            return False
+        if not self.complete:
+            print('log is incomplete: reading was cancelled', file=sys.stderr)
+        return True
 
 
 class StartCommand:
@@ -18,7 +111,7 @@ class StartCommand:
     def __init__(self):
         self.parser = argparse.ArgumentParser(description=self.doc, prog=f'acapella {self.name}', formatter_class=argparse.RawTextHelpFormatter)
 
-        self.parser.add_argument('fname', type=str,
+        self.parser.add_argument('fname', type=str, nargs='?', default=None,
                             help='full fragment reference. Format: `<SnapshotOwner>/<SnapshotName>/<SnapshotTag>:path/to/fragment.lua`')
 
         self.parser.add_argument('--trid', type=str, default=None, dest='trid',
@@ -29,13 +122,37 @@ class StartCommand:
                             help='allow TVM KV IO')
         self.parser.add_argument('--log', type=str, dest='log', default="offline",
                             help='logging mode: realtime, offline, none')
+        self.parser.add_argument('--stop_on_interrupt', action='store_true',
+                            help='stop the transaction on Ctrl-C (by default only the client stops waiting)')
         self.parser.add_argument('--preset', type=str, dest='preset', default="transactional",
                                  help= preset_names + '.\nYou can add your custom preset: just put \'*.json\' file of preset to the launcher folder')
+        self.parser.add_argument('--batch', type=str, dest='batch', default=None,
+                                 help='start transactions listed in a JSON Lines file (\'-\' for stdin), one object per line:\n'
+                                      '  {"fragment": "<SnapshotOwner>/<SnapshotName>/<SnapshotTag>:path/to/fragment.lua",\n'
+                                      '   "args": {"p1": "v1"}, "preset": "transactional", "kvio": false, "trid": "custom-id"}\n'
+                                      'only "fragment" is required. One JSON line is printed per finished transaction')
+        self.parser.add_argument('--inflight', type=int, dest='inflight', default=16,
+                                 help='max number of concurrently running transactions in batch mode (default: 16)')
+        add_compress_argument(self.parser)
 
     def handle(self, args: List[str]):
-        self.run(self.parser.parse_args(args))
+        with span('parse arguments'):
+            args = self.parser.parse_args(args)
+        if args.compress:
+            ap.set_compression(args.compress)
+        self.run(args)
+        if args.compress:
+            print('traffic:', ap.traffic.summary(), file=sys.stderr)
+
+    def run(self, args) -> Optional[TransactionStatus]:
+        if args.batch:
+            self.run_batch(args)
+            return
+
+        if not args.fname:
+            print("fragment reference is required", file=sys.stderr)
+            sys.exit(-1)
 
-    def run(self, args):
         parse_fr_ref(args.fname)
 
         if args.log and not (args.log in ['realtime', 'offline', 'none']):
@@ -49,41 +166,158 @@ class StartCommand:
         tr_params.transactionId = args.trid
         tr_params.fragment = args.fname
 
-        self.start_transaction(args, tr_params)
+        return self.start_transaction(args, tr_params)
 
-    def start_transaction(self, args, tr_params: TransactionParameters):
+    def start_transaction(self, args, tr_params: TransactionParameters) -> Optional[TransactionStatus]:
+        """:return: итоговый статус транзакции или `None`, если её не удалось дождаться"""
         print(ap.vm.get_version())
         print("using '" + args.preset + "' preset")
         print("start fragment:", tr_params.fragment)
 
-        tr_id = ap.vm.start_transaction(tr_params).transaction_id
+        with span('start_transaction'):
+            tr_id = ap.vm.start_transaction(tr_params).transaction_id
 
         print("transaction started:", tr_id)
 
+        # лог читается параллельно с ожиданием статуса; оба используют общий бюджет времени и общую отмену
+        deadline = Deadline(ap.vm.transaction_timeout_ms / 1000.0)
+        cancel = threading.Event()
+        tr_finished = threading.Event()
+
+        log_output = None
+        log_thread = None
         if args.log == "realtime":
-            print("log:\n")
-            ap.logs.read_tr_log(tr_id, log_id="log")
-            print()
+            print("log:\n", flush=True)
+            log_thread = self.start_log_thread(tr_id, sys.stdout, cancel, tr_finished)
+        elif args.log == "offline":
+            log_output = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+            log_thread = self.start_log_thread(tr_id, log_output, cancel, tr_finished)
 
         try:
-            status = ap.vm.wait_transaction(tr_id)
+            try:
+                with span('wait_transaction'):
+                    status = ap.vm.wait_transaction(tr_id, deadline=deadline, cancel=cancel)
+            finally:
+                tr_finished.set()
+            if log_thread is not None:
+                log_thread.finish(deadline)
+        except KeyboardInterrupt:
+            cancel.set()
+            print("\ninterrupted", file=sys.stderr)
+            if args.stop_on_interrupt:
+                ap.vm.stop_transaction(tr_id)
+                print("transaction stopped:", tr_id, file=sys.stderr)
+            sys.exit(-1)
         except ExecutionTimeout:
+            if log_thread is not None:
+                log_thread.stop()
+            else:
+                cancel.set()
             print("execution timeout", file=sys.stderr)
-            return
+            return None
+
+        if args.log == "realtime":
+            print()
+            log_thread.report()
 
         self.print_result(status)
         if status.state != TransactionState.FINISHED.value:
-            return
+            return status
 
-        if args.log == "offline":
-            print("log:\n")
-            ap.logs.read_tr_log(tr_id, log_id="log")
+        if (log_output is not None) and log_thread.report():
+            print("log:\n", flush=True)
+            log_output.seek(0)
+            shutil.copyfileobj(log_output, sys.stdout.buffer)
+            sys.stdout.buffer.flush()
             print()
+        return status
+
+    @staticmethod
+    def start_log_thread(tr_id, output, cancel: threading.Event, tr_finished: threading.Event) -> LogReaderThread:
+        ref = LogRef(LogScope.TRANSACTION, ap.auth.user_id, "log", trId=tr_id)
+        thread = LogReaderThread(ref, output, cancel, tr_finished)
+        thread.start()
+        return thread
+
+    def batch_params(self, job, args) -> TransactionParameters:
+        if type(job) != dict:
+            raise ValueError('must be JSON object')
+
+        fragment = job.get('fragment')
+        if not isinstance(fragment, str):
+            raise ValueError("'fragment' is required")
+        try:
+            parse_fr_ref(fragment)
+        except MalformedFragmentReference:
+            raise ValueError(f"malformed fragment reference: '{fragment}'")
+
+        preset = job.get('preset', args.preset)
+        if not (preset in presets):
+            raise ValueError(f"invalid preset: '{preset}'")
 
+        arguments = job.get('args', {})
+        if type(arguments) != dict:
+            raise ValueError("'args' must be dictionary")
+
+        tr_params = copy.deepcopy(presets[preset])
+        tr_params.arguments = arguments
+        tr_params.beginKvTransaction = bool(job.get('kvio', args.kvio))
+        tr_params.transactionId = job.get('trid')
+        tr_params.fragment = fragment
+        return tr_params
+
+    def read_batch(self, args) -> Iterator[Tuple[int, TransactionParameters]]:
+        batch_file = sys.stdin if args.batch == '-' else open(args.batch, 'r')
+        with batch_file:
+            for line_no, line in enumerate(batch_file, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield line_no, self.batch_params(json.loads(line), args)
+                except ValueError as e:
+                    print(f"{args.batch}:{line_no}: {e}", file=sys.stderr)
+
+    @staticmethod
+    def batch_result_json(line_no: int, result: TransactionResult) -> dict:
+        status = result.status
+        return {
+            'line': line_no,
+            'fragment': result.params.fragment,
+            'transactionId': result.transaction_id,
+            'state': status.state if status else TransactionState.ERROR.value,
+            'result': status.result if status else None,
+            'error': status.error if status else str(result.error),
+            'latencyMs': int(result.latency_sec * 1000),
+        }
+
+    def run_batch(self, args):
+        if not args.batch == '-' and not os.path.isfile(args.batch):
+            print(f"batch file not found: '{args.batch}'", file=sys.stderr)
+            sys.exit(-1)
+
+        load_presets()
+        line_by_params = {}
+
+        def batch_params():
+            for line_no, tr_params in self.read_batch(args):
+                line_by_params[id(tr_params)] = line_no
+                yield tr_params
+
+        failed = 0
+        for result in ap.vm.start_many(batch_params(), max_in_flight=args.inflight):
+            line_no = line_by_params.pop(id(result.params))
+            result_json = self.batch_result_json(line_no, result)
+            if result_json['state'] != TransactionState.FINISHED.value:
+                failed += 1
+            print(json.dumps(result_json), flush=True)
+
+        if failed > 0:
+            sys.exit(-1)
 
-    def parse_fr_args(self, dict_of_args) -> dict:
+    def parse_fr_args(self, tr_args_json: str) -> dict:
         try:
-            dict_of_args = json.loads(dict_of_args)
+            dict_of_args = json.loads(tr_args_json)
         except Exception:
             example = {'p1': 'v1', 'p2': 'v2'}
             print(f"malformed fragment arguments: '{tr_args_json}'\n"
@@ -143,8 +377,9 @@ class StartCommand:
             raise RuntimeError(f"unexpected state '{state}'")
 
     def get_preset(self, name) -> TransactionParameters:
+        load_presets()
         try:
             return presets[name]
         except KeyError:
-            print(f"invalid preset: '{args.preset}'\navailable: {preset_names}", file=sys.stderr)
+            print(f"invalid preset: '{name}'\navailable: {preset_names}", file=sys.stderr)
             sys.exit(-1)
\ No newline at end of file
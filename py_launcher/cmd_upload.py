@@ -1,36 +1,68 @@
 import argparse
-import hashlib
 import os
+import queue
 import sys
-from typing import List, Optional, Set, Mapping, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from typing import List, Optional, Set, Mapping, Tuple, Iterator, Iterable
 
 from acapella_api.codebase import SnapshotName, SnapshotId, ExecutorType, SnapshotMeta, SnapshotTag
 from acapella_api.common import UserId, FragmentReference
+from acapella_api.compression import available_encodings
 from .context import dir_path, launcher_path, ap
+from .file_walker import walk_files
+from .hash_cache import HashCache, sha1_digest
+from .snapshot_manifest import SnapshotManifest
+from .tracing import span
 
 execTypesByExt: Mapping[str, Set[ExecutorType]] = {
     "py": [ExecutorType.CPYTHON],
     "lua": [ExecutorType.VM_LUAJ],
 }
 
+# фрагменты больше этого размера загружаются потоком, без чтения файла целиком
+STREAM_UPLOAD_MIN_SIZE = 2**20
+
 
 class FragmentFile:
-    def __init__(self, path: str, rel_path: str, ext: str, exec_types: Set[ExecutorType]):
+    def __init__(self, path: str, rel_path: str, ext: str, exec_types: Set[ExecutorType], hash: Optional[str] = None):
         self.path = path
         self.rel_path = rel_path
         self.ext = ext
         self.exec_types = exec_types
-        self.hash = sha1_digest(path)
+        self.hash = hash if hash else sha1_digest(path)
+
+
+class FragmentUploadError(Exception):
+    def __init__(self, failures: List[Tuple[FragmentFile, Exception]], skipped: int = 0):
+        super().__init__(f'{len(failures)} fragment(s) failed to upload')
+        self.failures = failures
+        self.skipped = skipped
+
+
+class StageTimings:
+    """Длительность этапов загрузки, секунды, в порядке их начала. При `--trace` этапы попадают и в трассировку"""
+    def __init__(self):
+        self.stages: List[Tuple[str, float]] = []
+
+    def add(self, name: str, seconds: float):
+        self.stages.append((name, seconds))
 
+    @contextmanager
+    def measure(self, name: str):
+        started = time.monotonic()
+        try:
+            with span(name):
+                yield
+        finally:
+            self.add(name, time.monotonic() - started)
 
-def sha1_digest(path: str) -> str:
-    sha1 = hashlib.sha1()
-    with open(path, 'rb') as source:
-        block = source.read(2**16)
-        while len(block) != 0:
-            sha1.update(block)
-            block = source.read(2**16)
-    return sha1.hexdigest()
+    def print(self):
+        print('stage timings:')
+        for name, seconds in self.stages:
+            print('    {:18} {:8.3f}s'.format(name + ':', seconds))
 
 
 class MalformedSnapshotId(Exception):
@@ -45,6 +77,13 @@ class MalformedFragmentReference(Exception):
         self.fr_ref = fr_ref
 
 
+def add_compress_argument(parser: argparse.ArgumentParser):
+    parser.add_argument('--compress', type=str, nargs='?', const='gzip', default=None, dest='compress',
+                        choices=available_encodings(),
+                        help='compress request bodies of uploads and transaction starts (default: gzip);\n'
+                             'the server must accept the Content-Encoding of requests')
+
+
 def parse_snapshot_id(sn_id: str) -> SnapshotId:
     parts = sn_id.split('/')
     if not (len(parts) in [2, 3]):
@@ -70,6 +109,9 @@ class UploadCommand:
     need_auth = True
 
     def __init__(self):
+        self.timings = StageTimings()
+        # снапшот, взятый из локального индекса последним вызовом `get_or_create_snapshot`
+        self.manifest_snapshot: Optional[SnapshotId] = None
         self.parser = argparse.ArgumentParser(description=self.doc, prog=f'acapella {self.name}', formatter_class=argparse.RawTextHelpFormatter)
 
         self.parser.add_argument('files', type=str, action='append',
@@ -84,8 +126,23 @@ class UploadCommand:
         self.parser.add_argument('--nofreeze', dest='no_freeze', action='store_true',
                                  help='do not freeze snapshot after upload')
 
+        self.parser.add_argument('--jobs', '-j', type=int, default=8, dest='jobs',
+                                 help='number of fragments uploaded concurrently (default: 8)')
+
+        self.parser.add_argument('--nomanifest', dest='no_manifest', action='store_true',
+                                 help='always create a new snapshot, ignoring locally remembered ones')
+
+        self.parser.add_argument('--pipeline', dest='pipeline', action='store_true',
+                                 help='read and encode fragments in a separate thread while others are being sent,\n'
+                                      'and print timings of upload stages')
+
+        add_compress_argument(self.parser)
+
     def handle(self, args: List[str]):
-        args = self.parser.parse_args(args)
+        with span('parse arguments'):
+            args = self.parser.parse_args(args)
+        if args.compress:
+            ap.set_compression(args.compress)
 
         if args.sn_name and args.sn_id:
             print("parameters 'sn_name' and 'sn_id' are incompatible", file=sys.stderr)
@@ -95,39 +152,166 @@ class UploadCommand:
             print("option 'no_freeze' is useless when 'sn_id' is specified", file=sys.stderr)
 
         sn_id = parse_snapshot_id(args.sn_id) if args.sn_id else None
-        self.upload(args.files, sn_name=args.sn_name, sn_id=sn_id, freeze=(not args.no_freeze))
+        self.upload(args.files, sn_name=args.sn_name, sn_id=sn_id, freeze=(not args.no_freeze), jobs=args.jobs,
+                    use_manifest=(not args.no_manifest), pipeline=args.pipeline)
+        if args.compress:
+            print('traffic:', ap.traffic.summary(), file=sys.stderr)
 
     def upload_fragment(self, f, sn_id: SnapshotId):
-        with open(f.path, 'r') as fr_file:
-            src = fr_file.read()
-            ap.codebase.upload(sn_id.name, sn_id.tag, f.rel_path, code=src, exec_types=f.exec_types)
-
-    def add_fragments_to_snapshot(self, fragments: List[FragmentFile], sn_id: SnapshotId):
-        if len(fragments) > 1:
-            print('upload fragments:')
-            for f in fragments:
-                print(' ', f.rel_path)
-                self.upload_fragment(f, sn_id)
-        else:
+        with span('upload fragment', path=f.rel_path):
+            if os.path.getsize(f.path) >= STREAM_UPLOAD_MIN_SIZE:
+                ap.codebase.upload_file(sn_id.name, sn_id.tag, f.rel_path, f.path, exec_types=f.exec_types)
+                return
+            with open(f.path, 'r') as fr_file:
+                src = fr_file.read()
+                ap.codebase.upload(sn_id.name, sn_id.tag, f.rel_path, code=src, exec_types=f.exec_types)
+
+    def add_fragments_to_snapshot(self, fragments: List[FragmentFile], sn_id: SnapshotId, jobs: int = 1):
+        if len(fragments) == 1:
             f = fragments[0]
             print('upload fragment:', f.rel_path)
             self.upload_fragment(f, sn_id)
+            return
+
+        print('upload fragments:')
+        total = len(fragments)
+        uploaded = 0
+        skipped = 0
+        failures = []
+        with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix='upload') as executor:
+            futures = dict((executor.submit(self.upload_fragment, f, sn_id), f) for f in fragments)
+            for future in as_completed(futures):
+                if future.cancelled():
+                    skipped += 1
+                    continue
+                f = futures[future]
+                error = future.exception()
+                if error is not None:
+                    failures.append((f, error))
+                    print(f'  [failed] {f.rel_path}', file=sys.stderr)
+                    # fail fast: загрузки, которые ещё не начались, отменяются
+                    for pending in futures:
+                        pending.cancel()
+                    continue
+                uploaded += 1
+                print(f'  [{uploaded}/{total}] {f.rel_path}')
+
+        if failures:
+            raise FragmentUploadError(failures, skipped)
+
+    def pipeline_fragments(self, fragments: List[FragmentFile], sn_id: SnapshotId, jobs: int = 1):
+        """
+        Конвейерная загрузка: отдельный поток читает и кодирует тела фрагментов в ограниченную
+        очередь, `jobs` потоков отправляют их. Чтение следующих фрагментов идёт во время отправки.
+        """
+        jobs = max(1, jobs)
+        bodies = queue.Queue(maxsize=2 * jobs)
+        failed = threading.Event()
+        lock = threading.Lock()
+        failures = []
+        encode_time = [0.0]
+        uploaded = [0]
+        total = len(fragments)
+
+        def reader():
+            try:
+                for f in fragments:
+                    if failed.is_set():
+                        break
+                    started = time.monotonic()
+                    try:
+                        with span('encode fragment', path=f.rel_path):
+                            if os.path.getsize(f.path) >= STREAM_UPLOAD_MIN_SIZE:
+                                # большой фрагмент читается потоком уже при отправке
+                                body = ap.codebase.encode_fragment_stream(f.path, f.exec_types)
+                            else:
+                                with open(f.path, 'r') as fr_file:
+                                    body = ap.codebase.encode_fragment(fr_file.read(), f.exec_types)
+                    except Exception as e:
+                        with lock:
+                            failures.append((f, e))
+                        failed.set()
+                        break
+                    encode_time[0] += time.monotonic() - started
+                    bodies.put((f, body))
+            finally:
+                for _ in range(jobs):
+                    bodies.put(None)
+
+        def uploader():
+            while True:
+                item = bodies.get()
+                if item is None:
+                    return
+                f, body = item
+                if failed.is_set():
+                    continue
+                try:
+                    with span('upload fragment', path=f.rel_path):
+                        ap.codebase.upload_encoded(sn_id.name, sn_id.tag, f.rel_path, body)
+                except Exception as e:
+                    with lock:
+                        failures.append((f, e))
+                    print(f'  [failed] {f.rel_path}', file=sys.stderr)
+                    # fail fast: чтение и отправка оставшихся фрагментов прекращаются
+                    failed.set()
+                    continue
+                with lock:
+                    uploaded[0] += 1
+                    print(f'  [{uploaded[0]}/{total}] {f.rel_path}')
+
+        print('upload fragments:')
+        threads = [threading.Thread(target=reader, name='fragment-reader')] + \
+                  [threading.Thread(target=uploader, name=f'fragment-uploader-{i}') for i in range(jobs)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.timings.add('read+encode', encode_time[0])
+
+        if failures:
+            raise FragmentUploadError(failures, total - uploaded[0] - len(failures))
+
+    @staticmethod
+    def print_upload_errors(e: FragmentUploadError):
+        print(f'{len(e.failures)} fragment(s) failed to upload:', file=sys.stderr)
+        for f, error in e.failures:
+            print(f'  {f.rel_path}: {error}', file=sys.stderr)
+        if e.skipped > 0:
+            print(f'{e.skipped} fragment(s) were not uploaded', file=sys.stderr)
 
     def get_or_create_snapshot(self,
                                fragments: List[FragmentFile],
                                sn_name: Optional[SnapshotName],
-                               freeze = True) -> SnapshotMeta:
+                               freeze = True,
+                               jobs: int = 1,
+                               use_manifest = True,
+                               pipeline = False) -> SnapshotMeta:
         if sn_name is None:
             sn_name = 'cli-launcher'
 
         fr_hashes = dict((f.rel_path, f.hash) for f in fragments)
-        resp = ap.codebase.create_snapshot(sn_name, fragmentHashes=fr_hashes)
+
+        # замороженный снапшот с тем же набором фрагментов можно взять из локального индекса
+        manifest = SnapshotManifest() if (freeze and use_manifest) else None
+        if manifest:
+            manifest_key = SnapshotManifest.key(ap.url.netloc, ap.auth.user_id, sn_name, fr_hashes)
+            snapshot = manifest.find(manifest_key)
+            if snapshot:
+                self.manifest_snapshot = SnapshotId(snapshot.owner, snapshot.name, snapshot.tag)
+                print('matches with recently uploaded snapshot:', self.manifest_snapshot)
+                return snapshot
+
+        with self.timings.measure('create snapshot'):
+            resp = ap.codebase.create_snapshot(sn_name, fragmentHashes=fr_hashes)
 
         snapshot = resp.snapshot
         sn_id = SnapshotId(snapshot.owner, snapshot.name, snapshot.tag)
 
         if snapshot.frozen or (len(resp.notFound) == 0):
             print('matches with existing snapshot:', sn_id)
+            if manifest and snapshot.frozen:
+                manifest.put(manifest_key, snapshot)
             return snapshot
 
         print('snapshot created:', sn_id)
@@ -136,78 +320,134 @@ class UploadCommand:
         frs_to_upload = list(filter(lambda f: f.hash in not_found, fragments))
         if len(frs_to_upload) > 0:
             print(f'{len(frs_to_upload)} fragments not found in CodeBase')
-            self.add_fragments_to_snapshot(frs_to_upload, sn_id)
+            with self.timings.measure('upload'):
+                if pipeline:
+                    self.pipeline_fragments(frs_to_upload, sn_id, jobs=jobs)
+                else:
+                    self.add_fragments_to_snapshot(frs_to_upload, sn_id, jobs=jobs)
 
         if freeze:
-            ap.codebase.freeze_snapshot(sn_id.name, sn_id.tag)
+            # снапшот замораживается сразу после подтверждения последней загрузки
+            with self.timings.measure('freeze'):
+                ap.codebase.freeze_snapshot(sn_id.name, sn_id.tag)
+            snapshot.frozen = True
             print('snapshot is ready')
+            if manifest:
+                manifest.put(manifest_key, snapshot)
         return snapshot
 
-    def get_fr_list(self, file_paths: List[Tuple[str, str]]) -> List[FragmentFile]:
-        result = []
-        for paths in file_paths:
-            path = paths[0]
-            rel_path = paths[1]
-
-            dot_pos = path.rfind('.')
-            ext = '' if dot_pos == -1 else path[dot_pos+1:]
-            exec_types = execTypesByExt.get(ext)
-            if exec_types is None:
-                continue
-
-            result.append(FragmentFile(path, rel_path, ext, exec_types))
-        return result
-
-    def search_files(self, paths: List[str]) -> List[Tuple[str, str]]: # -> (abspath, relpath)
-        file_paths = []
-        paths = [os.path.join(dir_path, p) for p in paths]
-
-        for p in paths:
-            if os.path.isfile(p):
-                file_paths.append((p, os.path.relpath(p, dir_path)))
-            else:
-                if not os.path.exists(p):
-                    print(f"not found: '{p}'", file=sys.stderr)
-                    sys.exit(-1)
-
-                abs_filepaths = [
-                    os.path.join(root, name)
-                    for root, dirs, files in os.walk(p)
-                    for name in files]
-
-                for afp in abs_filepaths:
-                    file_paths.append((afp, os.path.relpath(afp, dir_path)))
-
-        file_paths = list(filter(lambda f: not f[0].startswith(launcher_path), file_paths))
-
-        return file_paths
-
-    def search_fragment_files(self, files: List[str]):
-        fr_paths = self.search_files(files)
-        fragments = self.get_fr_list(fr_paths)
+    def forget_missing_snapshot(self) -> bool:
+        """
+        Проверка снапшота из локального индекса после неудачного запуска: если на сервере его
+        больше нет (удалён или истёк раньше срока), он удаляется из индекса.
+        :return: снапшот удалён из индекса
+        """
+        sn_id = self.manifest_snapshot
+        if sn_id is None:
+            return False
+        snapshots = ap.codebase.get_snapshots(name=sn_id.name, owner=sn_id.owner)
+        if any((s.tag == sn_id.tag) and not s.removed for s in snapshots):
+            return False
+        SnapshotManifest().drop(sn_id)
+        self.manifest_snapshot = None
+        return True
+
+    def get_fr_list(self, file_paths: Iterable[Tuple[str, str]], jobs: Optional[int] = None) -> List[FragmentFile]:
+        candidates = []
+
+        def candidate_paths():
+            for paths in file_paths:
+                path = paths[0]
+                rel_path = paths[1]
+
+                dot_pos = path.rfind('.')
+                ext = '' if dot_pos == -1 else path[dot_pos+1:]
+                exec_types = execTypesByExt.get(ext)
+                if exec_types is None:
+                    continue
+                candidates.append((path, rel_path, ext, exec_types))
+                yield path
+
+        # пути передаются лениво: файлы хешируются, пока обход каталогов продолжается
+        hash_cache = HashCache()
+        hashes = hash_cache.digest_many(candidate_paths(), jobs=jobs)
+        hash_cache.save()
+
+        return [FragmentFile(path, rel_path, ext, exec_types, hash=hash)
+                for (path, rel_path, ext, exec_types), hash in zip(candidates, hashes)]
+
+    def search_files(self, paths: List[str], root: Optional[str] = None) -> Iterator[Tuple[str, str]]: # -> (abspath, relpath)
+        """
+        Ленивый поиск файлов фрагментов. Каталоги обходятся с пропуском служебных каталогов
+        и правил `.gitignore`/`.acapellaignore`, отбираются только файлы с расширениями из `execTypesByExt`.
+        :param root: корень снапшота, относительно которого строятся `relpath`
+        """
+        root = os.path.abspath(root) if root else dir_path
+        paths = [os.path.join(root, p) for p in paths]
+
+        # интервал трассировки охватывает весь обход, включая отданные потребителю пути
+        with span('search_files'):
+            for p in paths:
+                if os.path.isfile(p):
+                    p = os.path.abspath(p)
+                    if not p.startswith(launcher_path):
+                        yield p, os.path.relpath(p, root)
+                else:
+                    if not os.path.exists(p):
+                        print(f"not found: '{p}'", file=sys.stderr)
+                        sys.exit(-1)
+
+                    for afp in walk_files(p, base=root, extensions=execTypesByExt, exclude=[launcher_path]):
+                        yield afp, os.path.relpath(afp, root)
+
+    def search_fragment_files(self, files: List[str], root: Optional[str] = None):
+        with self.timings.measure('scan+hash'):
+            fr_paths = self.search_files(files, root)
+            fragments = self.get_fr_list(fr_paths)
         return fragments
 
     def upload_fragments(self,
                          fragments: List[FragmentFile],
                          sn_name: Optional[SnapshotName] = None,
                          sn_id: Optional[SnapshotId] = None,
-                         freeze = True) -> SnapshotId:
-        if sn_id is None:
-            sn_meta = self.get_or_create_snapshot(fragments, sn_name=sn_name, freeze=freeze)
-            sn_id = SnapshotId(sn_meta.owner, sn_meta.name, sn_meta.tag)
-        else:
-            self.add_fragments_to_snapshot(fragments, sn_id)
+                         freeze = True,
+                         jobs: int = 1,
+                         use_manifest = True,
+                         pipeline = False) -> SnapshotId:
+        """
+        :param pipeline: конвейерная загрузка (`pipeline_fragments`) с выводом длительности этапов
+        """
+        try:
+            if sn_id is None:
+                sn_meta = self.get_or_create_snapshot(fragments, sn_name=sn_name, freeze=freeze, jobs=jobs,
+                                                      use_manifest=use_manifest, pipeline=pipeline)
+                sn_id = SnapshotId(sn_meta.owner, sn_meta.name, sn_meta.tag)
+            elif pipeline:
+                with self.timings.measure('upload'):
+                    self.pipeline_fragments(fragments, sn_id, jobs=jobs)
+            else:
+                self.add_fragments_to_snapshot(fragments, sn_id, jobs=jobs)
+        except FragmentUploadError as e:
+            self.print_upload_errors(e)
+            sys.exit(-1)
 
+        if pipeline:
+            self.timings.print()
         return sn_id
 
     def upload(self,
                files: List[str],
                sn_name: Optional[SnapshotName] = None,
                sn_id: Optional[SnapshotId] = None,
-               freeze = True) -> SnapshotId:
+               freeze = True,
+               jobs: int = 1,
+               use_manifest = True,
+               pipeline = False) -> SnapshotId:
         """
 
         :param files: названия файлов или папок, которые нужно загрузить
+        :param jobs: количество одновременно загружаемых фрагментов
+        :param use_manifest: переиспользовать замороженный снапшот из локального индекса, если набор фрагментов не изменился
         :return: sn_id
         """
         fragments = self.search_fragment_files(files)
@@ -216,4 +456,5 @@ class UploadCommand:
             print(f"no fragments in {', '.join(files)}", file=sys.stderr)
             sys.exit(-1)
 
-        return self.upload_fragments(fragments, sn_name=sn_name, sn_id=sn_id, freeze=freeze)
+        return self.upload_fragments(fragments, sn_name=sn_name, sn_id=sn_id, freeze=freeze, jobs=jobs,
+                                     use_manifest=use_manifest, pipeline=pipeline)
@@ -7,5 +7,8 @@ cli_name = 'Acapella CLI ' + version
 
 launcher_path = os.path.dirname(os.path.realpath(__file__))
 dir_path = os.getcwd()
+cache_path = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'acapella')
 
-ap = AcapellaApi()
\ No newline at end of file
+# адрес API можно переопределить, например, для запуска против `tests/fake_server.py`
+api_options = {'address': os.environ['ACAPELLA_ADDRESS']} if os.environ.get('ACAPELLA_ADDRESS') else {}
+ap = AcapellaApi(log_cache_dir=os.path.join(cache_path, 'logs'), **api_options)
\ No newline at end of file
@@ -0,0 +1,174 @@
+import os
+import re
+from typing import Collection, Iterator, List, Optional, Tuple
+
+# каталоги, в которые обход никогда не спускается
+IGNORED_DIRS = frozenset([
+    '.git', '.hg', '.svn', '.idea', '.vscode',
+    'node_modules', '__pycache__', '.mypy_cache', '.pytest_cache', '.tox', '.nox',
+    'venv', '.venv',
+])
+IGNORE_FILES = ('.gitignore', '.acapellaignore')
+
+
+def _glob_to_regex(glob: str) -> str:
+    """Перевод шаблона .gitignore в регулярное выражение (`*`, `?`, `[...]`, `**`)"""
+    regex = ''
+    i = 0
+    while i < len(glob):
+        c = glob[i]
+        if glob.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if glob.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[':
+            end = glob.find(']', i + 1)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                body = glob[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                regex += '[' + body.replace('\\', '\\\\') + ']'
+                i = end
+        elif c == '\\' and i + 1 < len(glob):
+            i += 1
+            regex += re.escape(glob[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    return regex
+
+
+class IgnoreRule:
+    """Одна строка .gitignore. Путь для сопоставления задаётся относительно каталога с файлом правил"""
+    def __init__(self, pattern: str):
+        self.negate = pattern.startswith('!')
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # шаблон без `/` сопоставляется с именем на любой глубине, иначе - с путём от каталога правил
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        prefix = '' if anchored else '(?:.*/)?'
+        self.regex = re.compile(prefix + _glob_to_regex(pattern) + '$')
+
+    def matches(self, rel_path: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        return self.regex.match(rel_path) is not None
+
+
+def parse_ignore_file(path: str) -> List[IgnoreRule]:
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as source:
+            lines = source.read().splitlines()
+    except OSError:
+        return []
+
+    rules = []
+    for line in lines:
+        # пробелы в конце строки значимы, только если экранированы
+        if not line.endswith('\\ '):
+            line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('\\#') or line.startswith('\\!'):
+            line = line[1:]
+        rules.append(IgnoreRule(line))
+    return rules
+
+
+# набор правил и каталог, относительно которого они заданы
+_RuleSet = Tuple[str, List[IgnoreRule]]
+
+
+def _load_rules(dir_path: str) -> Optional[_RuleSet]:
+    rules = []
+    for name in IGNORE_FILES:
+        rules.extend(parse_ignore_file(os.path.join(dir_path, name)))
+    return (dir_path, rules) if rules else None
+
+
+def _is_ignored(rule_sets: List[_RuleSet], path: str, is_dir: bool) -> bool:
+    # последнее подходящее правило побеждает; правила вложенных каталогов идут позже
+    ignored = False
+    for base, rules in rule_sets:
+        rel_path = os.path.relpath(path, base).replace(os.sep, '/')
+        for rule in rules:
+            if rule.matches(rel_path, is_dir):
+                ignored = not rule.negate
+    return ignored
+
+
+def _is_virtualenv(dir_path: str) -> bool:
+    return os.path.isfile(os.path.join(dir_path, 'pyvenv.cfg'))
+
+
+def walk_files(root: str,
+               base: Optional[str] = None,
+               extensions: Optional[Collection[str]] = None,
+               exclude: Collection[str] = ()) -> Iterator[str]:
+    """
+    Ленивый обход каталога `root` через `os.scandir`. Игнорируемые каталоги отсекаются до
+    спуска в них: служебные (`IGNORED_DIRS`, виртуальные окружения), исключённые (`exclude`)
+    и указанные в `.gitignore`/`.acapellaignore`. Файлы правил учитываются от каталога `base`
+    (если `root` лежит внутри него) и во всех вложенных каталогах.
+
+    :param extensions: расширения файлов без точки; `None` - любые файлы
+    :return: абсолютные пути файлов в детерминированном порядке
+    """
+    root = os.path.abspath(root)
+    exclude = set(os.path.abspath(p) for p in exclude)
+
+    rule_sets: List[_RuleSet] = []
+    if base is not None:
+        base = os.path.abspath(base)
+        if (root != base) and (os.path.commonpath([base, root]) == base):
+            # правила каталогов от `base` до родителя `root`; правила самого `root` загрузит обход
+            parent = base
+            for part in os.path.relpath(root, base).split(os.sep):
+                rule_set = _load_rules(parent)
+                if rule_set:
+                    rule_sets.append(rule_set)
+                parent = os.path.join(parent, part)
+
+    yield from _walk_dir(root, rule_sets, extensions, exclude)
+
+
+def _walk_dir(dir_path: str, rule_sets: List[_RuleSet], extensions, exclude) -> Iterator[str]:
+    rule_set = _load_rules(dir_path)
+    if rule_set:
+        rule_sets = rule_sets + [rule_set]
+
+    try:
+        with os.scandir(dir_path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        return
+
+    for entry in entries:
+        # как и `os.walk`, по символическим ссылкам на каталоги не спускаемся
+        if entry.is_dir(follow_symlinks=False):
+            if (entry.name in IGNORED_DIRS) or (entry.path in exclude) or _is_virtualenv(entry.path):
+                continue
+            if rule_sets and _is_ignored(rule_sets, entry.path, True):
+                continue
+            yield from _walk_dir(entry.path, rule_sets, extensions, exclude)
+        elif entry.is_file():
+            if extensions is not None:
+                dot_pos = entry.name.rfind('.')
+                if dot_pos == -1 or entry.name[dot_pos + 1:] not in extensions:
+                    continue
+            if rule_sets and _is_ignored(rule_sets, entry.path, False):
+                continue
+            yield entry.path
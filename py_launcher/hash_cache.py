@@ -0,0 +1,97 @@
+import hashlib
+import mmap
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from .local_cache import load_json, save_json
+from .tracing import span
+
+# файлы, изменённые недавно, не кешируются: в пределах точности mtime
+# файловой системы повторная запись может не изменить подпись файла
+_RACY_WINDOW_NS = 2 * 10**9
+_MAX_ENTRIES = 100000
+# файлы больше этого размера хешируются через mmap, без копирования в буфер
+_MMAP_MIN_SIZE = 2**22
+_BLOCK_SIZE = 2**20
+
+
+def sha1_digest(path: str) -> str:
+    # hashlib отпускает GIL на больших блоках, поэтому файлы можно хешировать в нескольких потоках
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as source:
+        size = os.fstat(source.fileno()).st_size
+        if size >= _MMAP_MIN_SIZE:
+            with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                sha1.update(data)
+            return sha1.hexdigest()
+
+        block = source.read(_BLOCK_SIZE)
+        while len(block) != 0:
+            sha1.update(block)
+            block = source.read(_BLOCK_SIZE)
+    return sha1.hexdigest()
+
+
+def _traced_digest(path: str) -> str:
+    with span('hash', path=path):
+        return sha1_digest(path)
+
+
+class HashCache:
+    """
+    Кеш хешей файлов фрагментов. Ключ - путь к файлу, подпись - (size, mtime_ns, inode).
+    Если подпись не изменилась, файл повторно не читается.
+    """
+    file_name = 'hashes.json'
+
+    def __init__(self):
+        entries = load_json(self.file_name)
+        self.__entries: Dict[str, List] = entries if isinstance(entries, dict) else {}
+        self.__used = set()
+        self.__dirty = False
+
+    def __lookup(self, path: str):
+        """Абсолютный путь, подпись файла и хеш из кеша (`None` - файл нужно хешировать)"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        signature = [st.st_size, st.st_mtime_ns, st.st_ino]
+        self.__used.add(path)
+
+        entry = self.__entries.get(path)
+        return path, signature, (entry[3] if entry and entry[:3] == signature else None)
+
+    def __store(self, path: str, signature: List, digest: str, now: int):
+        if now - signature[1] > _RACY_WINDOW_NS:
+            self.__entries[path] = signature + [digest]
+            self.__dirty = True
+
+    def digest_many(self, paths: Iterable[str], jobs: Optional[int] = None) -> List[str]:
+        """
+        Хеши файлов в порядке `paths`. Файлы, которых нет в кеше, хешируются в `jobs` потоках
+        (по умолчанию - по числу ядер) по мере поступления путей, так что обход каталогов,
+        выдающий `paths` лениво, идёт параллельно с хешированием.
+        """
+        digests: List[Optional[str]] = []
+        misses = []
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1, thread_name_prefix='hash') as executor:
+            for path in paths:
+                path, signature, digest = self.__lookup(path)
+                if digest is None:
+                    misses.append((len(digests), path, signature, executor.submit(_traced_digest, path)))
+                digests.append(digest)
+
+            now = time.time_ns()
+            for i, path, signature, future in misses:
+                digests[i] = future.result()
+                self.__store(path, signature, digests[i], now)
+        return digests
+
+    def save(self):
+        if not self.__dirty:
+            return
+        if len(self.__entries) > _MAX_ENTRIES:
+            self.__entries = dict((p, e) for p, e in self.__entries.items() if p in self.__used)
+        save_json(self.file_name, self.__entries)
+        self.__dirty = False
@@ -1,41 +1,98 @@
 import argparse
+import importlib
 import sys
-
-import requests
+from typing import List, Dict, Union
 
 from acapella_api.context import HttpError
-from .cmd_log import LogCommand
-from .cmd_login import LoginCommand
-from .cmd_logout import LogoutCommand
-from .cmd_presets import PresetsCommand
-from .cmd_register import RegisterCommand
-from .cmd_run import RunCommand
-from .cmd_snapshots import SnapshotsCommand
-from .cmd_start import StartCommand
-from .cmd_transactions import TransactionsCommand
-from .cmd_upload import UploadCommand
-from .cmd_version import VersionCommand
+from acapella_api.stats import RequestStats
 from .context import ap, cli_name
+from .formatters import format_size
 from .netrc_util import read_session, clear_sessions
-from .presets import load_presets
+from .tracing import span, start_tracing
 
+# Команды регистрируются по имени, модуль команды импортируется только при её запуске.
+# Описание дублирует `doc` класса команды, чтобы справка не требовала импорта всех команд.
 commands = [
-    UploadCommand,
-    StartCommand,
-    RunCommand,
-    LoginCommand,
-    LogoutCommand,
-    RegisterCommand,
-    PresetsCommand,
-    SnapshotsCommand,
-    TransactionsCommand,
-    LogCommand,
-    VersionCommand
+    ('upload',       'cmd_upload',       'UploadCommand',       "upload fragments to CodeBase"),
+    ('start',        'cmd_start',        'StartCommand',        'start transaction'),
+    ('run',          'cmd_run',          'RunCommand',          'upload directory and start transaction'),
+    ('bench',        'cmd_bench',        'BenchCommand',        'run fragment many times and report latency percentiles'),
+    ('login',        'cmd_login',        'LoginCommand',        "login and store session data in '`/.netrc'"),
+    ('logout',       'cmd_logout',       'LogoutCommand',       "log out and remove session data from '`/.netrc'"),
+    ('register',     'cmd_register',     'RegisterCommand',     "sign up for Acapella"),
+    ('presets',      'cmd_presets',      'PresetsCommand',      'dump deafult presets'),
+    ('snapshots',    'cmd_snapshots',    'SnapshotsCommand',    'snapshot management'),
+    ('transactions', 'cmd_transactions', 'TransactionsCommand', 'list, stop, remove transactions'),
+    ('log',          'cmd_log',          'LogCommand',          'print log (terminated/online)'),
+    ('version',      'cmd_version',      'VersionCommand',      "print CPVM and CLI launcher versions"),
 ]
 
-command_by_name = dict((cmd.name, cmd) for cmd in commands)
+command_by_name = dict((name, (module, cls, doc)) for name, module, cls, doc in commands)
+
+command_docs = "\n".join((name.ljust(15) + doc) for name, (module, cls, doc) in command_by_name.items())
+
+
+def load_command(name: str):
+    module, cls, doc = command_by_name[name]
+    return getattr(importlib.import_module('.' + module, __package__), cls)
+
+
+def is_connection_error(e: Exception) -> bool:
+    # `requests` импортируется при первом HTTP-запросе: если его нет, соединений не было
+    requests = sys.modules.get('requests')
+    return (requests is not None) and isinstance(e, requests.ConnectionError)
+
+
+global_flags = ['--stats']
+global_options = ['--trace', '--profile']
 
-command_docs = "\n".join((name.ljust(15) + cmd.doc) for name, cmd in command_by_name.items())
+
+def pop_global_options(argv: List[str]) -> Dict[str, Union[bool, str]]:
+    """
+    Удаление глобальных флагов и параметров со значением (`--option value` или `--option=value`),
+    указанных перед именем команды. Всё после имени команды - её аргументы и не разбирается.
+    """
+    found = {}
+    while argv and argv[0].startswith('--'):
+        name, eq, value = argv[0].partition('=')
+        if (name in global_flags) and not eq:
+            found[name] = True
+            del argv[0]
+        elif name in global_options:
+            if not eq:
+                if len(argv) < 2:
+                    print(f'{name}: value is required', file=sys.stderr)
+                    sys.exit(1)
+                value = argv[1]
+                del argv[1]
+            found[name] = value
+            del argv[0]
+        else:
+            break
+    return found
+
+
+def print_request_stats(stats: RequestStats):
+    rows = stats.summary()
+    if not rows:
+        return
+
+    def ms(seconds) -> str:
+        return '-' if seconds is None else f'{seconds * 1000:.1f}ms'
+
+    width = max(len(row['endpoint']) for row in rows) + 2
+    print('\nHTTP requests (p50..total: without reading streamed bodies; dns, connect: sums over all attempts; '
+          'ttfb: request sent to response headers):', file=sys.stderr)
+    print('endpoint'.ljust(width) + ''.join(h.rjust(10) for h in
+          ['count', 'errors', 'retries', 'p50', 'p90', 'p99', 'max', 'total', 'dns', 'connect', 'ttfb_p50',
+           'sent', 'received']),
+          file=sys.stderr)
+    for row in rows:
+        cells = [str(row['count']), str(row['errors']), str(row['retries'])] + \
+                [ms(v) for v in row['percentiles'] + [row['max'], row['total'], row['dns'], row['connect'],
+                                                      row['ttfb_p50']]] + \
+                [format_size(row['sent']), format_size(row['received'])]
+        print(row['endpoint'].ljust(width) + ''.join(c.rjust(10) for c in cells), file=sys.stderr)
 
 
 def run_cmd(cmd, args = sys.argv[2:]):
@@ -43,34 +100,77 @@ def run_cmd(cmd, args = sys.argv[2:]):
         cmd().handle(args)
     except KeyboardInterrupt:
         sys.exit(-1)
-    except requests.ConnectionError:
+    except Exception as e:
+        if not is_connection_error(e):
+            raise
+        # идемпотентные запросы к этому моменту уже повторены по политике `RetryPolicy`
         print("connection error: " + ap.url.netloc, file=sys.stderr)
+        sys.exit(-1)
 
 
 def main():
+    argv = sys.argv[1:]
+    options = pop_global_options(argv)
+    stats = RequestStats() if options.get('--stats') else None
+    trace_path = options.get('--trace')
+    profile_path = options.get('--profile')
+    if stats is not None:
+        ap.add_request_hook(stats)
+    tracer = None
+    if trace_path is not None:
+        tracer = start_tracing(' '.join(['acapella'] + argv[0:1]))
+        ap.add_request_hook(tracer.record_request)
+    profiler = None
+    if profile_path is not None:
+        import cProfile
+        # cProfile учитывает только основной поток; фоновые загрузки и чтение лога видны в `--trace`
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        run_main(argv)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if tracer is not None:
+            tracer.save(trace_path)
+        if stats is not None:
+            print_request_stats(stats)
+        ap.close()
+
+
+def run_main(argv: List[str]):
     parser = argparse.ArgumentParser(
         description=cli_name,
-        usage=f'acapella <command> [<args>]\nAvailable commands:\n{command_docs}\n')
+        usage=f'acapella [<global options>] <command> [<args>]\n'
+              f'Global options (before the command name):\n'
+              f'  --stats        print per-endpoint HTTP latency table at exit\n'
+              f'  --trace FILE   write Chrome trace event JSON of command phases and HTTP requests\n'
+              f'                 (open in chrome://tracing or ui.perfetto.dev)\n'
+              f'  --profile FILE run the command under cProfile and save stats for pstats/snakeviz\n'
+              f'Available commands:\n{command_docs}\n')
 
     parser.add_argument('command', help =f'subcommand to run: {", ".join(sorted(command_by_name.keys()))}')
 
-    args = parser.parse_args(sys.argv[1:2])
-    cmd = command_by_name.get(args.command)
-    if not cmd:
+    with span('parse arguments'):
+        args = parser.parse_args(argv[0:1])
+    if not (args.command in command_by_name):
         print('unrecognized command', file=sys.stderr)
         parser.print_help()
         exit(1)
 
-    load_presets()
+    with span('import command', command=args.command):
+        cmd = load_command(args.command)
 
     while True:
         if cmd.need_auth:
             ap.auth.user_id, ap.auth.token = read_session()
             if ap.auth.token is None:
-                run_cmd(LoginCommand, args=[])
+                run_cmd(load_command('login'), args=[])
 
         try:
-            run_cmd(cmd)
+            with span('acapella ' + args.command):
+                run_cmd(cmd, argv[1:])
             break
         except HttpError as e:
             if e.status_code == 401:
@@ -82,4 +182,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
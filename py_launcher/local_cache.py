@@ -0,0 +1,38 @@
+import json
+import os
+import tempfile
+from typing import Any, Optional
+
+from .context import cache_path
+
+
+def cache_file(name: str) -> str:
+    return os.path.join(cache_path, name)
+
+
+def load_json(name: str) -> Optional[Any]:
+    """Чтение json-файла из кеша. Отсутствующий или повреждённый файл считается пустым кешем"""
+    try:
+        with open(cache_file(name), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_json(name: str, data: Any) -> None:
+    """
+    Атомарная запись json-файла в кеш: данные пишутся во временный файл,
+    который затем подменяет старый. Ошибки записи игнорируются - кеш необязателен.
+    """
+    try:
+        os.makedirs(cache_path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path, prefix='.' + name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp_path, cache_file(name))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        pass
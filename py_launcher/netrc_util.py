@@ -4,8 +4,10 @@ from acapella_api.common import UserId
 
 from .context import ap
 from .tinynetrc import Netrc
+from .tracing import traced
 
 
+@traced('read netrc')
 def read_session(username: Optional[UserId] = None) -> Optional[Tuple[str, str]]:
     """
     Read session data from `~/.netrc` file. Hostname is coming from `acapella_api.AcapellaApi.url.netloc`
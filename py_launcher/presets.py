@@ -8,6 +8,7 @@ from acapella_api.logs import LogParameters, LoggingParameters, LogScope
 from acapella_api.vm import TransactionParameters
 
 from .context import launcher_path
+from .tracing import traced
 
 _common_log = LogParameters(
     id = 'log',
@@ -76,7 +77,17 @@ def __get_filename(full_path):
     return basename(normpath(full_path))
 
 
+__loaded = False
+
+
+@traced('load_presets')
 def load_presets():
+    """Загрузка пользовательских пресетов из папки лаунчера. Повторные вызовы ничего не делают"""
+    global __loaded
+    if __loaded:
+        return
+    __loaded = True
+
     def is_preset(path):
         return isfile(path) and path.endswith(".json")
 
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import time
+from typing import Optional, Mapping
+
+from acapella_api.codebase import SnapshotMeta, SnapshotName, FragmentPath, SnapshotId
+from acapella_api.common import AccessLevel, UserId
+
+from .local_cache import load_json, save_json
+
+# снапшот, который скоро истечёт, не переиспользуется: транзакция должна успеть стартовать
+_EXPIRE_MARGIN_MS = 60 * 1000
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class SnapshotManifest:
+    """
+    Локальный индекс замороженных снапшотов: дайджест набора (rel_path -> hash) -> SnapshotMeta.
+    Позволяет при неизменном наборе фрагментов не вызывать `/cb/newSnapshot`.
+    """
+    file_name = 'snapshots.json'
+
+    def __init__(self, ttl_sec: int = 60 * 60):
+        self.ttl_ms = ttl_sec * 1000
+        entries = load_json(self.file_name)
+        self.__entries = entries if isinstance(entries, dict) else {}
+
+    @staticmethod
+    def key(host: str, user: UserId, sn_name: SnapshotName, fr_hashes: Mapping[FragmentPath, str]) -> str:
+        canonical = json.dumps([host, user, sn_name, sorted((p, h.lower()) for p, h in fr_hashes.items())],
+                               separators=(',', ':'))
+        return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+    def __is_alive(self, entry: dict, now_ms: int) -> bool:
+        if now_ms - entry['storedAt'] > self.ttl_ms:
+            return False
+        expire_at = entry.get('expireAt')
+        return not expire_at or (now_ms + _EXPIRE_MARGIN_MS < expire_at)
+
+    def find(self, key: str) -> Optional[SnapshotMeta]:
+        entry = self.__entries.get(key)
+        if not entry or not self.__is_alive(entry, _now_ms()):
+            return None
+
+        return SnapshotMeta(
+            name = entry['name'],
+            tag = entry['tag'],
+            frozen = True,
+            removed = False,
+            created = entry.get('created'),
+            expireAt = entry.get('expireAt'),
+            owner = entry['owner'],
+            accessLevel = AccessLevel(entry['accessLevel'])
+        )
+
+    def put(self, key: str, snapshot: SnapshotMeta):
+        if snapshot.removed:
+            return
+        now_ms = _now_ms()
+        self.__entries = dict((k, e) for k, e in self.__entries.items() if self.__is_alive(e, now_ms))
+        access_level = snapshot.accessLevel
+        self.__entries[key] = {
+            'name': snapshot.name,
+            'tag': snapshot.tag,
+            'owner': snapshot.owner,
+            'created': snapshot.created,
+            'expireAt': snapshot.expireAt,
+            'accessLevel': access_level.value if isinstance(access_level, AccessLevel) else access_level,
+            'storedAt': now_ms,
+        }
+        save_json(self.file_name, self.__entries)
+
+    def drop(self, sn_id: SnapshotId):
+        """Удаление записей снапшота, которого больше нет на сервере"""
+        entries = dict((k, e) for k, e in self.__entries.items()
+                       if (e['owner'], e['name'], e['tag']) != (sn_id.owner, sn_id.name, sn_id.tag))
+        if len(entries) != len(self.__entries):
+            self.__entries = entries
+            save_json(self.file_name, self.__entries)
@@ -0,0 +1,97 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, List
+
+from acapella_api.stats import RequestRecord
+
+
+class Tracer:
+    """
+    Запись интервалов выполнения команды в формате Chrome trace event (`chrome://tracing`, Perfetto).
+    Интервалы одного потока вкладываются друг в друга по времени, поэтому HTTP-запросы,
+    отправленные внутри этапа, отображаются под ним.
+    """
+    def __init__(self, process_name: str):
+        self.__lock = threading.Lock()
+        self.__started = time.monotonic()
+        self.__pid = os.getpid()
+        self.__threads = set()
+        self.events: List[dict] = [self.__metadata('process_name', 0, process_name)]
+
+    def __metadata(self, name: str, tid: int, value: str) -> dict:
+        return {'name': name, 'ph': 'M', 'pid': self.__pid, 'tid': tid, 'args': {'name': value}}
+
+    def complete(self, name: str, started: float, seconds: float, cat: str = 'phase', args: Optional[dict] = None):
+        """Интервал текущего потока; `started` - по `time.monotonic()`"""
+        thread = threading.current_thread()
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': self.__pid, 'tid': thread.ident,
+                 'ts': round((started - self.__started) * 1e6), 'dur': round(seconds * 1e6)}
+        if args:
+            event['args'] = args
+        with self.__lock:
+            if thread.ident not in self.__threads:
+                self.__threads.add(thread.ident)
+                self.events.append(self.__metadata('thread_name', thread.ident, thread.name))
+            self.events.append(event)
+
+    def record_request(self, record: RequestRecord):
+        """Обработчик `AcapellaApi.add_request_hook`: интервал HTTP-запроса"""
+        args = {'path': record.path, 'status': record.status,
+                'sent': record.bytes_sent, 'received': record.bytes_received}
+        if record.dns_sec > 0:
+            args['dns_ms'] = round(record.dns_sec * 1000, 3)
+        if record.connect_sec > 0:
+            args['connect_ms'] = round(record.connect_sec * 1000, 3)
+        if record.ttfb_sec is not None:
+            args['ttfb_ms'] = round(record.ttfb_sec * 1000, 3)
+        if len(record.attempts) > 1:
+            args['attempts'] = len(record.attempts)
+        if record.retries > 0:
+            args['retries'] = record.retries
+        if record.error is not None:
+            args['error'] = repr(record.error)
+        self.complete(record.endpoint, record.started, record.total_sec, cat='http', args=args)
+
+    def save(self, path: str):
+        with self.__lock:
+            events = list(self.events)
+        with open(path, 'w') as out:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, out)
+
+
+# активная трассировка; `None` - интервалы не записываются
+tracer: Optional[Tracer] = None
+
+
+def start_tracing(process_name: str) -> Tracer:
+    global tracer
+    tracer = Tracer(process_name)
+    return tracer
+
+
+@contextmanager
+def span(name: str, **args):
+    """Интервал этапа команды в текущем потоке; без активной трассировки ничего не делает"""
+    if tracer is None:
+        yield
+        return
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        tracer.complete(name, started, time.monotonic() - started, args=args)
+
+
+def traced(name: str):
+    """Декоратор: вызов функции записывается как интервал `name`"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+from acapella_api.aio import AsyncAcapellaApi, aiohttp
+from acapella_api.codebase import ExecutorType
+from acapella_api.logs import LogRef, LogScope
+from acapella_api.vm import TransactionParameters, TransactionState
+from fake_server import FakeCpvmServer
+
+
+@unittest.skipIf(aiohttp is None, 'aiohttp is not installed')
+class AsyncApiTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = FakeCpvmServer(run_sec=0.3, log_size=200 * 1024).start()
+        self.acapella = AsyncAcapellaApi(self.server.address)
+        await self.acapella.auth.login('test', 'secret')
+
+    async def asyncTearDown(self):
+        await self.acapella.close()
+        self.server.stop()
+
+    async def upload_snapshot(self):
+        codebase = self.acapella.codebase
+        snapshot = (await codebase.create_snapshot('aio-snapshot')).snapshot
+        await codebase.upload(snapshot.name, snapshot.tag, 'hello.py', code='print(1)',
+                              exec_types=[ExecutorType.CPYTHON])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'big.py')
+            with open(path, 'w') as source:
+                source.write('print(2)\n' * 10000)
+            await codebase.upload_file(snapshot.name, snapshot.tag, 'big.py', path, [ExecutorType.CPYTHON])
+        await codebase.freeze_snapshot(snapshot.name, snapshot.tag)
+
+        snapshots = await codebase.get_snapshots()
+        self.assertEqual([(s.name, s.frozen) for s in snapshots], [('aio-snapshot', True)])
+        return snapshot
+
+    async def test_auth(self):
+        self.assertEqual(self.acapella.auth.user_id, 'test')
+        self.assertEqual(await self.acapella.vm.get_version(), 'fake-cpvm')
+
+    async def test_start_and_wait(self):
+        snapshot = await self.upload_snapshot()
+        params = TransactionParameters(fragment=f'{snapshot.owner}/{snapshot.name}/{snapshot.tag}:hello.py')
+        tr_id = (await self.acapella.vm.start_transaction(params)).transaction_id
+        status = await self.acapella.vm.wait_transaction(tr_id)
+        self.assertEqual(status.state, TransactionState.FINISHED.value)
+
+    async def test_start_many(self):
+        snapshot = await self.upload_snapshot()
+        prefix = f'{snapshot.owner}/{snapshot.name}/{snapshot.tag}:'
+        params = [TransactionParameters(fragment=prefix + path) for path in ['hello.py', 'big.py', 'missing.py'] * 3]
+
+        states = []
+        async for result in self.acapella.vm.start_many(params, max_in_flight=4):
+            self.assertIsNone(result.error)
+            states.append(result.status.state)
+        self.assertEqual(sorted(states), ['error'] * 3 + ['finished'] * 6)
+        self.assertEqual(len(await self.acapella.vm.get_transactions()), 9)
+
+    async def test_follow_log(self):
+        snapshot = await self.upload_snapshot()
+        params = TransactionParameters(fragment=f'{snapshot.owner}/{snapshot.name}/{snapshot.tag}:hello.py')
+        tr_id = (await self.acapella.vm.start_transaction(params)).transaction_id
+
+        ref = LogRef(LogScope.TRANSACTION, 'test', 'log', trId=tr_id)
+        chunks = [chunk async for chunk in self.acapella.logs.follow_log(ref)]
+        self.assertEqual(b''.join(chunks), self.server.log_for(self.server.log_size))
+        # лог рос во время исполнения: чтение продолжалось несколькими запросами с Range
+        self.assertGreater(self.server.request_count(r'/logs/log$'), 1)
+
+    async def test_follow_log_gzip(self):
+        # aiohttp по умолчанию принимает gzip; Range должен отсчитываться в байтах лога
+        self.server.gzip_log = True
+        await self.test_follow_log()
+
+    async def test_follow_log_after_disconnect(self):
+        snapshot = await self.upload_snapshot()
+        params = TransactionParameters(fragment=f'{snapshot.owner}/{snapshot.name}/{snapshot.tag}:hello.py')
+        tr_id = (await self.acapella.vm.start_transaction(params)).transaction_id
+
+        self.server.inject(r'/logs/log$', count=2, drop=True)
+        ref = LogRef(LogScope.TRANSACTION, 'test', 'log', trId=tr_id)
+        chunks = [chunk async for chunk in self.acapella.logs.follow_log(ref)]
+        self.assertEqual(b''.join(chunks), self.server.log_for(self.server.log_size))
+
+
+if __name__ == '__main__':
+    unittest.main()
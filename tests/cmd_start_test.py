@@ -0,0 +1,75 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from acapella_api import AcapellaApi
+from acapella_api.codebase import ExecutorType
+from acapella_api.vm import TransactionParameters
+from fake_server import FakeCpvmServer
+from py_launcher import cmd_start
+
+
+class StartCommandTest(unittest.TestCase):
+    def setUp(self):
+        # лог растёт всё время исполнения и отдаётся одним chunked-ответом
+        self.server = FakeCpvmServer(run_sec=10, log_size=1024 * 1024, stream_log=True).start()
+        self.acapella = AcapellaApi(self.server.address)
+        self.acapella.auth.login('test', 'secret')
+        self.acapella.vm.transaction_timeout_ms = 500
+
+    def tearDown(self):
+        self.acapella.close()
+        self.server.stop()
+
+    def fragment(self) -> str:
+        snapshot = self.acapella.codebase.create_snapshot('test-snapshot').snapshot
+        self.acapella.codebase.upload(snapshot.name, snapshot.tag, path='test/hello.py',
+                                      code='print("Hello World!")', exec_types=[ExecutorType.CPYTHON])
+        self.acapella.codebase.freeze_snapshot(snapshot.name, snapshot.tag)
+        return f'{snapshot.owner}/{snapshot.name}/{snapshot.tag}:test/hello.py'
+
+    def test_execution_timeout_while_log_streams(self):
+        args = argparse.Namespace(preset='transactional', log='offline')
+        stdout, stderr = io.StringIO(), io.StringIO()
+        started = time.monotonic()
+        with mock.patch.object(cmd_start, 'ap', self.acapella), \
+                contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            cmd_start.StartCommand().start_transaction(args, TransactionParameters(self.fragment()))
+
+        self.assertIn('execution timeout', stderr.getvalue())
+        # транзакция исполняется 10 с: чтение лога прервано, а не дочитано до конца
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertGreater(self.server.request_count(r'/logs/log$'), 0)
+
+    def test_batch(self):
+        self.server.run_sec = 0.2
+        fragment = self.fragment()
+        jobs = [{'fragment': fragment, 'trid': 'tr-1'},
+                {'fragment': fragment.replace('hello.py', 'missing.py'), 'trid': 'tr-2'},
+                {'fragment': fragment, 'args': {'p1': 'v1'}, 'trid': 'tr-3'}]
+        with tempfile.TemporaryDirectory() as tmp:
+            batch_path = os.path.join(tmp, 'batch.jsonl')
+            with open(batch_path, 'w') as batch:
+                batch.write('\n'.join(json.dumps(job) for job in jobs) + '\n')
+
+            command = cmd_start.StartCommand()
+            args = command.parser.parse_args(['--batch', batch_path, '--inflight', '2'])
+            stdout = io.StringIO()
+            with mock.patch.object(cmd_start, 'ap', self.acapella), contextlib.redirect_stdout(stdout), \
+                    self.assertRaises(SystemExit):
+                command.run(args)
+
+        results = dict((r['line'], r) for r in map(json.loads, stdout.getvalue().splitlines()))
+        self.assertEqual({1: 'finished', 2: 'error', 3: 'finished'}, dict((n, r['state']) for n, r in results.items()))
+        self.assertEqual(['tr-1', 'tr-2', 'tr-3'], [results[n]['transactionId'] for n in (1, 2, 3)])
+        self.assertEqual({'p1': 'v1'}, self.server.transactions['tr-3'].params['arguments'])
+
+
+if __name__ == '__main__':
+    unittest.main()
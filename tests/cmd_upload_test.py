@@ -0,0 +1,80 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from acapella_api import AcapellaApi
+from acapella_api.codebase import SnapshotId
+from fake_server import FakeCpvmServer
+from py_launcher import cmd_upload, local_cache
+from py_launcher.cmd_upload import FragmentUploadError
+
+FRAGMENT_COUNT = 20
+UPLOAD = r'^POST /cb/snapshots/.*/fragments/'
+
+
+class ConcurrentUploadTest(unittest.TestCase):
+    def setUp(self):
+        # задержка ответа, чтобы очередь загрузок не успевала опустеть до отказа
+        self.server = FakeCpvmServer(latency_sec=0.05).start()
+        self.addCleanup(self.server.stop)
+        self.acapella = AcapellaApi(self.server.address)
+        self.addCleanup(self.acapella.close)
+        self.acapella.auth.login('test', 'secret')
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = os.path.join(tmp.name, 'src')
+        os.makedirs(self.root)
+        for i in range(FRAGMENT_COUNT):
+            with open(os.path.join(self.root, f'f{i:02}.py'), 'w') as f:
+                f.write(f'print({i})')
+
+        for patcher in (mock.patch.object(local_cache, 'cache_path', os.path.join(tmp.name, 'cache')),
+                        mock.patch.object(cmd_upload, 'ap', self.acapella)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.command = cmd_upload.UploadCommand()
+        self.fragments = sorted(self.command.search_fragment_files(['.'], root=self.root), key=lambda f: f.rel_path)
+        snapshot = self.acapella.codebase.create_snapshot('test-snapshot').snapshot
+        self.sn_id = SnapshotId(snapshot.owner, snapshot.name, snapshot.tag)
+
+    def upload(self, jobs: int):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            self.command.add_fragments_to_snapshot(self.fragments, self.sn_id, jobs=jobs)
+
+    def test_concurrent_upload(self):
+        self.upload(jobs=4)
+        self.assertEqual(FRAGMENT_COUNT, self.server.request_count(UPLOAD))
+        snapshot = self.server.snapshots[(self.sn_id.owner, self.sn_id.name, self.sn_id.tag)]
+        self.assertEqual(sorted(f.rel_path for f in self.fragments), sorted(snapshot.fragments))
+
+    def test_fail_fast(self):
+        self.server.inject(UPLOAD + r'f01\.py$', status=500, count=None)
+        with self.assertRaises(FragmentUploadError) as cm:
+            self.upload(jobs=2)
+
+        error = cm.exception
+        self.assertEqual(['f01.py'], [f.rel_path for f, _ in error.failures])
+        # загрузки, не начавшиеся к моменту отказа, отменены и до сервера не дошли
+        sent = self.server.request_count(UPLOAD)
+        self.assertGreater(error.skipped, 0)
+        self.assertEqual(FRAGMENT_COUNT, sent + error.skipped)
+        self.assertLess(sent, FRAGMENT_COUNT // 2)
+
+    def test_errors_are_reported(self):
+        self.server.inject(UPLOAD + r'f01\.py$', status=500, count=None)
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(stderr), \
+                self.assertRaises(SystemExit):
+            self.command.upload_fragments(self.fragments, sn_id=self.sn_id, jobs=2)
+        self.assertIn('1 fragment(s) failed to upload', stderr.getvalue())
+        self.assertIn('f01.py:', stderr.getvalue())
+        self.assertIn('fragment(s) were not uploaded', stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import json
+import os
+import tempfile
+import unittest
+
+from acapella_api.codebase import CodeBaseApi, ExecutorType
+
+
+class FragmentEncodingTest(unittest.TestCase):
+    def test_stream_matches_whole_body(self):
+        code = 'local s = "quote \\" backslash \\\\ tab \t ctrl \x01 юникод 😀"\n' * 1000
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.lua')
+            with open(path, 'w') as f:
+                f.write(code)
+            body = b''.join(CodeBaseApi.encode_fragment_stream(path, [ExecutorType.VM_LUAJ], chunk_size=100))
+
+        expected = CodeBaseApi.encode_fragment(code, [ExecutorType.VM_LUAJ])
+        self.assertEqual(json.loads(body), json.loads(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import json
+import unittest
+
+from acapella_api.common import JsonObject
+from acapella_api.logs import LoggingParameters, LogParameters, LogScope
+from acapella_api.vm import TransactionInfo, TransactionParameters, TransactionStatistics
+
+
+class JsonObjectTest(unittest.TestCase):
+    def test_decode_nested(self):
+        stats = dict((name, i) for i, name in enumerate([
+            'tvmReads', 'tvmWrites', 'bytesWrite', 'bytesRead', 'asyncCalls', 'syncCalls', 'totalRestarts',
+            'totalConflicts', 'startTimestamp', 'ioStartTimestamp', 'endTimestamp', 'workerExecTime',
+            'workerExecTimeTotal', 'nodeExecTime']))
+        tr = JsonObject.decode_from_json(TransactionInfo, json.dumps({
+            'id': 'tr-1',
+            'params': {'fragment': 'user/sn/tag:main.lua', 'arguments': {'a': 'b'}},
+            'status': {'state': 'finished', 'result': '42', 'statistics': stats},
+        }))
+
+        self.assertEqual(tr.id, 'tr-1')
+        self.assertIsInstance(tr.params, TransactionParameters)
+        self.assertEqual(tr.params.arguments, {'a': 'b'})
+        self.assertEqual(tr.params.tvmCount, 0)
+        self.assertTrue(tr.params.syncTvmIo)
+        self.assertEqual(tr.status.state, 'finished')
+        self.assertIsInstance(tr.status.statistics, TransactionStatistics)
+        self.assertEqual(tr.status.statistics.nodeExecTime, 13)
+
+    def test_encode_roundtrip(self):
+        params = TransactionParameters(
+            fragment = 'user/sn/tag:main.lua',
+            logging = LoggingParameters(redirections = {'stdout': LogParameters('log', LogScope.TRANSACTION)}))
+
+        encoded = json.loads(params.to_json())
+        self.assertEqual(encoded['logging']['redirections']['stdout'], {'id': 'log', 'scope': 'TRANSACTION', 'ordering': 'PARTIAL'})
+        self.assertEqual(json.loads(params.to_json(formatted=True)), encoded)
+
+        decoded = JsonObject.decode_from_json(TransactionParameters, params.to_json())
+        self.assertEqual(decoded.fragment, params.fragment)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import gzip
+import hashlib
+import os
+import tempfile
+import unittest
+
+from acapella_api import AcapellaApi
+from acapella_api.codebase import CodeBaseApi, ExecutorType
+from acapella_api.compression import compress
+from fake_server import FakeCpvmServer
+
+UPLOAD = r'POST /cb/snapshots/.*/fragments/'
+
+
+class CompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCpvmServer().start()
+        self.addCleanup(self.server.stop)
+        self.acapella = AcapellaApi(self.server.address)
+        self.addCleanup(self.acapella.close)
+        self.acapella.auth.login('test', 'secret')
+        self.snapshot = self.acapella.codebase.create_snapshot('test-snapshot').snapshot
+
+    def upload(self, path: str, code: str):
+        self.acapella.codebase.upload(self.snapshot.name, self.snapshot.tag, path=path,
+                                      code=code, exec_types=[ExecutorType.CPYTHON])
+
+    def assert_received(self, code: str):
+        self.assertEqual(code, self.server.fragments.get(hashlib.sha1(code.encode('utf-8')).hexdigest()))
+
+    def request_totals(self):
+        traffic = self.acapella.traffic
+        return traffic.request_bytes, traffic.request_wire_bytes
+
+    def test_round_trip(self):
+        self.acapella.set_compression('gzip')
+        code = 'print("Hello World!")\n' * 1000
+        before = self.request_totals()
+        self.upload('test/hello.py', code)
+
+        self.assertEqual(['gzip'], self.server.body_encodings(UPLOAD))
+        self.assert_received(code)
+
+        body = CodeBaseApi.encode_fragment(code, [ExecutorType.CPYTHON])
+        wire = compress(body, 'gzip')
+        self.assertEqual(body, gzip.decompress(wire))
+        self.assertEqual([len(wire)], [size for request, _, size in self.server.bodies if 'fragments/' in request])
+        self.assertEqual((before[0] + len(body), before[1] + len(wire)), self.request_totals())
+        self.assertLess(len(wire), len(body) // 10)
+
+        traffic = self.acapella.traffic
+        self.assertGreater(traffic.response_bytes, 0)
+        self.assertEqual(traffic.response_bytes, traffic.response_wire_bytes)
+
+    def test_min_size(self):
+        self.acapella.set_compression('deflate', min_size=200)
+        small = 'print(1)\n'
+        large = 'print(2)\n' * 100
+        before = self.request_totals()
+        self.upload('test/small.py', small)
+        self.upload('test/large.py', large)
+
+        # тело меньше порога уходит как есть и учитывается без экономии
+        self.assertEqual([None, 'deflate'], self.server.body_encodings(UPLOAD))
+        self.assert_received(small)
+        self.assert_received(large)
+
+        small_body = CodeBaseApi.encode_fragment(small, [ExecutorType.CPYTHON])
+        large_body = CodeBaseApi.encode_fragment(large, [ExecutorType.CPYTHON])
+        self.assertEqual((before[0] + len(small_body) + len(large_body),
+                          before[1] + len(small_body) + len(compress(large_body, 'deflate'))),
+                         self.request_totals())
+
+    def test_generator_body(self):
+        code = 'print("Hello World!")\n' * 1000
+        with tempfile.TemporaryDirectory() as tmp:
+            file_path = os.path.join(tmp, 'hello.py')
+            with open(file_path, 'w') as f:
+                f.write(code)
+            body = b''.join(CodeBaseApi.encode_fragment_stream(file_path, [ExecutorType.CPYTHON]))
+
+            # размер тела-генератора заранее неизвестен: без сжатия оно не учитывается
+            before = self.request_totals()
+            self.acapella.codebase.upload_file(self.snapshot.name, self.snapshot.tag, 'test/plain.py',
+                                               file_path, [ExecutorType.CPYTHON])
+            self.assertEqual(before, self.request_totals())
+
+            # со сжатием - сжимается всегда, независимо от порога, и учитывается по мере отправки
+            self.acapella.set_compression('gzip', min_size=len(body) + 1)
+            self.acapella.codebase.upload_file(self.snapshot.name, self.snapshot.tag, 'test/hello.py',
+                                               file_path, [ExecutorType.CPYTHON])
+
+        self.assertEqual([None, 'gzip'], self.server.body_encodings(UPLOAD))
+        self.assert_received(code)
+        sent = [size for request, _, size in self.server.bodies if 'fragments/' in request]
+        self.assertEqual(len(body), sent[0])
+        self.assertEqual((before[0] + len(body), before[1] + sent[1]), self.request_totals())
+        self.assertLess(sent[1], len(body))
+
+
+if __name__ == '__main__':
+    unittest.main()
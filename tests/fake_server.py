@@ -0,0 +1,579 @@
+"""
+Локальная замена API CPVM для тестов и бенчмарков клиента без доступа к `api.acapella.ru`.
+
+Сервер хранит снапшоты, фрагменты, сессии и транзакции в памяти. Транзакция "исполняется"
+`run_sec` секунд, лог транзакции растёт за это время до `log_size` байт. Задержка ответов
+и отказы настраиваются, в том числе на ходу.
+
+Запуск отдельным процессом: `python tests/fake_server.py --port 5678 --latency 0.01`,
+после чего CLI можно направить на него через `ACAPELLA_ADDRESS=http://127.0.0.1:5678`.
+"""
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_LOG_CHUNK_SIZE = 64 * 1024
+
+
+def make_log(size: int) -> bytes:
+    """Детерминированный лог из нумерованных строк длиной ровно `size` байт"""
+    lines = []
+    total = 0
+    n = 0
+    while total < size:
+        line = f'line {n:08d} ' + 'x' * 50 + '\n'
+        lines.append(line)
+        total += len(line)
+        n += 1
+    return ''.join(lines).encode('utf-8')[:size]
+
+
+class Failure:
+    """Отказ для запросов `METHOD /path`, подходящих под `pattern`"""
+    def __init__(self, pattern: str, status: int = 503, count: Optional[int] = 1, drop: bool = False):
+        """
+        :param status: код ответа
+        :param count: сколько запросов отклонить, `None` - все
+        :param drop: закрыть соединение без ответа (ошибка соединения у клиента)
+        """
+        self.pattern = re.compile(pattern)
+        self.status = status
+        self.count = count
+        self.drop = drop
+
+
+class Snapshot:
+    def __init__(self, owner: str, name: str, tag: str):
+        self.owner = owner
+        self.name = name
+        self.tag = tag
+        self.frozen = False
+        self.created = int(time.time() * 1000)
+        # путь фрагмента -> sha1 исходного кода
+        self.fragments: Dict[str, str] = {}
+
+    def to_json(self) -> dict:
+        return {'name': self.name, 'tag': self.tag, 'frozen': self.frozen, 'removed': False,
+                'created': self.created, 'expireAt': 0, 'owner': self.owner, 'accessLevel': 'Invisible'}
+
+
+class Transaction:
+    def __init__(self, tr_id: str, params: dict, run_sec: float, log: bytes, error: Optional[str] = None):
+        self.id = tr_id
+        self.params = params
+        self.started = time.monotonic()
+        self.run_sec = run_sec
+        self.log = log
+        self.error = error
+
+    def finished(self) -> bool:
+        return (self.error is not None) or (time.monotonic() - self.started >= self.run_sec)
+
+    def log_available(self) -> int:
+        """Объём лога, "записанного" к текущему моменту"""
+        if self.finished() or self.run_sec <= 0:
+            return len(self.log)
+        return int(len(self.log) * (time.monotonic() - self.started) / self.run_sec)
+
+    def status(self) -> dict:
+        if self.error is not None:
+            return {'state': 'error', 'error': self.error}
+        if not self.finished():
+            return {'state': 'running'}
+        now = int(time.time() * 1000)
+        return {'state': 'finished', 'result': json.dumps({'ok': True}),
+                'statistics': {'tvmReads': 0, 'tvmWrites': 0, 'bytesWrite': 0, 'bytesRead': 0,
+                               'asyncCalls': 0, 'syncCalls': 0, 'totalRestarts': 0, 'totalConflicts': 0,
+                               'startTimestamp': now - int(self.run_sec * 1000), 'ioStartTimestamp': 0,
+                               'endTimestamp': now, 'workerExecTime': 0, 'workerExecTimeTotal': 0,
+                               'nodeExecTime': int(self.run_sec * 1000)}}
+
+
+class FakeCpvmServer:
+    """
+    Поддерживаются `/auth/login`, `/auth/logout`, `/cb/newSnapshot`, загрузка фрагментов (в том числе
+    `Transfer-Encoding: chunked` и сжатые тела), заморозка, `/cb/users/{u}/snapshots`, `/vm/start`,
+    `/vm/stop`, `/vm/version`, статус и `/wait` транзакции, список и удаление транзакций, чтение лога
+    транзакции с `Range`. Все запросы, кроме входа, требуют сессию, если `require_auth`.
+    """
+    def __init__(self,
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 users: Optional[Dict[str, str]] = None,
+                 latency_sec: float = 0.0,
+                 run_sec: float = 0.0,
+                 log_size: int = 4096,
+                 wait_timeout_sec: float = 30.0,
+                 fail_rate: float = 0.0,
+                 support_range: bool = True,
+                 stream_log: bool = False,
+                 gzip_log: bool = False,
+                 require_auth: bool = True):
+        """
+        :param users: имя -> пароль
+        :param latency_sec: задержка перед каждым ответом
+        :param run_sec: длительность исполнения транзакции
+        :param log_size: размер лога транзакции, байт
+        :param wait_timeout_sec: максимальная длительность long-poll `/wait`
+        :param fail_rate: доля случайных ответов 503 (кроме `/auth/*`)
+        :param support_range: `False` - заголовок `Range` игнорируется, как старыми серверами
+        :param stream_log: лог исполняющейся транзакции отдаётся chunked-ответом, который
+                           дописывается по мере роста лога до завершения транзакции
+        :param gzip_log: лог сжимается gzip, если клиент его принимает; `Range` отсчитывается
+                         в сжатых байтах, как у серверов, сжимающих ответ целиком
+        """
+        self.users = dict(users) if users is not None else {'test': 'secret'}
+        self.latency_sec = latency_sec
+        self.run_sec = run_sec
+        self.log_size = log_size
+        self.wait_timeout_sec = wait_timeout_sec
+        self.fail_rate = fail_rate
+        self.support_range = support_range
+        self.stream_log = stream_log
+        self.gzip_log = gzip_log
+        self.require_auth = require_auth
+
+        self.lock = threading.Lock()
+        self.tokens: Dict[str, str] = {}
+        self.snapshots: Dict[Tuple[str, str, str], Snapshot] = {}
+        self.fragments: Dict[str, str] = {}  # sha1 -> исходный код
+        self.transactions: Dict[str, Transaction] = {}
+        self.failures: List[Failure] = []
+        # принятые запросы: (метод, путь)
+        self.requests: List[Tuple[str, str]] = []
+        # непустые тела запросов: (`METHOD /path`, `Content-Encoding`, размер до распаковки)
+        self.bodies: List[Tuple[str, Optional[str], int]] = []
+        self.__logs: Dict[int, bytes] = {}
+
+        self.httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.httpd.daemon_threads = True
+        self.__thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeCpvmServer':
+        self.__thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,), name='fake-cpvm', daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def __enter__(self) -> 'FakeCpvmServer':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def inject(self, pattern: str, status: int = 503, count: Optional[int] = 1, drop: bool = False) -> Failure:
+        """Отказ для запросов, у которых `METHOD /path` подходит под регулярное выражение `pattern`"""
+        failure = Failure(pattern, status, count, drop)
+        with self.lock:
+            self.failures.append(failure)
+        return failure
+
+    def request_count(self, pattern: str) -> int:
+        regex = re.compile(pattern)
+        with self.lock:
+            return sum(1 for method, path in self.requests if regex.search(f'{method} {path}'))
+
+    def body_encodings(self, pattern: str) -> List[Optional[str]]:
+        """`Content-Encoding` тел запросов, у которых `METHOD /path` подходит под `pattern`"""
+        regex = re.compile(pattern)
+        with self.lock:
+            return [encoding for request, encoding, _ in self.bodies if regex.search(request)]
+
+    def login(self, user: str) -> str:
+        """Сессия пользователя в обход `/auth/login`"""
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = user
+        return token
+
+    def log_for(self, size: int) -> bytes:
+        with self.lock:
+            log = self.__logs.get(size)
+            if log is None:
+                log = self.__logs[size] = make_log(size)
+            return log
+
+    def take_failure(self, method: str, path: str) -> Optional[Failure]:
+        request = f'{method} {path}'
+        with self.lock:
+            self.requests.append((method, path))
+            for failure in self.failures:
+                if (failure.count is None or failure.count > 0) and failure.pattern.search(request):
+                    if failure.count is not None:
+                        failure.count -= 1
+                    return failure
+        if self.fail_rate > 0 and not path.startswith('/auth/') and random.random() < self.fail_rate:
+            return Failure('', 503)
+        return None
+
+
+class _Response(Exception):
+    """Ответ с ошибкой, прерывающий обработку запроса"""
+    def __init__(self, status: int, body=None):
+        super().__init__(status)
+        self.status = status
+        self.body = body
+
+
+def _make_handler(server: FakeCpvmServer):
+    class Handler(_Handler):
+        fake = server
+    return Handler
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # заголовки и тело уходят одним пакетом, иначе задержанный ACK добавляет ~40 мс к каждому ответу
+    disable_nagle_algorithm = True
+    wbufsize = -1
+    fake: FakeCpvmServer
+
+    routes = [
+        ('POST', r'/auth/login', 'login'),
+        ('POST', r'/auth/logout', 'logout'),
+        ('POST', r'/cb/newSnapshot', 'new_snapshot'),
+        ('POST', r'/cb/snapshots/(?P<name>[^/]+)/(?P<tag>[^/]+)/fragments/(?P<path>.+)', 'upload_fragment'),
+        ('POST', r'/cb/snapshots/(?P<name>[^/]+)/(?P<tag>[^/]+)/freeze', 'freeze'),
+        ('GET', r'/cb/users/(?P<owner>[^/]+)/snapshots', 'list_snapshots'),
+        ('POST', r'/vm/start', 'start'),
+        ('POST', r'/vm/stop', 'stop'),
+        ('GET', r'/vm/version', 'version'),
+        ('GET', r'/vm/transactions', 'list_transactions'),
+        ('GET', r'/vm/transactions/(?P<tr_id>[^/]+)/status', 'status'),
+        ('GET', r'/vm/transactions/(?P<tr_id>[^/]+)/wait', 'wait'),
+        ('GET', r'/vm/transactions/(?P<tr_id>[^/]+)/logs/(?P<log_id>[^/]+)', 'read_log'),
+        ('DELETE', r'/vm/transactions/(?P<tr_id>[^/]+)', 'remove_transaction'),
+    ]
+    compiled_routes = [(method, re.compile(pattern + '$'), action) for method, pattern, action in routes]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def handle_request(self, method: str):
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        # тело читается до ответа, иначе оставшиеся байты испортят следующий запрос соединения
+        body = self.read_body(f'{method} {path}')
+
+        if self.fake.latency_sec > 0:
+            time.sleep(self.fake.latency_sec)
+
+        failure = self.fake.take_failure(method, path)
+        if failure is not None:
+            if failure.drop:
+                self.close_connection = True
+                return
+            self.send_json(failure.status, {'code': failure.status, 'message': 'injected failure'})
+            return
+
+        for route_method, pattern, action in self.compiled_routes:
+            match = pattern.match(path)
+            if match and route_method == method:
+                break
+        else:
+            self.send_json(404, {'code': 404, 'message': f'not found: {path}'})
+            return
+
+        try:
+            user = None
+            if action != 'login':
+                user = self.authorized_user()
+            result = getattr(self, 'do_' + action)(user, body, parse_qs(url.query), **match.groupdict())
+            if result is not None:
+                self.send_json(200, result)
+        except _Response as r:
+            self.send_json(r.status, r.body)
+
+    def read_body(self, request: str) -> bytes:
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if size == 0:
+                    # завершающие заголовки не используются
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        encoding = self.headers.get('Content-Encoding')
+        if body:
+            with self.fake.lock:
+                self.fake.bodies.append((request, encoding, len(body)))
+        if encoding == 'gzip':
+            body = gzip.decompress(body)
+        elif encoding == 'deflate':
+            body = zlib.decompress(body)
+        elif encoding == 'zstd' and zstandard is not None:
+            body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        return body
+
+    def authorized_user(self) -> Optional[str]:
+        header = self.headers.get('Authorization', '')
+        if header.startswith('Basic '):
+            user, _, token = base64.b64decode(header[6:]).decode('utf-8').partition(':')
+            with self.fake.lock:
+                if self.fake.tokens.get(token) == user:
+                    return user
+        if self.fake.require_auth:
+            raise _Response(401, {'code': 401, 'message': 'unauthorized'})
+        return 'anonymous'
+
+    def send_json(self, status: int, obj):
+        self.send_bytes(status, json.dumps(obj).encode('utf-8'), 'application/json')
+
+    def send_bytes(self, status: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        for offset in range(0, len(body), _LOG_CHUNK_SIZE):
+            self.wfile.write(body[offset:offset + _LOG_CHUNK_SIZE])
+
+    def send_log_stream(self, tr: Transaction):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        sent = 0
+        try:
+            while True:
+                finished = tr.finished()
+                size = tr.log_available()
+                if size > sent:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (size - sent, tr.log[sent:size]))
+                    self.wfile.flush()
+                    sent = size
+                if finished:
+                    break
+                time.sleep(0.01)
+            self.wfile.write(b'0\r\n\r\n')
+        except OSError:
+            # клиент прекратил чтение
+            self.close_connection = True
+
+    @staticmethod
+    def form(body: bytes) -> Dict[str, str]:
+        return dict((k, v[0]) for k, v in parse_qs(body.decode('utf-8')).items())
+
+    def transaction(self, tr_id: str) -> Transaction:
+        with self.fake.lock:
+            tr = self.fake.transactions.get(tr_id)
+        if tr is None:
+            raise _Response(404, {'code': 404, 'message': f'transaction not found: {tr_id}'})
+        return tr
+
+    # auth
+
+    def do_login(self, user, body, query):
+        form = self.form(body)
+        name, _, password = base64.b64decode(form.get('loginAndPassword', '')).decode('utf-8').partition(':')
+        if self.fake.users.get(name) != password or not name:
+            raise _Response(400, {'code': 0, 'message': 'invalid username or password'})
+        if form.get('invalidateOld') == 'True':
+            with self.fake.lock:
+                self.fake.tokens = dict((t, u) for t, u in self.fake.tokens.items() if u != name)
+        return {'token': self.fake.login(name)}
+
+    def do_logout(self, user, body, query):
+        with self.fake.lock:
+            self.fake.tokens = dict((t, u) for t, u in self.fake.tokens.items() if u != user)
+        return {}
+
+    # codebase
+
+    def do_new_snapshot(self, user, body, query):
+        meta = json.loads(body)
+        name = meta['name']
+        tag = meta.get('tag') or uuid.uuid4().hex[:8]
+        hashes: Dict[str, str] = meta.get('fragmentHashes') or {}
+        snapshot = Snapshot(user, name, tag)
+        with self.fake.lock:
+            not_found = [h for h in hashes.values() if h.lower() not in self.fake.fragments]
+            for path, h in hashes.items():
+                if h.lower() in self.fake.fragments:
+                    snapshot.fragments[path] = h.lower()
+            self.fake.snapshots[(user, name, tag)] = snapshot
+        return {'snapshot': snapshot.to_json(), 'notFound': not_found}
+
+    def snapshot(self, user: str, name: str, tag: str) -> Snapshot:
+        with self.fake.lock:
+            snapshot = self.fake.snapshots.get((user, name, tag))
+        if snapshot is None:
+            raise _Response(400, {'code': 404, 'message': f'snapshot not found: {name}/{tag}'})
+        return snapshot
+
+    def do_upload_fragment(self, user, body, query, name, tag, path):
+        snapshot = self.snapshot(user, name, tag)
+        if snapshot.frozen:
+            raise _Response(400, {'code': 403, 'message': 'snapshot is frozen'})
+        code = json.loads(body).get('sourceCode') or ''
+        digest = hashlib.sha1(code.encode('utf-8')).hexdigest()
+        with self.fake.lock:
+            self.fake.fragments[digest] = code
+            snapshot.fragments[path] = digest
+        return {}
+
+    def do_freeze(self, user, body, query, name, tag):
+        self.snapshot(user, name, tag).frozen = True
+        return {}
+
+    def do_list_snapshots(self, user, body, query, owner):
+        name = self.form(body).get('snName')
+        with self.fake.lock:
+            return [s.to_json() for (o, n, t), s in self.fake.snapshots.items()
+                    if o == owner and (name is None or n == name)]
+
+    # vm
+
+    def do_start(self, user, body, query):
+        params = json.loads(body)
+        tr_id = params.get('transactionId') or uuid.uuid4().hex
+        with self.fake.lock:
+            tr = self.fake.transactions.get(tr_id)
+        if tr is not None:
+            # повторный запуск с тем же ID не создаёт вторую транзакцию
+            return {'transactionId': tr_id}
+
+        error = None
+        match = re.match(r'^([^/]+)/([^/]+)/([^:]+):(.+)$', params.get('fragment') or '')
+        with self.fake.lock:
+            snapshot = self.fake.snapshots.get(match.group(1, 2, 3)) if match else None
+        if snapshot is None or not snapshot.frozen or match.group(4) not in snapshot.fragments:
+            error = f"fragment not found: {params.get('fragment')}"
+
+        tr = Transaction(tr_id, params, self.fake.run_sec, self.fake.log_for(self.fake.log_size), error)
+        with self.fake.lock:
+            self.fake.transactions[tr_id] = tr
+        return {'transactionId': tr_id}
+
+    def do_stop(self, user, body, query):
+        tr = self.transaction(self.form(body).get('trId', ''))
+        if not tr.finished():
+            tr.error = 'stopped'
+        return {}
+
+    def do_version(self, user, body, query):
+        self.send_bytes(200, b'fake-cpvm', 'text/plain')
+
+    def do_list_transactions(self, user, body, query):
+        with self.fake.lock:
+            transactions = list(self.fake.transactions.values())
+        return [{'id': tr.id, 'params': tr.params, 'status': tr.status()} for tr in transactions]
+
+    def do_status(self, user, body, query, tr_id):
+        with self.fake.lock:
+            tr = self.fake.transactions.get(tr_id)
+        return tr.status() if tr else {'state': 'notFound'}
+
+    def do_wait(self, user, body, query, tr_id):
+        tr = self.transaction(tr_id)
+        remaining = tr.run_sec - (time.monotonic() - tr.started)
+        if not tr.finished() and remaining > 0:
+            time.sleep(min(remaining, self.fake.wait_timeout_sec))
+        return tr.status()
+
+    def do_remove_transaction(self, user, body, query, tr_id):
+        with self.fake.lock:
+            self.fake.transactions.pop(tr_id, None)
+        return {}
+
+    def do_read_log(self, user, body, query, tr_id, log_id):
+        tr = self.transaction(tr_id)
+        if log_id != 'log':
+            raise _Response(404, {'code': 404, 'message': f'log not found: {log_id}'})
+
+        data = tr.log[:tr.log_available()]
+        headers = {}
+        if self.fake.gzip_log and ('gzip' in self.headers.get('Accept-Encoding', '')):
+            data = gzip.compress(data, mtime=0)
+            headers['Content-Encoding'] = 'gzip'
+        size = len(data)
+        ranges = re.match(r'^bytes=(\d*)-(\d*)$', self.headers.get('Range', '')) if self.fake.support_range else None
+        if (ranges is None) and self.fake.stream_log and not tr.finished():
+            self.send_log_stream(tr)
+            return
+        if ranges is None:
+            self.send_bytes(200, data, 'text/plain', headers)
+            return
+
+        first, last = ranges.groups()
+        if first == '':
+            # суффиксный диапазон: последние N байт
+            start = max(0, size - int(last or 0))
+            end = size - 1
+        else:
+            start = int(first)
+            end = min(size - 1, int(last)) if last else size - 1
+        if start >= size or start > end:
+            self.send_bytes(416, b'', 'text/plain', {'Content-Range': f'bytes */{size}'})
+            return
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        self.send_bytes(206, data[start:end + 1], 'text/plain', headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fake CPVM API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5678)
+    parser.add_argument('--user', action='append', default=None, metavar='NAME:PASSWORD',
+                        help='user account (default: test:secret)')
+    parser.add_argument('--latency', type=float, default=0.0, help='delay before every response, seconds')
+    parser.add_argument('--run-sec', type=float, default=0.0, help='transaction execution time, seconds')
+    parser.add_argument('--log-size', type=int, default=4096, help='transaction log size, bytes')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of random 503 responses')
+    args = parser.parse_args()
+
+    users = dict(u.split(':', 1) for u in args.user) if args.user else None
+    server = FakeCpvmServer(args.host, args.port, users=users, latency_sec=args.latency, run_sec=args.run_sec,
+                            log_size=args.log_size, fail_rate=args.fail_rate)
+    print('listening on', server.address, flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+
+from py_launcher.file_walker import walk_files
+
+
+class WalkFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        for path in ['a/b/c.py', 'a/d.lua', 'a/e.txt', 'build/z.py', 'src/gen/g.py', 'src/keep.py', 'src/skip.lua',
+                     '.git/hook.py', 'node_modules/x/y.lua', 'env2/pyvenv.cfg', 'env2/lib.py']:
+            self.write(path, '')
+        self.write('.gitignore', '# build output\nbuild/\n*.lua\n!a/d.lua\n')
+        self.write('src/.acapellaignore', 'gen\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, rel_path: str, text: str):
+        path = os.path.join(self.root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def walk(self, path: str = '.'):
+        files = walk_files(os.path.join(self.root, path), base=self.root, extensions=['py', 'lua'])
+        return [os.path.relpath(f, self.root).replace(os.sep, '/') for f in files]
+
+    def test_prunes_and_honors_ignore_files(self):
+        self.assertEqual(self.walk(), ['a/b/c.py', 'a/d.lua', 'src/keep.py'])
+
+    def test_parent_rules_apply_to_subdirectory(self):
+        self.assertEqual(self.walk('src'), ['src/keep.py'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from py_launcher import hash_cache, local_cache
+from py_launcher.hash_cache import HashCache
+
+
+class HashCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.cache_dir = os.path.join(self.dir, 'cache')
+        patcher = mock.patch.object(local_cache, 'cache_path', self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.hashed = []
+        traced_digest = hash_cache._traced_digest
+
+        def counting_digest(path: str) -> str:
+            self.hashed.append(path)
+            return traced_digest(path)
+        patcher = mock.patch.object(hash_cache, '_traced_digest', counting_digest)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, name: str, data: bytes, age_sec: float = 60) -> str:
+        """Файл с mtime в прошлом: за пределами окна, в котором кешировать нельзя"""
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        mtime_ns = time.time_ns() - int(age_sec * 1e9)
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        return path
+
+    def digest(self, *paths: str) -> list:
+        cache = HashCache()
+        digests = cache.digest_many(paths, jobs=2)
+        cache.save()
+        return digests
+
+    def test_unchanged_file_is_not_rehashed(self):
+        a = self.write('a.py', b'print(1)')
+        b = self.write('b.py', b'print(2)')
+        self.assertEqual([hashlib.sha1(b'print(1)').hexdigest(), hashlib.sha1(b'print(2)').hexdigest()],
+                         self.digest(a, b))
+        self.assertEqual(2, len(self.hashed))
+
+        # новый экземпляр читает сохранённый кеш: подписи совпадают, файлы не читаются
+        self.assertEqual(self.digest(a, b), self.digest(b, a)[::-1])
+        self.assertEqual(2, len(self.hashed))
+
+    def test_modified_file_is_rehashed(self):
+        a = self.write('a.py', b'print(1)')
+        self.digest(a)
+        # тот же размер, другое содержимое и mtime
+        a = self.write('a.py', b'print(3)', age_sec=30)
+        self.assertEqual([hashlib.sha1(b'print(3)').hexdigest()], self.digest(a))
+        self.assertEqual(2, len(self.hashed))
+
+    def test_recent_file_is_not_cached(self):
+        # запись в пределах точности mtime может не изменить подпись, поэтому свежий файл не кешируется
+        a = self.write('a.py', b'print(1)', age_sec=0)
+        self.digest(a)
+        self.digest(a)
+        self.assertEqual(2, len(self.hashed))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, HashCache.file_name)))
+
+    def test_corrupt_cache_file(self):
+        os.makedirs(self.cache_dir)
+        cache_file = os.path.join(self.cache_dir, HashCache.file_name)
+        with open(cache_file, 'w') as f:
+            f.write('{"truncated')
+
+        a = self.write('a.py', b'print(1)')
+        self.assertEqual([hashlib.sha1(b'print(1)').hexdigest()], self.digest(a))
+        with open(cache_file) as f:
+            self.assertIn(os.path.abspath(a), json.load(f))
+
+        # сбой посреди записи не портит прежний файл и не оставляет временных
+        b = self.write('b.py', b'print(2)')
+        with mock.patch.object(local_cache.json, 'dump', side_effect=OSError('disk full')):
+            self.digest(b)
+        with open(cache_file) as f:
+            self.assertEqual([os.path.abspath(a)], list(json.load(f)))
+        self.assertEqual([HashCache.file_name], os.listdir(self.cache_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import unittest
+
+root_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# суммарное время импорта `py_launcher.launcher` (микросекунды, по `-X importtime`); сейчас около 100 мс,
+# бюджет втрое больше - с запасом на нагруженную машину. Жадный импорт `requests` и команд ловит `test_lazy_imports`
+IMPORT_TIME_BUDGET_US = 300 * 1000
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable] + list(args), cwd=root_path, capture_output=True, text=True, check=True)
+
+
+class LauncherImportTest(unittest.TestCase):
+    def test_lazy_imports(self):
+        # HTTP-клиенты и модули команд загружаются только при запуске команды
+        code = ('import sys, py_launcher.launcher\n'
+                'heavy = ("requests", "urllib3", "aiohttp", "acapella_api.aio")\n'
+                'print(" ".join(sorted(m for m in sys.modules if m.split(".")[0] in heavy or m in heavy\n'
+                '                      or m.startswith("py_launcher.cmd_") or m == "py_launcher.presets")))')
+        loaded = run_python('-c', code).stdout.split()
+        self.assertEqual(loaded, [])
+
+    def test_import_time_budget(self):
+        stderr = run_python('-X', 'importtime', '-c', 'import py_launcher.launcher').stderr
+        cumulative = None
+        for line in stderr.splitlines():
+            parts = [p.strip() for p in line.split('|')]
+            if len(parts) == 3 and parts[2] == 'py_launcher.launcher':
+                cumulative = int(parts[1])
+        self.assertIsNotNone(cumulative)
+        self.assertLess(cumulative, IMPORT_TIME_BUDGET_US)
+
+    def test_commands_registry(self):
+        from py_launcher.launcher import command_by_name, load_command
+        for name, (module, cls, doc) in command_by_name.items():
+            cmd = load_command(name)
+            self.assertEqual(cmd.name, name)
+            self.assertEqual(cmd.doc, doc)
+
+
+class GlobalOptionsTest(unittest.TestCase):
+    def test_options_before_command(self):
+        from py_launcher.launcher import pop_global_options
+        argv = ['--stats', '--trace', 'trace.json', '--profile=run.prof', 'start', 'main.py']
+        self.assertEqual({'--stats': True, '--trace': 'trace.json', '--profile': 'run.prof'},
+                         pop_global_options(argv))
+        self.assertEqual(['start', 'main.py'], argv)
+
+    def test_command_arguments_are_kept(self):
+        from py_launcher.launcher import pop_global_options
+        argv = ['run', 'main.py', '--stats', '--trace', 'x']
+        self.assertEqual({}, pop_global_options(argv))
+        self.assertEqual(['run', 'main.py', '--stats', '--trace', 'x'], argv)
+
+
+if __name__ == '__main__':
+    unittest.main()
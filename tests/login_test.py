@@ -1,3 +1,40 @@
-from py_launcher.cmd_login import LoginCommand
+import unittest
 
-LoginCommand().request_login()
\ No newline at end of file
+from acapella_api import AcapellaApi
+from acapella_api.context import ApiError, HttpError
+from fake_server import FakeCpvmServer
+
+
+class LoginTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCpvmServer(users={'test': 'secret'}).start()
+        self.acapella = AcapellaApi(self.server.address)
+
+    def tearDown(self):
+        self.acapella.close()
+        self.server.stop()
+
+    def test_login(self):
+        self.acapella.auth.login('test', 'secret')
+        self.assertEqual(self.acapella.auth.user_id, 'test')
+        self.assertIsNotNone(self.acapella.auth.token)
+        self.assertEqual(self.acapella.codebase.get_snapshots(), [])
+
+    def test_invalid_password(self):
+        with self.assertRaises(ApiError) as cm:
+            self.acapella.auth.login('test', 'wrong')
+        self.assertEqual(cm.exception.error_code, 0)
+
+    def test_logout(self):
+        self.acapella.auth.login('test', 'secret')
+        token = self.acapella.auth.token
+        self.acapella.auth.logout()
+
+        self.acapella.auth.user_id, self.acapella.auth.token = 'test', token
+        with self.assertRaises(HttpError) as cm:
+            self.acapella.codebase.get_snapshots()
+        self.assertEqual(cm.exception.status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
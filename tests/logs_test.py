@@ -0,0 +1,191 @@
+import io
+import mmap
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+from acapella_api import AcapellaApi
+from acapella_api.codebase import ExecutorType
+from acapella_api.log_cache import LogCache
+from acapella_api.logs import LogFilter, _LogSpool
+from acapella_api.vm import TransactionParameters
+from fake_server import FakeCpvmServer
+
+
+class LogFilterTest(unittest.TestCase):
+    def filter(self, chunks, **kwargs):
+        output = io.StringIO()
+        log_filter = LogFilter(output, **kwargs)
+        for chunk in chunks:
+            log_filter.write(chunk)
+        log_filter.close()
+        return output.getvalue(), log_filter
+
+    def test_lines_split_across_chunks(self):
+        text, _ = self.filter(['err', 'or 1\nok\ner', 'ror 2'], grep='^error')
+        self.assertEqual(text, 'error 1\nerror 2')
+
+    def test_head_stops(self):
+        text, log_filter = self.filter(['a\nb\nc\nd\n'], head=2)
+        self.assertEqual(text, 'a\nb\n')
+        self.assertTrue(log_filter.done)
+
+    def test_tail_after_grep_and_head(self):
+        lines = ''.join(f'{i}\n' for i in range(100))
+        text, _ = self.filter([lines], grep='5', head=4, tail=2)
+        self.assertEqual(text, '25\n35\n')
+
+
+class LogSpoolTest(unittest.TestCase):
+    def test_lines_while_writing(self):
+        spool = _LogSpool(chunk_size=4)
+        chunks = ['пе'.encode('utf-8')[:3], 'пе'.encode('utf-8')[3:] + b'rvaya\r', b'\nvtoraya\n', b'tail']
+
+        def writer():
+            for chunk in chunks:
+                spool.write(chunk)
+            spool.finish(True)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        self.assertEqual(list(spool.lines()), ['пеrvaya\r\n', 'vtoraya\n', 'tail\n'])
+        thread.join()
+        spool.close()
+
+    def test_error_after_data(self):
+        spool = _LogSpool(chunk_size=1024)
+        spool.write(b'line\n')
+        spool.finish(False, ValueError('broken'))
+        lines = spool.lines()
+        self.assertEqual(next(lines), 'line\n')
+        self.assertRaises(ValueError, next, lines)
+        spool.close()
+
+
+class LogCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache = LogCache(os.path.join(tmp.name, 'logs'), max_bytes=250)
+
+    def read(self, key: str, chunk_size: int = 1024):
+        chunks = []
+        found = self.cache.read_into(key, lambda chunk: chunks.append(bytes(chunk)), chunk_size)
+        return b''.join(chunks) if found else None
+
+    def store(self, key: str, data: bytes):
+        pending = self.cache.begin(key)
+        pending.write(data)
+        pending.commit()
+
+    def test_commit_and_abort(self):
+        pending = self.cache.begin('a')
+        pending.write(b'first ')
+        pending.write(b'second')
+        # недописанный лог не виден
+        self.assertIsNone(self.read('a'))
+        pending.commit()
+        self.assertEqual(b'first second', self.read('a'))
+
+        pending = self.cache.begin('b')
+        pending.write(b'partial')
+        pending.abort()
+        self.assertIsNone(self.read('b'))
+        self.assertEqual(['a.log'], os.listdir(self.cache.path))
+
+    def test_read_into_mmap(self):
+        self.store('a', b'0123456789')
+        chunks = []
+
+        def write(chunk):
+            # блок - срез отображения файла, после возврата из `write` он недействителен
+            self.assertIsInstance(chunk, memoryview)
+            chunks.append(bytes(chunk))
+        with mock.patch.object(mmap, 'mmap', wraps=mmap.mmap) as mapped:
+            self.assertTrue(self.cache.read_into('a', write, 4))
+        self.assertEqual(1, mapped.call_count)
+        self.assertEqual([b'0123', b'4567', b'89'], chunks)
+
+        # пустой файл не отображается в память
+        self.store('empty', b'')
+        with mock.patch.object(mmap, 'mmap', wraps=mmap.mmap) as mapped:
+            self.assertEqual(b'', self.read('empty'))
+        self.assertEqual(0, mapped.call_count)
+
+    def test_lru_eviction(self):
+        now = time.time()
+        for age, key in enumerate(['c', 'b', 'a']):
+            self.store(key, bytes(100))
+            os.utime(self.cache.file_path(key), (now - 100 * (age + 1), now - 100 * (age + 1)))
+
+        # чтение обновляет mtime: 'a' становится самым свежим, вытесняются 'b' и 'c'
+        self.assertIsNotNone(self.read('a'))
+        self.store('d', bytes(100))
+        self.assertEqual(['a.log', 'd.log'], sorted(os.listdir(self.cache.path)))
+
+
+class LogCacheApiTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = os.path.join(tmp.name, 'logs')
+
+        self.server = FakeCpvmServer(run_sec=0, log_size=200 * 1024).start()
+        self.addCleanup(self.server.stop)
+        self.acapella = AcapellaApi(self.server.address, log_cache_dir=self.cache_dir)
+        self.addCleanup(self.acapella.close)
+        self.acapella.auth.login('test', 'secret')
+
+        snapshot = self.acapella.codebase.create_snapshot('test-snapshot').snapshot
+        self.acapella.codebase.upload(snapshot.name, snapshot.tag, path='test/hello.py',
+                                      code='print("Hello World!")', exec_types=[ExecutorType.CPYTHON])
+        self.acapella.codebase.freeze_snapshot(snapshot.name, snapshot.tag)
+        self.fragment = f'{snapshot.owner}/{snapshot.name}/{snapshot.tag}:test/hello.py'
+
+    def read(self, tr_id: str) -> bytes:
+        output = io.BytesIO()
+        self.assertTrue(self.acapella.logs.read_tr_log(tr_id, 'log', output, binary=True))
+        return output.getvalue()
+
+    def cached_files(self):
+        return os.listdir(self.cache_dir) if os.path.isdir(self.cache_dir) else []
+
+    def test_finished_log_is_cached(self):
+        tr_id = self.acapella.vm.start_transaction(TransactionParameters(self.fragment)).transaction_id
+        self.assertEqual(self.server.log_for(self.server.log_size), self.read(tr_id))
+        self.assertEqual(1, len(self.cached_files()))
+
+        self.assertEqual(self.server.log_for(self.server.log_size), self.read(tr_id))
+        self.assertEqual(1, self.server.request_count(r'/logs/log$'))
+
+    def test_running_log_is_not_cached(self):
+        self.server.run_sec = 10
+        tr_id = self.acapella.vm.start_transaction(TransactionParameters(self.fragment)).transaction_id
+        self.assertLess(len(self.read(tr_id)), self.server.log_size)
+        self.assertEqual([], self.cached_files())
+
+        # следующее чтение снова идёт на сервер
+        self.read(tr_id)
+        self.assertEqual(2, self.server.request_count(r'/logs/log$'))
+        self.assertEqual([], self.cached_files())
+
+    def test_failed_read_is_not_cached(self):
+        tr_id = self.acapella.vm.start_transaction(TransactionParameters(self.fragment)).transaction_id
+        failure = self.server.inject(r'/logs/log$', count=None, drop=True)
+        with self.assertRaises(requests.ConnectionError):
+            self.read(tr_id)
+        self.assertEqual([], self.cached_files())
+
+        self.server.failures.remove(failure)
+
+        self.assertEqual(self.server.log_for(self.server.log_size), self.read(tr_id))
+        self.assertEqual(1, len(self.cached_files()))
+
+
+if __name__ == '__main__':
+    unittest.main()
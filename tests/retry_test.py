@@ -0,0 +1,24 @@
+import unittest
+
+from acapella_api.common import Deadline
+from acapella_api.retry import RetryPolicy, NO_RETRY
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_backoff_is_bounded(self):
+        policy = RetryPolicy(backoff_base_sec=0.1, backoff_max_sec=1.0)
+        for attempt in range(10):
+            pause = policy.backoff(attempt)
+            self.assertGreaterEqual(pause, 0)
+            self.assertLessEqual(pause, min(1.0, 0.1 * 2 ** attempt))
+
+    def test_attempts_and_budget(self):
+        policy = RetryPolicy(max_attempts=3)
+        self.assertTrue(policy.can_retry(1, Deadline(None)))
+        self.assertFalse(policy.can_retry(2, Deadline(None)))
+        self.assertFalse(policy.can_retry(0, Deadline(0)))
+        self.assertFalse(NO_RETRY.can_retry(0, Deadline(None)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from acapella_api import AcapellaApi
+from acapella_api.codebase import SnapshotMeta
+from acapella_api.common import AccessLevel
+from fake_server import FakeCpvmServer
+from py_launcher import cmd_run, cmd_start, cmd_upload, local_cache, snapshot_manifest
+from py_launcher.snapshot_manifest import SnapshotManifest
+
+
+class SnapshotManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCpvmServer(run_sec=0.1).start()
+        self.acapella = AcapellaApi(self.server.address)
+        self.acapella.auth.login('test', 'secret')
+        self.addCleanup(self.server.stop)
+        self.addCleanup(self.acapella.close)
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = os.path.join(tmp.name, 'src')
+        os.makedirs(self.root)
+        for name, code in (('hello.py', 'print("Hello World!")'), ('util.py', 'X = 1')):
+            with open(os.path.join(self.root, name), 'w') as f:
+                f.write(code)
+
+        for patcher in (mock.patch.object(local_cache, 'cache_path', os.path.join(tmp.name, 'cache')),
+                        mock.patch.object(cmd_upload, 'ap', self.acapella),
+                        mock.patch.object(cmd_start, 'ap', self.acapella),
+                        mock.patch.object(cmd_run, 'ap', self.acapella),
+                        mock.patch.object(cmd_run, 'dir_path', self.root)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def upload(self, **kwargs):
+        command = cmd_upload.UploadCommand()
+        fragments = command.search_fragment_files(['.'], root=self.root)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return command.upload_fragments(fragments, **kwargs)
+
+    def new_snapshot_count(self) -> int:
+        return self.server.request_count(r'/cb/newSnapshot')
+
+    def test_reuse(self):
+        first = self.upload()
+        self.assertEqual(1, self.new_snapshot_count())
+        self.assertEqual(str(first), str(self.upload()))
+        self.assertEqual(1, self.new_snapshot_count())
+
+        # без индекса или с другим набором фрагментов снапшот создаётся заново
+        self.assertNotEqual(str(first), str(self.upload(use_manifest=False)))
+        with open(os.path.join(self.root, 'util.py'), 'w') as f:
+            f.write('X = 2')
+        self.upload()
+        self.assertEqual(3, self.new_snapshot_count())
+
+    def test_ttl_expiry(self):
+        now_ms = snapshot_manifest._now_ms()
+        self.upload()
+        with mock.patch.object(snapshot_manifest, '_now_ms', return_value=now_ms + 59 * 60 * 1000):
+            self.upload()
+        self.assertEqual(1, self.new_snapshot_count())
+        with mock.patch.object(snapshot_manifest, '_now_ms', return_value=now_ms + 61 * 60 * 1000):
+            self.upload()
+        self.assertEqual(2, self.new_snapshot_count())
+
+    def test_expire_at(self):
+        now_ms = snapshot_manifest._now_ms()
+
+        def snapshot(tag, expire_at):
+            return SnapshotMeta('sn', tag, frozen=True, removed=False, created=now_ms, expireAt=expire_at,
+                                owner='test', accessLevel=AccessLevel.INVISIBLE)
+
+        manifest = SnapshotManifest()
+        manifest.put('soon', snapshot('t1', now_ms + 30 * 1000))
+        manifest.put('later', snapshot('t2', now_ms + 10 * 60 * 1000))
+        manifest.put('never', snapshot('t3', 0))
+        manifest.put('removed', SnapshotMeta('sn', 't4', frozen=True, removed=True, created=now_ms,
+                                             expireAt=0, owner='test'))
+
+        manifest = SnapshotManifest()
+        # истекающий в пределах запаса снапшот не переиспользуется
+        self.assertIsNone(manifest.find('soon'))
+        self.assertEqual('t2', manifest.find('later').tag)
+        self.assertEqual('t3', manifest.find('never').tag)
+        self.assertIsNone(manifest.find('removed'))
+        with mock.patch.object(snapshot_manifest, '_now_ms', return_value=now_ms + 10 * 60 * 1000):
+            self.assertIsNone(manifest.find('later'))
+
+    def test_missing_snapshot_is_dropped(self):
+        sn_id = self.upload()
+        # сервер удалил снапшот раньше, чем истёк срок в индексе
+        del self.server.snapshots[(sn_id.owner, sn_id.name, sn_id.tag)]
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            cmd_run.RunCommand().handle(['hello.py', '--log', 'none'])
+        self.assertIn('matches with recently uploaded snapshot', stdout.getvalue())
+        self.assertIn('removed from the local manifest', stderr.getvalue())
+        self.assertEqual(1, self.new_snapshot_count())
+
+        # следующий запуск создаёт новый снапшот и завершается успешно
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(io.StringIO()):
+            cmd_run.RunCommand().handle(['hello.py', '--log', 'none'])
+        self.assertEqual(2, self.new_snapshot_count())
+        self.assertIn('transaction completed', stdout.getvalue())
+
+    def test_existing_snapshot_is_kept(self):
+        self.upload()
+        command = cmd_upload.UploadCommand()
+        fragments = command.search_fragment_files(['.'], root=self.root)
+        with contextlib.redirect_stdout(io.StringIO()):
+            command.upload_fragments(fragments)
+        self.assertIsNotNone(command.manifest_snapshot)
+        # снапшот есть на сервере: ошибка транзакции не связана с индексом
+        self.assertFalse(command.forget_missing_snapshot())
+        self.upload()
+        self.assertEqual(1, self.new_snapshot_count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+
+from acapella_api import AcapellaApi, context
+from acapella_api.retry import RetryPolicy
+from acapella_api.stats import RequestRecord, RequestStats, path_template, percentile
+from fake_server import FakeCpvmServer
+
+
+def make_record(method: str, path: str, total_sec: float, status: int = 200) -> RequestRecord:
+    record = RequestRecord(method, path)
+    record.status = status
+    record.total_sec = total_sec
+    return record
+
+
+class RequestStatsTest(unittest.TestCase):
+    def test_path_template(self):
+        self.assertEqual('/vm/transactions/{trId}/status', path_template('/vm/transactions/42/status'))
+        self.assertEqual('/cb/snapshots/{name}/{tag}/fragments/{path}',
+                         path_template('/cb/snapshots/user/1/fragments/dir/file.py'))
+        self.assertEqual('/vm/transactions', path_template('/vm/transactions?user=me'))
+
+    def test_percentile(self):
+        values = [float(v) for v in range(1, 11)]
+        self.assertEqual(5.0, percentile(values, 50))
+        self.assertEqual(10.0, percentile(values, 99))
+        self.assertIsNone(percentile([], 50))
+
+    def test_summary_groups_by_endpoint(self):
+        stats = RequestStats()
+        stats(make_record('get', '/vm/transactions/1/status', 0.1))
+        stats(make_record('get', '/vm/transactions/2/status', 0.3, status=503))
+        stats(make_record('post', '/vm/start', 0.2))
+
+        rows = stats.summary()
+        self.assertEqual(['GET /vm/transactions/{trId}/status', 'POST /vm/start'], [r['endpoint'] for r in rows])
+        self.assertEqual(2, rows[0]['count'])
+        self.assertEqual(1, rows[0]['errors'])
+        self.assertAlmostEqual(0.3, rows[0]['max'])
+
+
+class RequestTimingTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCpvmServer(latency_sec=0.2).start()
+        self.records = []
+
+    def tearDown(self):
+        self.server.stop()
+
+    def api(self, **kwargs) -> AcapellaApi:
+        # имя вместо адреса, чтобы соединение включало разрешение имени
+        acapella = AcapellaApi(self.server.address.replace('127.0.0.1', 'localhost'), **kwargs)
+        acapella.add_request_hook(self.records.append)
+        self.addCleanup(acapella.close)
+        return acapella
+
+    def test_attempt_timing(self):
+        acapella = self.api()
+        acapella.auth.login('test', 'secret')
+        acapella.auth.login('test', 'secret')
+
+        first, second = self.records
+        self.assertEqual(1, len(first.attempts))
+        self.assertGreater(first.dns_sec, 0)
+        self.assertGreater(first.connect_sec, 0)
+        self.assertGreaterEqual(first.ttfb_sec, 0.2)
+        # соединение из пула
+        self.assertEqual(0, second.dns_sec)
+        self.assertEqual(0, second.connect_sec)
+
+    def test_dns_timed_separately(self):
+        getaddrinfo = socket.getaddrinfo
+
+        def slow_getaddrinfo(host, *args, **kwargs):
+            # медленно только разрешение имени; адрес соединение разбирает повторно, без DNS
+            if host == 'localhost':
+                time.sleep(0.1)
+            return getaddrinfo(host, *args, **kwargs)
+
+        acapella = self.api()
+        with mock.patch('socket.getaddrinfo', slow_getaddrinfo):
+            acapella.auth.login('test', 'secret')
+
+        record = self.records[0]
+        self.assertGreaterEqual(record.dns_sec, 0.1)
+        self.assertLess(record.connect_sec, 0.1)
+        self.assertLess(record.ttfb_sec, record.total_sec - record.dns_sec)
+
+    def test_without_dns_timing(self):
+        # версия urllib3, устройство которой неизвестно: время DNS входит в `connect_sec`
+        with mock.patch.object(context, '_DNS_TIMING_URLLIB3_MAJOR', 0):
+            acapella = self.api()
+            acapella.auth.login('test', 'secret')
+
+        record = self.records[0]
+        self.assertEqual(200, record.status)
+        self.assertEqual(0, record.dns_sec)
+        self.assertGreater(record.connect_sec, 0)
+
+    def test_hedged_attempts(self):
+        acapella = self.api(retry=RetryPolicy(hedge_delay_sec=0.1))
+        acapella.auth.login('test', 'secret')
+        acapella.vm.get_transaction_status(1)
+
+        record = self.records[-1]
+        self.assertEqual([False, True], [a.hedge for a in record.attempts])
+        self.assertEqual(200, record.attempts[0].status)
+        # дублирующий запрос открывает своё соединение в своём потоке, и оно тоже учтено
+        self.assertGreater(record.attempts[1].connect_sec, 0)
+        self.assertGreaterEqual(record.ttfb_sec, 0.15)
+
+        # проигравший запрос обрывается, не дожидаясь ответа сервера
+        for thread in threading.enumerate():
+            if thread.name == 'hedge':
+                thread.join(1.0)
+        self.assertIsNotNone(record.attempts[1].error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from acapella_api.stats import RequestRecord
+from py_launcher import tracing
+
+
+class TracingTest(unittest.TestCase):
+    def tearDown(self):
+        tracing.tracer = None
+
+    def test_span_without_tracer(self):
+        with tracing.span('phase'):
+            pass
+        self.assertIsNone(tracing.tracer)
+
+    def test_http_spans_nest_in_phase(self):
+        tracer = tracing.start_tracing('acapella test')
+        with tracing.span('phase', path='a.lua'):
+            record = RequestRecord('post', '/cb/snapshots/sn/1/freeze')
+            record.started = time.monotonic()
+            record.status = 200
+            record.total_sec = 0.001
+            time.sleep(0.002)
+            tracer.record_request(record)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trace.json')
+            tracer.save(path)
+            with open(path) as source:
+                events = json.load(source)['traceEvents']
+
+        spans = dict((e['name'], e) for e in events if e['ph'] == 'X')
+        phase = spans['phase']
+        request = spans['POST /cb/snapshots/{name}/{tag}/freeze']
+        self.assertEqual(phase['tid'], request['tid'])
+        self.assertEqual('a.lua', phase['args']['path'])
+        self.assertLessEqual(phase['ts'], request['ts'])
+        self.assertGreaterEqual(phase['ts'] + phase['dur'], request['ts'] + request['dur'])
+        self.assertEqual(1, len([e for e in events if e['name'] == 'thread_name']))
+
+
+if __name__ == '__main__':
+    unittest.main()
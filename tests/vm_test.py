@@ -1,32 +1,219 @@
+import io
+import threading
+import time
 import unittest
 
 from acapella_api import AcapellaApi
-from acapella_api.codebase import NewSnapshotMeta, ExecutorType
-from acapella_api.vm import TransactionState
+from acapella_api.codebase import ExecutorType
+from acapella_api.common import Deadline
+from acapella_api.logs import LogRef, LogScope
+from acapella_api.vm import ExecutionTimeout, TransactionParameters, TransactionState
+from fake_server import FakeCpvmServer
 
 
 class VmApiTest(unittest.TestCase):
-    def test_start(self):
-        acapella = AcapellaApi()
+    def setUp(self):
+        self.server = FakeCpvmServer(run_sec=0.3, log_size=200 * 1024).start()
+        self.acapella = AcapellaApi(self.server.address)
+        self.acapella.auth.login('test', 'secret')
+
+    def tearDown(self):
+        self.acapella.close()
+        self.server.stop()
 
+    def upload_snapshot(self):
+        acapella = self.acapella
         sn_name = "test-snapshot"
-        snapshot: NewSnapshotMeta = acapella.codebase.create_snapshot(sn_name)
+        snapshot = acapella.codebase.create_snapshot(sn_name).snapshot
         self.assertIsNotNone(snapshot)
         self.assertEqual(snapshot.name, sn_name)
-        print('snapshot created: ' + snapshot.tag)
 
         acapella.codebase.upload(snapshot.name, snapshot.tag,
                                  path="test/hello.py",
                                  code='print("Hello World!")',
-                                 execTypes=[ExecutorType.CPYTHON])
+                                 exec_types=[ExecutorType.CPYTHON])
 
         acapella.codebase.freeze_snapshot(snapshot.name, snapshot.tag)
+        return snapshot
 
-        start_res = acapella.vm.call('TEST_USER', snapshot.name, snapshot.tag, "test/hello.py")
+    def test_start(self):
+        snapshot = self.upload_snapshot()
+
+        start_res = self.acapella.vm.call(snapshot.owner, snapshot.name, snapshot.tag, "test/hello.py")
         self.assertIsNotNone(start_res)
 
-        status = acapella.vm.wait_transaction(start_res.transaction_id)
-        self.assertNotEqual(status.state, TransactionState.RUNNING)
+        status = self.acapella.vm.wait_transaction(start_res.transaction_id)
+        self.assertEqual(status.state, TransactionState.FINISHED.value)
+
+        tr_ids = [tr.id for tr in self.acapella.vm.get_transactions()]
+        self.assertEqual(tr_ids, [start_res.transaction_id])
+        self.acapella.vm.remove_transaction(start_res.transaction_id)
+        self.assertEqual(self.acapella.vm.get_transactions(), [])
+
+    def test_follow_log(self):
+        snapshot = self.upload_snapshot()
+        tr_id = self.acapella.vm.call(snapshot.owner, snapshot.name, snapshot.tag, "test/hello.py").transaction_id
+
+        output = io.BytesIO()
+        ref = LogRef(LogScope.TRANSACTION, 'test', 'log', trId=tr_id)
+        self.assertTrue(self.acapella.logs.follow_log(ref, output, binary=True))
+        # лог читался частями, пока транзакция исполнялась, и продолжался через Range
+        self.assertEqual(len(output.getvalue()), self.server.log_size)
+        self.assertEqual(output.getvalue(), self.server.log_for(self.server.log_size))
+
+    def test_follow_log_gzip(self):
+        # продолжение через Range отсчитывается в байтах лога, поэтому лог запрашивается несжатым
+        self.server.gzip_log = True
+        self.test_follow_log()
+
+    def test_read_tail_gzip(self):
+        self.server.gzip_log = True
+        self.test_read_tail()
+
+    def test_follow_log_unreachable(self):
+        snapshot = self.upload_snapshot()
+        tr_id = self.acapella.vm.call(snapshot.owner, snapshot.name, snapshot.tag, "test/hello.py").transaction_id
+
+        self.server.inject(r'/logs/log$', count=None, drop=True)
+        tr_finished = threading.Event()
+        tr_finished.set()
+        ref = LogRef(LogScope.TRANSACTION, 'test', 'log', trId=tr_id)
+        # ни одного ответа с логом не было: лог не найден, а не пуст
+        self.assertFalse(self.acapella.logs.follow_log(ref, io.BytesIO(), binary=True, tr_finished=tr_finished))
+
+    def test_read_logs(self):
+        snapshot = self.upload_snapshot()
+        tr_ids = [self.acapella.vm.call(snapshot.owner, snapshot.name, snapshot.tag, "test/hello.py").transaction_id
+                  for _ in range(3)]
+        for tr_id in tr_ids:
+            self.acapella.vm.wait_transaction(tr_id)
+
+        refs = [LogRef(LogScope.TRANSACTION, 'test', 'log', trId=tr_id) for tr_id in tr_ids]
+        missing = LogRef(LogScope.TRANSACTION, 'test', 'missing', trId=tr_ids[0])
+        output = io.StringIO()
+        not_found = self.acapella.logs.read_logs(refs + [missing], output, jobs=2)
+
+        self.assertEqual(not_found, [missing])
+        lines = output.getvalue().splitlines(keepends=True)
+        # незавершённая последняя строка лога дополняется переводом строки
+        expected = (self.server.log_for(self.server.log_size).decode('utf-8') + '\n').splitlines(keepends=True)
+        self.assertEqual(lines, ['[log] ' + line for line in expected] * 3)
+
+    def test_read_tail(self):
+        snapshot = self.upload_snapshot()
+        tr_id = self.acapella.vm.call(snapshot.owner, snapshot.name, snapshot.tag, "test/hello.py").transaction_id
+        self.acapella.vm.wait_transaction(tr_id)
+        ref = LogRef(LogScope.TRANSACTION, 'test', 'log', trId=tr_id)
+        lines = self.server.log_for(self.server.log_size).decode('utf-8').splitlines(keepends=True)
+
+        output = io.StringIO()
+        self.assertTrue(self.acapella.logs.filter_log(ref, output, tail=3))
+        self.assertEqual(lines[-3:], output.getvalue().splitlines(keepends=True))
+        # хватило одного запроса конца лога
+        self.assertEqual(1, self.server.request_count(r'/logs/log$'))
+
+    def test_read_tail_of_short_log(self):
+        # 6 строк: весь лог помещается в первый диапазон, строк меньше, чем запрошено
+        self.server.log_size = 6 * 65
+        snapshot = self.upload_snapshot()
+        tr_id = self.acapella.vm.call(snapshot.owner, snapshot.name, snapshot.tag, "test/hello.py").transaction_id
+        self.acapella.vm.wait_transaction(tr_id)
+        ref = LogRef(LogScope.TRANSACTION, 'test', 'log', trId=tr_id)
+        lines = self.server.log_for(self.server.log_size).decode('utf-8').splitlines(keepends=True)
+        self.assertEqual(6, len(lines))
+
+        for tail in (4, 6, 8, 10, 13):
+            output = io.StringIO()
+            self.assertTrue(self.acapella.logs.filter_log(ref, output, tail=tail))
+            self.assertEqual(lines[-tail:], output.getvalue().splitlines(keepends=True), tail)
+
+    def test_status_retry(self):
+        snapshot = self.upload_snapshot()
+        tr_id = self.acapella.vm.call(snapshot.owner, snapshot.name, snapshot.tag, "test/hello.py").transaction_id
+
+        self.server.inject(r'^GET /vm/transactions/[^/]+/wait$', status=503, count=2)
+        status = self.acapella.vm.wait_transaction(tr_id, deadline=Deadline(10))
+        self.assertEqual(status.state, TransactionState.FINISHED.value)
+        self.assertGreaterEqual(self.server.request_count(r'/wait$'), 3)
+
+    def test_wait_budget_expires_before_request(self):
+        snapshot = self.upload_snapshot()
+        tr_id = self.acapella.vm.call(snapshot.owner, snapshot.name, snapshot.tag, "test/hello.py").transaction_id
+
+        # бюджет истёк между проверкой в цикле и запросом `/wait`
+        deadline = Deadline(0)
+        deadline.expired = lambda: False
+        with self.assertRaises(ExecutionTimeout):
+            self.acapella.vm.wait_transaction(tr_id, deadline=deadline)
+        self.assertEqual(0, self.server.request_count(r'/wait$'))
+
+    def test_missing_fragment(self):
+        snapshot = self.upload_snapshot()
+        tr_id = self.acapella.vm.call(snapshot.owner, snapshot.name, snapshot.tag, "test/missing.py").transaction_id
+        status = self.acapella.vm.wait_transaction(tr_id)
+        self.assertEqual(status.state, TransactionState.ERROR.value)
+
+
+class StartManyTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCpvmServer(run_sec=0.3).start()
+        self.acapella = AcapellaApi(self.server.address)
+        self.acapella.auth.login('test', 'secret')
+        snapshot = self.acapella.codebase.create_snapshot('test-snapshot').snapshot
+        self.acapella.codebase.upload(snapshot.name, snapshot.tag, path='hello.py',
+                                      code='print("Hello World!")', exec_types=[ExecutorType.CPYTHON])
+        self.acapella.codebase.freeze_snapshot(snapshot.name, snapshot.tag)
+        self.prefix = f'{snapshot.owner}/{snapshot.name}/{snapshot.tag}:'
+
+    def tearDown(self):
+        self.acapella.close()
+        self.server.stop()
+
+    def params(self, path: str) -> TransactionParameters:
+        return TransactionParameters(fragment=self.prefix + path)
+
+    def test_results_in_completion_order(self):
+        # транзакции с отсутствующим фрагментом завершаются ошибкой сразу, остальные - через `run_sec`
+        paths = ['hello.py', 'missing.py', 'hello.py', 'missing.py']
+        results = list(self.acapella.vm.start_many([self.params(p) for p in paths], max_in_flight=4))
+
+        self.assertEqual(['missing.py', 'missing.py', 'hello.py', 'hello.py'],
+                         [r.params.fragment[len(self.prefix):] for r in results])
+        self.assertEqual([TransactionState.ERROR.value] * 2 + [TransactionState.FINISHED.value] * 2,
+                         [r.status.state for r in results])
+        self.assertTrue(all(r.error is None and r.transaction_id for r in results))
+
+    def test_max_in_flight(self):
+        started = time.monotonic()
+        results = list(self.acapella.vm.start_many((self.params('hello.py') for _ in range(6)), max_in_flight=2))
+        self.assertEqual([TransactionState.FINISHED.value] * 6, [r.status.state for r in results])
+        # 6 транзакций по 0.3 с, не больше двух одновременно
+        self.assertGreaterEqual(time.monotonic() - started, 0.9)
+
+        # сколько транзакций исполнялось на сервере в момент запуска каждой
+        starts = sorted(tr.started for tr in self.server.transactions.values())
+        running = [sum(1 for s in starts if s <= t < s + self.server.run_sec) for t in starts]
+        self.assertEqual(2, max(running))
+
+    def test_early_break(self):
+        self.server.run_sec = 10
+        paths = ['missing.py', 'hello.py', 'hello.py', 'hello.py', 'hello.py']
+        results = self.acapella.vm.start_many((self.params(p) for p in paths), max_in_flight=3)
+
+        started = time.monotonic()
+        first = next(results)
+        results.close()
+        # выход из цикла не ждёт ни исполняющихся транзакций, ни их long-poll запросов
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(TransactionState.ERROR.value, first.status.state)
+        # оставшиеся параметры не запускались; запуски в работе могли не дойти до сервера до отмены
+        self.assertLessEqual(self.server.request_count(r'^POST /vm/start$'), 3)
+
+        # ожидания в работе замечают отмену не позже `cancel_poll_slice_sec`
+        deadline = time.monotonic() + self.acapella.vm.cancel_poll_slice_sec + 1.0
+        while time.monotonic() < deadline and any(t.name.startswith('ThreadPoolExecutor') for t in threading.enumerate()):
+            time.sleep(0.05)
+        self.assertFalse(any(t.name.startswith('ThreadPoolExecutor') for t in threading.enumerate()))
 
 
 if __name__ == '__main__':